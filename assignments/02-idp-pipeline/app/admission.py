@@ -0,0 +1,142 @@
+import os
+import math
+import time
+from typing import Any, Dict, Optional
+
+from redis import Redis
+from rq import Queue, Worker
+
+# ----------------------------
+# Admission control（POST /v1/jobs 的入口保護）
+#   1) queue depth 上限：排隊太長直接 429，避免塞出好幾小時的 backlog
+#   2) per-client token bucket：單一 client 的送件速率
+# ----------------------------
+MAX_QUEUE_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "500"))  # 0 = 不限制
+RATE_PER_SEC = float(os.getenv("ADMISSION_RATE_PER_SEC", "2"))        # 0 = 不限制
+BURST = int(os.getenv("ADMISSION_BURST", "20"))
+THROUGHPUT_WINDOW_SEC = int(os.getenv("ADMISSION_THROUGHPUT_WINDOW_SEC", "300"))
+# 還沒有完成紀錄時，用來估算 time-to-start 的單一 job 秒數
+DEFAULT_JOB_SEC = float(os.getenv("ADMISSION_DEFAULT_JOB_SEC", "10"))
+
+DONE_KEY = "jobs:done"  # sorted set：member=job_id, score=完成時間
+
+# now 用 Redis TIME，避免多個 API replica 時鐘不同步
+_TOKEN_BUCKET_LUA = """
+local key = KEYS[1]
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  wait = (cost - tokens) / rate
+end
+redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+_scripts: Dict[int, Any] = {}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after_sec: float, info: Optional[Dict[str, Any]] = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after_sec = max(1, int(math.ceil(retry_after_sec)))
+        self.info = info or {}
+
+
+def _token_bucket(r: Redis):
+    script = _scripts.get(id(r))
+    if script is None:
+        script = _scripts[id(r)] = r.register_script(_TOKEN_BUCKET_LUA)
+    return script
+
+
+def take_token(r: Redis, client_id: str, cost: float = 1.0) -> float:
+    """
+    Returns 0 if admitted, else seconds until enough tokens are available.
+    """
+    if RATE_PER_SEC <= 0:
+        return 0.0
+    allowed, wait = _token_bucket(r)(
+        keys=[f"ratelimit:jobs:{client_id}"],
+        args=[RATE_PER_SEC, BURST, cost],
+    )
+    return 0.0 if int(allowed) == 1 else float(wait)
+
+
+def record_completion(r: Redis, job_id: Optional[str]):
+    """
+    Called by the worker when a job finishes or fails (throughput estimate).
+    """
+    if not job_id:
+        return
+    now = time.time()
+    pipe = r.pipeline(transaction=False)
+    pipe.zadd(DONE_KEY, {job_id: now})
+    pipe.zremrangebyscore(DONE_KEY, "-inf", now - THROUGHPUT_WINDOW_SEC)
+    pipe.execute()
+
+
+def throughput_per_sec(r: Redis) -> Optional[float]:
+    now = time.time()
+    n = r.zcount(DONE_KEY, now - THROUGHPUT_WINDOW_SEC, now)
+    if not n:
+        return None
+    return n / float(THROUGHPUT_WINDOW_SEC)
+
+
+def estimate_start_sec(r: Redis, q: Queue, depth: Optional[int] = None) -> float:
+    """
+    Time until a job enqueued now would start: depth / recent throughput.
+    Falls back to DEFAULT_JOB_SEC per job spread over the live workers.
+    """
+    depth = q.count if depth is None else depth
+    if depth <= 0:
+        return 0.0
+    tput = throughput_per_sec(r)
+    if tput:
+        return depth / tput
+    workers = max(1, Worker.count(queue=q))
+    return depth * DEFAULT_JOB_SEC / workers
+
+
+def check_admission(r: Redis, q: Queue, client_id: str, *, rate_limit: bool = True) -> Dict[str, Any]:
+    """
+    Raises AdmissionRejected (-> HTTP 429 + Retry-After). Returns queue info when admitted.
+    rate_limit=False only checks queue depth (the client's token was already taken earlier in the request).
+    """
+    depth = q.count
+    if MAX_QUEUE_DEPTH > 0 and depth >= MAX_QUEUE_DEPTH:
+        # 要等多久才會降到上限以下
+        over = depth - MAX_QUEUE_DEPTH + 1
+        retry = estimate_start_sec(r, q, depth=over)
+        raise AdmissionRejected(
+            "queue is full",
+            retry,
+            {"queue": q.name, "queue_depth": depth, "max_queue_depth": MAX_QUEUE_DEPTH},
+        )
+
+    wait = take_token(r, client_id) if rate_limit else 0.0
+    if wait > 0:
+        raise AdmissionRejected(
+            "rate limit exceeded",
+            wait,
+            {"client_id": client_id, "rate_per_sec": RATE_PER_SEC, "burst": BURST},
+        )
+
+    return {
+        "queue_depth": depth,
+        "estimated_start_sec": round(estimate_start_sec(r, q, depth=depth), 1),
+    }
@@ -0,0 +1,145 @@
+import os
+import re
+import tempfile
+from hashlib import sha256
+from typing import Iterable, Optional, Tuple
+
+# Content-addressed local blob store (shared volume between api / worker)
+#   <BLOB_DIR>/<key[:2]>/<key>   key = sha256 hex of the content
+BLOB_DIR = os.getenv("BLOB_DIR", "/app/data/blobs")
+
+_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+class BlobNotFound(KeyError):
+    pass
+
+class BlobTooLarge(ValueError):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"blob exceeds {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+def _check_key(key: str) -> str:
+    if not isinstance(key, str) or not _KEY_RE.match(key):
+        raise ValueError(f"invalid blob key: {key!r}")
+    return key
+
+def blob_path(key: str, blob_dir: Optional[str] = None) -> str:
+    key = _check_key(key)
+    return os.path.join(blob_dir or BLOB_DIR, key[:2], key)
+
+def _commit_tmp(tmp_path: str, key: str, blob_dir: Optional[str] = None) -> str:
+    """
+    Move a fully written temp file to its content address (atomic rename).
+    Same content -> same path, so a concurrent writer of identical bytes is harmless.
+    """
+    dst = blob_path(key, blob_dir)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.exists(dst):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, dst)
+    return dst
+
+def put_bytes(data: bytes, blob_dir: Optional[str] = None) -> str:
+    key = sha256(data).hexdigest()
+    if os.path.exists(blob_path(key, blob_dir)):
+        return key
+
+    root = blob_dir or BLOB_DIR
+    os.makedirs(root, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=root, prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    _commit_tmp(tmp, key, blob_dir)
+    return key
+
+class BlobWriter:
+    """
+    Streaming put：chunk 直接寫進 BLOB_DIR 底下的 temp file，同時累加 sha256，
+    commit() 才知道 key 並 rename 到 content address；記憶體只留當下那個 chunk。
+
+    超過 max_bytes 時 write() 丟 BlobTooLarge 並刪掉 temp file。
+    with 區塊內沒 commit（或有 exception）會自動 abort。
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, blob_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.blob_dir = blob_dir
+        self.size = 0
+        self.key: Optional[str] = None
+        self._hash = sha256()
+        root = blob_dir or BLOB_DIR
+        os.makedirs(root, exist_ok=True)
+        fd, self._tmp = tempfile.mkstemp(dir=root, prefix=".tmp-")
+        self._f = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes) -> None:
+        if self._tmp is None:
+            raise ValueError("BlobWriter already committed / aborted")
+        if not data:
+            return
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self.abort()
+            raise BlobTooLarge(self.max_bytes)
+        self._hash.update(data)
+        self._f.write(data)
+
+    def commit(self) -> str:
+        if self._tmp is None:
+            raise ValueError("BlobWriter already committed / aborted")
+        self._f.close()
+        self.key = self._hash.hexdigest()
+        _commit_tmp(self._tmp, self.key, self.blob_dir)
+        self._tmp = None
+        return self.key
+
+    def abort(self) -> None:
+        if self._tmp is None:
+            return
+        self._f.close()
+        try:
+            os.remove(self._tmp)
+        except FileNotFoundError:
+            pass
+        self._tmp = None
+
+    def __enter__(self) -> "BlobWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.abort()
+
+def put_stream(
+    chunks: Iterable[bytes], max_bytes: Optional[int] = None, blob_dir: Optional[str] = None
+) -> Tuple[str, int]:
+    """Iterable of byte chunks -> (key, size)；超過 max_bytes 丟 BlobTooLarge（不留檔）。"""
+    with BlobWriter(max_bytes=max_bytes, blob_dir=blob_dir) as w:
+        for chunk in chunks:
+            w.write(chunk)
+        return w.commit(), w.size
+
+def get_bytes(key: str, blob_dir: Optional[str] = None) -> bytes:
+    path = blob_path(key, blob_dir)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError as e:
+        raise BlobNotFound(key) from e
+
+def resolve_path(key: str, blob_dir: Optional[str] = None) -> str:
+    """blob key -> 本機路徑（api / worker 共用 ./data volume）；不存在丟 BlobNotFound。"""
+    path = blob_path(key, blob_dir)
+    if not os.path.exists(path):
+        raise BlobNotFound(key)
+    return path
+
+def exists(key: str, blob_dir: Optional[str] = None) -> bool:
+    return os.path.exists(blob_path(key, blob_dir))
+
+def delete(key: str, blob_dir: Optional[str] = None) -> bool:
+    try:
+        os.remove(blob_path(key, blob_dir))
+        return True
+    except FileNotFoundError:
+        return False
@@ -1,10 +1,187 @@
-from docling.document_converter import DocumentConverter
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
-def run_docling(file_path: str):
-    converter = DocumentConverter()
-    doc = converter.convert(file_path)
+from docling.datamodel.base_models import ConversionStatus, InputFormat
+from docling.datamodel.pipeline_options import PdfPipelineOptions
+from docling.datamodel.settings import settings as docling_settings
+from docling.document_converter import DocumentConverter, PdfFormatOption
 
+try:  # docling >= 2.30 搬到 accelerator_options
+    from docling.datamodel.accelerator_options import AcceleratorDevice, AcceleratorOptions
+except ImportError:  # pragma: no cover
+    from docling.datamodel.pipeline_options import AcceleratorDevice, AcceleratorOptions
+
+# ----------------------------
+# Warm DocumentConverter pool
+#   每個 process 每組 options 只建一次 converter（layout / table model 載入要數秒）
+#   DOCLING_THREADS：每個 converter 的 CPU threads（預設 = min(4, 核心數)）
+#   DOCLING_POOL_SIZE：convert_many 的 process 數（預設 = 核心數 / DOCLING_THREADS）
+#   DOCLING_WARM_OPTIONS：除了預設組之外要 warm 的 options（見 _parse_warm_options）
+# ----------------------------
+_CPU_COUNT = os.cpu_count() or 1
+DOCLING_THREADS = int(os.getenv("DOCLING_THREADS", "0")) or min(4, _CPU_COUNT)
+DOCLING_POOL_SIZE = int(os.getenv("DOCLING_POOL_SIZE", "0")) or max(1, _CPU_COUNT // max(1, DOCLING_THREADS))
+DOCLING_DEVICE = os.getenv("DOCLING_DEVICE", "cpu").strip().lower()
+# stage 級耗時（layout / table_structure / ocr ...）放進結果的 timings.stages
+DOCLING_PROFILE = os.getenv("DOCLING_PROFILE", "0") == "1"
+
+if DOCLING_PROFILE:
+    docling_settings.debug.profile_pipeline_timings = True
+
+# options -> converter；不以 pid 區分：worker 在 fork 前 warm()，work-horse 直接繼承（copy-on-write）
+_converters: Dict[Tuple[bool, bool], DocumentConverter] = {}
+_lock = threading.Lock()
+
+def _key(options: Optional[Dict[str, Any]]) -> Tuple[bool, bool]:
+    """
+    options（每個 request 可不同；只需要文字時關掉昂貴功能）：
+      ocr:             Docling 內建 OCR（掃描頁才需要；純文字層 PDF 可關）
+      table_structure: 表格結構模型（TableFormer）
+    """
+    options = options or {}
+    return bool(options.get("ocr", True)), bool(options.get("table_structure", True))
+
+def _build(do_ocr: bool, do_table_structure: bool) -> DocumentConverter:
+    pipeline_options = PdfPipelineOptions(do_ocr=do_ocr, do_table_structure=do_table_structure)
+    pipeline_options.accelerator_options = AcceleratorOptions(
+        num_threads=DOCLING_THREADS, device=AcceleratorDevice(DOCLING_DEVICE)
+    )
+    converter = DocumentConverter(
+        format_options={InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)}
+    )
+    converter.initialize_pipeline(InputFormat.PDF)  # 先載 model，第一份文件不用等
+    return converter
+
+def get_converter(options: Optional[Dict[str, Any]] = None) -> DocumentConverter:
+    key = _key(options)
+    conv = _converters.get(key)
+    if conv is not None:
+        return conv
+    with _lock:
+        if key not in _converters:
+            _converters[key] = _build(*key)
+        return _converters[key]
+
+def all_options() -> List[Dict[str, Any]]:
+    """API 接受的每一組 options（ocr × table_structure = 4 組），預設組（全開）在前"""
+    return [{"ocr": o, "table_structure": t} for o, t in product((True, False), repeat=2)]
+
+def _parse_warm_options(raw: str) -> List[Dict[str, Any]]:
+    """
+    DOCLING_WARM_OPTIONS：以 ; 分隔多組，每組 key=0/1 以 , 分隔；"all" = 全部 4 組
+      例："ocr=0,table_structure=0;ocr=0"
+    """
+    raw = raw.strip()
+    if raw.lower() == "all":
+        return all_options()
+    out = []
+    for combo in filter(None, (c.strip() for c in raw.split(";"))):
+        opt = {}
+        for pair in filter(None, (p.strip() for p in combo.split(","))):
+            k, _, v = pair.partition("=")
+            opt[k.strip()] = v.strip().lower() not in ("0", "false", "no", "off")
+        out.append(opt)
+    return out
+
+DOCLING_WARM_OPTIONS = _parse_warm_options(os.getenv("DOCLING_WARM_OPTIONS", ""))
+
+def warm(*options: Dict[str, Any]) -> None:
+    """
+    預先建立 converter（RQ worker 在 fork work-horse 之前呼叫）。
+    不指定 = 預設組 + DOCLING_WARM_OPTIONS；每組各自載入 model（全部 4 組約 4 倍記憶體），
+    沒 warm 的組合在 work-horse 裡第一次用到時才建（該 job 多付一次 model 載入）。
+    """
+    for opt in options or ({}, *DOCLING_WARM_OPTIONS):
+        get_converter(opt)
+
+def _stage_timings(result) -> Dict[str, float]:
+    out = {}
+    for name, item in (getattr(result, "timings", None) or {}).items():
+        times = getattr(item, "times", None) or []
+        out[name] = round(sum(times) * 1000, 2)
+    return out
+
+def run_docling(file_path: str, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    一份文件 -> {"content"（markdown）, "text", "pages": [{"page", "text"}], "timings", ...}
+    text = 各頁 markdown 以換行接起來（與 streaming pipeline 逐頁接起來的結果相同）
+    """
+    do_ocr, do_table_structure = _key(options)
+    t0 = time.perf_counter()
+    converter = get_converter(options)
+    t1 = time.perf_counter()
+    result = converter.convert(file_path, raises_on_error=False)
+    t2 = time.perf_counter()
+
+    doc = result.document
+    ok = result.status in (ConversionStatus.SUCCESS, ConversionStatus.PARTIAL_SUCCESS)
+    pages = []
+    if ok and doc is not None:
+        for page_no in sorted(doc.pages):
+            pages.append({"page": page_no, "text": doc.export_to_markdown(page_no=page_no)})
+    t3 = time.perf_counter()
+
+    text = "\n".join(p["text"] for p in pages)
     return {
         "engine": "docling",
-        "content": doc.export_to_markdown(),
-    }
\ No newline at end of file
+        "pdf_path": file_path,
+        "ok": ok,
+        "status": str(getattr(result.status, "value", result.status)),
+        "errors": [str(getattr(e, "error_message", e)) for e in (result.errors or [])],
+        "content": text,
+        "text": text,
+        "pages": pages,
+        "tables": len(getattr(doc, "tables", None) or []) if doc is not None else 0,
+        "options": {"ocr": do_ocr, "table_structure": do_table_structure},
+        "timings": {
+            "converter_ms": round((t1 - t0) * 1000, 2),  # ~0 = warm
+            "convert_ms": round((t2 - t1) * 1000, 2),
+            "export_ms": round((t3 - t2) * 1000, 2),
+            "pages": len(pages),
+            "ms_per_page": round((t2 - t1) * 1000 / len(pages), 2) if pages else None,
+            "stages": _stage_timings(result) if DOCLING_PROFILE else None,
+        },
+        "worker_pid": os.getpid(),
+    }
+
+# ----------------------------
+# Batch：一個 process pool，每個 process 一個 warm converter（大小依核心數）
+#   RQ worker 的每個 job 只轉一份檔；批次 / 離線轉檔（不經 queue）用這裡
+# ----------------------------
+def _pool_init(options: Optional[Dict[str, Any]]) -> None:
+    warm(options or {})
+
+def _convert_safe(path: str, options: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    try:
+        return run_docling(path, options)
+    except Exception as e:
+        return {"engine": "docling", "pdf_path": path, "ok": False, "errors": [str(e)], "worker_pid": os.getpid()}
+
+def convert_many(
+    paths: Iterable[str],
+    options: Optional[Dict[str, Any]] = None,
+    *,
+    processes: int = DOCLING_POOL_SIZE,
+) -> Iterator[Dict[str, Any]]:
+    """
+    文件 queue（任意 iterable / generator）-> 依輸入順序 yield 每份結果（含 timings、worker_pid）。
+    最多 2 × processes 份在處理中，不會一次把整個 queue 送進 pool。
+    """
+    if processes <= 1:
+        for path in paths:
+            yield _convert_safe(path, options)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_pool_init, initargs=(options,)) as pool:
+        inflight: deque = deque()
+        for path in paths:
+            inflight.append(pool.submit(_convert_safe, path, options))
+            if len(inflight) >= 2 * processes:
+                yield inflight.popleft().result()
+        while inflight:
+            yield inflight.popleft().result()
@@ -1,18 +1,286 @@
+import io
+import json
+import os
+import tempfile
+import threading
+from hashlib import sha256
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import cv2
 import easyocr
+import numpy as np
+from PIL import Image  # easyocr 的依賴，一定有
+
+# ----------------------------
+# Batched + cached EasyOCR
+#   preprocess（灰階、依來源 DPI 降到 target DPI）→ 依內容 hash 查 cache → 沒中的一次丟進 readtext_batched
+# ----------------------------
+OCR_LANGS = [x.strip() for x in os.getenv("OCR_LANGS", "en,ch_tra").split(",") if x.strip()]
+OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", "200"))
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2560"))      # = EasyOCR detector 預設 canvas_size
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "8"))     # 每次 readtext_batched 的圖片 / 頁數
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", "/app/data/ocr_cache").strip()  # 空字串 = 不 cache
+OCR_GPU = os.getenv("OCR_GPU", "auto").strip().lower()
+
+# preprocessing / engine 參數變了，舊 cache 就不能用（來源 DPI 是每張圖各自的，放在 content hash）
+_CACHE_VERSION = f"v2:{','.join(OCR_LANGS)}:{OCR_TARGET_DPI}:{OCR_MAX_SIDE}"
+
+ImageInput = Union[str, bytes, np.ndarray]
 
 _reader = None
+_reader_pid: Optional[int] = None
+_reader_lock = threading.Lock()
 
 def get_reader():
-    global _reader
-    if _reader is None:
-        _reader = easyocr.Reader(['en', 'ch_tra'])
+    """One Reader per process (model load is seconds); keyed by pid like the other clients."""
+    global _reader, _reader_pid
+    pid = os.getpid()
+    if _reader is not None and _reader_pid == pid:
+        return _reader
+    with _reader_lock:
+        if _reader is None or _reader_pid != pid:
+            gpu = True if OCR_GPU == "auto" else OCR_GPU in ("1", "true", "yes")
+            _reader = easyocr.Reader(OCR_LANGS, gpu=gpu)
+            _reader_pid = pid
     return _reader
 
-def run_easyocr(image_path: str):
-    reader = get_reader()
-    results = reader.readtext(image_path)
-    texts = [r[1] for r in results]
+# ----------------------------
+# preprocessing
+# ----------------------------
+def _scale_for(h: int, w: int, source_dpi: Optional[int]) -> float:
+    # 只縮不放大：DPI 過高 / 邊長超過 detector canvas 都是白算
+    # 來源 DPI 不知道就只限制最長邊（猜錯會把低解析度的圖再縮小，小字直接認不出來）
+    scale = min(1.0, OCR_MAX_SIDE / max(h, w, 1))
+    if source_dpi:
+        scale = min(scale, OCR_TARGET_DPI / source_dpi)
+    return scale
+
+def preprocess(img: np.ndarray, source_dpi: Optional[int] = None) -> Tuple[np.ndarray, float]:
+    """BGR/BGRA/gray ndarray -> (gray uint8, scale)；box 座標除以 scale 即回到原圖座標"""
+    if img.ndim == 3 and img.shape[2] == 1:
+        img = img[:, :, 0]
+    if img.ndim == 3:
+        code = cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        img = cv2.cvtColor(img, code)
+    scale = _scale_for(img.shape[0], img.shape[1], source_dpi)
+    if scale < 1.0:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(img), scale
+
+_EXIF_X_RESOLUTION = 282
+_EXIF_RESOLUTION_UNIT = 296  # 2 = inch, 3 = cm
+
+def image_dpi(data: bytes) -> Optional[int]:
+    """
+    圖檔 metadata 裡的 DPI（PNG pHYs / JPEG JFIF / TIFF，其次 EXIF XResolution）；沒有或不合理 -> None。
+    JFIF 只記長寬比（unit=0）時 Pillow 不給 dpi；72 是很多軟體不管實際解析度都寫的預設值，一樣當成不知道。
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            dpi = im.info.get("dpi")
+            if dpi:
+                dpi = float(dpi[0])
+            else:
+                exif = im.getexif()
+                x = exif.get(_EXIF_X_RESOLUTION)
+                unit = exif.get(_EXIF_RESOLUTION_UNIT, 2)
+                dpi = float(x) * (2.54 if unit == 3 else 1.0) if x and unit in (2, 3) else None
+    except Exception:
+        return None
+    if not dpi or dpi <= 72:
+        return None
+    return int(round(dpi))
+
+def _load(item: ImageInput, source_dpi: Optional[int] = None) -> Tuple[np.ndarray, str, Optional[int]]:
+    """
+    -> (ndarray, content hash, source DPI)；檔案 / bytes 以原始位元組 hash，DPI 讀 metadata；
+    ndarray 以像素 hash，DPI 只能由呼叫端給。有指定 source_dpi 就以它為準。
+    同一張圖、不同來源 DPI 的縮放不同 -> DPI 也放進 content hash（不同 cache entry）
+    """
+    if isinstance(item, np.ndarray):
+        h = sha256(str(item.shape).encode() + item.tobytes()).hexdigest()
+        return item, f"{h}:dpi{source_dpi or 0}", source_dpi
+    data = item
+    if isinstance(item, str):
+        with open(item, "rb") as f:
+            data = f.read()
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ValueError(f"cannot decode image: {item if isinstance(item, str) else '<bytes>'}")
+    dpi = source_dpi or image_dpi(data)
+    return img, f"{sha256(data).hexdigest()}:dpi{dpi or 0}", dpi
+
+# ----------------------------
+# cache（<OCR_CACHE_DIR>/<key[:2]>/<key>.json）
+# ----------------------------
+def _cache_key(content_hash: str) -> str:
+    return sha256(f"{_CACHE_VERSION}:{content_hash}".encode()).hexdigest()
+
+def _cache_path(key: str) -> str:
+    return os.path.join(OCR_CACHE_DIR, key[:2], f"{key}.json")
+
+def _cache_get(key: str) -> Optional[Dict[str, Any]]:
+    if not OCR_CACHE_DIR:
+        return None
+    try:
+        with open(_cache_path(key), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _cache_put(key: str, page: Dict[str, Any]) -> None:
+    if not OCR_CACHE_DIR:
+        return
+    dst = _cache_path(key)
+    try:
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(page, f, ensure_ascii=False)
+        os.replace(tmp, dst)
+    except OSError:
+        pass  # cache 只是加速，寫不進去不影響結果
+
+# ----------------------------
+# OCR
+# ----------------------------
+def _pad_to(img: np.ndarray, h: int, w: int) -> np.ndarray:
+    # readtext_batched 要求同尺寸：右 / 下補白（不縮放，box 座標不變）
+    if img.shape[0] == h and img.shape[1] == w:
+        return img
+    return cv2.copyMakeBorder(img, 0, h - img.shape[0], 0, w - img.shape[1], cv2.BORDER_CONSTANT, value=255)
+
+def _to_page(results, scale: float, size: Tuple[int, int]) -> Dict[str, Any]:
+    blocks = []
+    for box, text, conf in results:
+        blocks.append(
+            {
+                "text": text,
+                "conf": round(float(conf), 4),
+                # 4 個角點，換回原圖座標
+                "box": [[round(float(x) / scale, 1), round(float(y) / scale, 1)] for x, y in box],
+            }
+        )
+    return {
+        "text": "\n".join(b["text"] for b in blocks),
+        "blocks": blocks,
+        "width": size[1],
+        "height": size[0],
+    }
+
+def _ocr_batch(images: List[np.ndarray]) -> List[Any]:
+    h = max(im.shape[0] for im in images)
+    w = max(im.shape[1] for im in images)
+    return get_reader().readtext_batched([_pad_to(im, h, w) for im in images], batch_size=OCR_BATCH_SIZE)
+
+def ocr_arrays(items: Sequence[Tuple[np.ndarray, str, Optional[int]]]) -> List[Dict[str, Any]]:
+    """
+    items: [(image ndarray, content hash, source DPI or None)] -> 每張一個 page dict
+    cache 命中的直接回傳；其餘 preprocess 後依尺寸排序、每 OCR_BATCH_SIZE 張一次 readtext_batched
+    （尺寸相近的放同一批，補白最少）。
+    """
+    pages: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    todo: List[Tuple[int, str, np.ndarray, float, Tuple[int, int]]] = []
+    for i, (img, content_hash, source_dpi) in enumerate(items):
+        key = _cache_key(content_hash)
+        hit = _cache_get(key)
+        if hit is not None:
+            pages[i] = {**hit, "cached": True}
+            continue
+        gray, scale = preprocess(img, source_dpi)
+        todo.append((i, key, gray, scale, img.shape[:2]))
+
+    todo.sort(key=lambda t: t[2].shape)
+    for start in range(0, len(todo), OCR_BATCH_SIZE):
+        batch = todo[start : start + OCR_BATCH_SIZE]
+        for (i, key, _, scale, size), results in zip(batch, _ocr_batch([t[2] for t in batch])):
+            page = _to_page(results, scale, size)
+            _cache_put(key, page)
+            pages[i] = {**page, "cached": False}
+    return pages
+
+def _result(pages: List[Dict[str, Any]], **extra) -> Dict[str, Any]:
+    for n, p in enumerate(pages):
+        p["page"] = n
+    text = "\n\n".join(p["text"] for p in pages)
     return {
         "engine": "easyocr",
-        "text_blocks": texts,
-    }
\ No newline at end of file
+        "pages": pages,
+        "text": text,
+        "extracted_text": text,
+        # 舊欄位（只有文字）
+        "text_blocks": [b["text"] for p in pages for b in p["blocks"]],
+        "cache_hits": sum(1 for p in pages if p.get("cached")),
+        **extra,
+    }
+
+def run_easyocr_images(images: Sequence[ImageInput], source_dpi: Optional[int] = None) -> Dict[str, Any]:
+    """
+    多張圖片（路徑 / bytes / ndarray）一起 OCR；回傳格式同 run_easyocr_pdf（pages[i] 對應 images[i]）
+    source_dpi=None：每張圖讀自己的 metadata，沒有就只限制最長邊
+    """
+    return _result(ocr_arrays([_load(x, source_dpi) for x in images]))
+
+def run_easyocr(image_path: str):
+    return {**run_easyocr_images([image_path]), "image_path": image_path}
+
+# ----------------------------
+# scanned PDF：pypdfium2 直接以 target DPI 灰階 render（不先 render 成高解析度再縮）
+# ----------------------------
+def _file_hash(path: str) -> str:
+    h = sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _iter_pdf_pages(
+    path: str, dpi: int, file_hash: str
+) -> Iterator[Tuple[Optional[np.ndarray], str, Optional[Dict[str, Any]]]]:
+    """-> (gray ndarray, content hash, cached page)；cache 命中的頁不 render（ndarray 為 None）"""
+    try:
+        import pypdfium2 as pdfium
+    except ImportError as e:
+        raise RuntimeError("scanned PDF OCR needs pypdfium2: pip install pypdfium2") from e
+
+    pdf = pdfium.PdfDocument(path)
+    try:
+        for i in range(len(pdf)):
+            # render DPI 不同，輸入影像就不同：dpi 放進 content hash
+            content_hash = f"{file_hash}:p{i}:{dpi}"
+            hit = _cache_get(_cache_key(content_hash))
+            if hit is not None:
+                yield None, content_hash, hit
+                continue
+            page = pdf[i]
+            w_pt, h_pt = page.get_size()
+            scale = min(dpi / 72.0, OCR_MAX_SIDE / max(w_pt, h_pt, 1))
+            bitmap = page.render(scale=scale, grayscale=True)
+            yield np.ascontiguousarray(bitmap.to_numpy()), content_hash, None
+            page.close()
+    finally:
+        pdf.close()
+
+def run_easyocr_pdf(pdf_path: str, dpi: int = OCR_TARGET_DPI) -> Dict[str, Any]:
+    """
+    掃描 PDF：一次只 render OCR_BATCH_SIZE 頁（記憶體不隨頁數成長），每批一次 readtext_batched。
+    頁面直接以 dpi render，不再二次縮放；box 座標為該 DPI 下的像素座標。cache 依 dpi 分開。
+    """
+    pages: List[Dict[str, Any]] = []
+    pending: List[Tuple[np.ndarray, str, Optional[int]]] = []
+
+    def flush():
+        pages.extend(ocr_arrays(pending))
+        pending.clear()
+
+    for img, content_hash, hit in _iter_pdf_pages(pdf_path, dpi, _file_hash(pdf_path)):
+        if hit is not None:
+            flush()  # 保持頁序
+            pages.append({**hit, "cached": True})
+            continue
+        # 已依呼叫端要的 dpi render：不再依 DPI 縮（source_dpi=None），preprocess 只做灰階 / max side
+        pending.append((img, content_hash, None))
+        if len(pending) >= OCR_BATCH_SIZE:
+            flush()
+    flush()
+    return {**_result(pages), "pdf_path": pdf_path, "dpi": dpi}
@@ -1,17 +1,110 @@
 # app/clients/embedding_client.py (示意)
+import os
+import threading
+from typing import Any, Dict, Optional
+
 from sentence_transformers import SentenceTransformer
+import numpy as np
 import torch
 
+# Embedding backend（同一個 all-MiniLM-L6-v2，向量與既有 index 相容）：
+#   EMBED_BACKEND=torch      PyTorch（預設）
+#   EMBED_BACKEND=onnx       ONNX Runtime fp32（需 optimum[onnxruntime]、sentence-transformers>=3.2）
+#   EMBED_BACKEND=onnx-int8  ONNX Runtime + dynamic int8 quantization（CPU 最快，向量有極小誤差）
+# EMBED_THREADS：CPU intra-op threads（0 = library 預設，通常 = 核心數）
+# EMBED_ONNX_FILE：覆寫 onnx 檔名（例如 onnx/model_qint8_avx512_vnni.onnx）
+EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch").strip().lower()
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))
+EMBED_ONNX_FILE = os.getenv("EMBED_ONNX_FILE", "").strip()
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+
+# model repo 內已附的 onnx 檔；int8 預設 avx2 版（x86-64 CPU 都能跑）
+ONNX_FILES = {
+    "onnx": "onnx/model.onnx",
+    "onnx-int8": "onnx/model_quint8_avx2.onnx",
+}
+BACKENDS = ("torch",) + tuple(ONNX_FILES)
+
 _model = None
+_model_pid: Optional[int] = None
+_model_lock = threading.Lock()
 
-def get_embedder():
-    global _model
-    if _model is None:
+def load_embedder(backend: str = EMBED_BACKEND, threads: int = EMBED_THREADS, onnx_file: str = EMBED_ONNX_FILE):
+    """
+    Build a SentenceTransformer for the given backend (uncached; bench/ uses this to compare backends).
+    """
+    backend = (backend or "torch").strip().lower()
+    if backend == "torch":
+        if threads > 0:
+            torch.set_num_threads(threads)  # process-wide
         device = "cuda" if torch.cuda.is_available() else "cpu"
-        _model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2", device=device)
+        return SentenceTransformer(EMBED_MODEL, device=device)
+
+    if backend not in ONNX_FILES:
+        raise ValueError(f"Unknown EMBED_BACKEND: {backend} (expected one of {', '.join(BACKENDS)})")
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise RuntimeError(f"EMBED_BACKEND={backend} needs onnxruntime: pip install 'optimum[onnxruntime]'") from e
+
+    so = ort.SessionOptions()
+    if threads > 0:
+        so.intra_op_num_threads = threads
+        so.inter_op_num_threads = 1
+    return SentenceTransformer(
+        EMBED_MODEL,
+        device="cpu",
+        backend="onnx",
+        model_kwargs={
+            "file_name": onnx_file or ONNX_FILES[backend],
+            "provider": "CPUExecutionProvider",
+            "session_options": so,
+        },
+    )
+
+def fork_inheritable(backend: str = EMBED_BACKEND) -> bool:
+    """
+    fork 出來的 work-horse 能不能直接用 parent 載好的 model：
+      torch + CPU：可以。parent 只載權重、不跑 inference，child 以 copy-on-write 繼承；
+                   PyTorch 在 child 裡重建自己的 intra-op thread pool
+      onnx*：不行。InferenceSession 建立時就開好 intra-op thread pool，fork 後 thread 不存在，
+             child 第一次 run 會卡住 -> 每個 process 自己建 session
+      CUDA：CUDA context 不能跨 fork
+    """
+    return (backend or "torch").strip().lower() == "torch" and not torch.cuda.is_available()
+
+def get_embedder():
+    """
+    One model per process (EMBED_BACKEND / EMBED_THREADS).
+    When fork_inheritable(), the model loaded by the RQ worker before forking (app/worker.py)
+    is reused by every work-horse; otherwise it is keyed by pid and rebuilt after fork.
+    """
+    global _model, _model_pid
+    pid = os.getpid()
+    if _model is not None and _model_pid in (None, pid):
+        return _model
+    with _model_lock:
+        if _model is None or _model_pid not in (None, pid):
+            _model = load_embedder()
+            _model_pid = None if fork_inheritable() else pid
     return _model
 
+def embedder_info() -> Dict[str, Any]:
+    return {
+        "model": EMBED_MODEL,
+        "backend": EMBED_BACKEND,
+        "threads": EMBED_THREADS or None,
+        "onnx_file": (EMBED_ONNX_FILE or ONNX_FILES.get(EMBED_BACKEND)) if EMBED_BACKEND != "torch" else None,
+    }
+
+def encode(model, texts: list[str], batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+    vecs = model.encode(texts, batch_size=batch_size, normalize_embeddings=True, convert_to_numpy=True)
+    return vecs.astype(np.float32, copy=False)
+
+def embed_array(texts: list[str]) -> np.ndarray:
+    """(n, dim) float32，不轉成 Python list（streaming pipeline 直接把 ndarray 交給 Qdrant）"""
+    return encode(get_embedder(), texts)
+
 def embed_texts(texts: list[str]) -> list[list[float]]:
-    model = get_embedder()
-    vecs = model.encode(texts, normalize_embeddings=True, convert_to_numpy=True)
-    return vecs.tolist()
\ No newline at end of file
+    return embed_array(texts).tolist()
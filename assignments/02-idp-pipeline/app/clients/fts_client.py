@@ -1,7 +1,10 @@
 import os, re
 import sqlite3
+from hashlib import sha1
 from typing import List, Optional, Dict, Any, Tuple
 
+from app.metrics import track_outbound
+
 DEFAULT_DB_PATH = os.getenv("FTS_DB_PATH", "/app/data/fts.db")
 
 def _connect(db_path: str = DEFAULT_DB_PATH) -> sqlite3.Connection:
@@ -23,7 +26,9 @@ def init_fts(db_path: str = DEFAULT_DB_PATH) -> None:
                 chunk_index UNINDEXED,
                 source_file UNINDEXED,
                 job_id UNINDEXED,
-                content
+                content,
+                input_type UNINDEXED,
+                ingested_at UNINDEXED
             );
         """)
         conn.commit()
@@ -65,6 +70,11 @@ def upsert_chunk(
     finally:
         conn.close()
 
+def _chunk_rowid(chunk_id: str) -> int:
+    """Stable positive 63-bit rowid derived from chunk_id (re-upserting a chunk replaces its row)."""
+    return int.from_bytes(sha1(chunk_id.encode("utf-8")).digest()[:8], "big") >> 1
+
+@track_outbound("sqlite", "bulk_upsert")
 def bulk_upsert(chunks: List[Dict[str, Any]], db_path: str = DEFAULT_DB_PATH) -> int:
     """
     chunks: [{chunk_id, doc_id, pipeline_version, chunk_index, text}, ...]
@@ -74,8 +84,7 @@ def bulk_upsert(chunks: List[Dict[str, Any]], db_path: str = DEFAULT_DB_PATH) ->
 
     conn = _connect(db_path)
     try:
-        cur = conn.cursor()
-        # speed: single transaction
+        rows = []
         for c in chunks:
             text = c.get("text") or ""
             if not text:
@@ -83,10 +92,9 @@ def bulk_upsert(chunks: List[Dict[str, Any]], db_path: str = DEFAULT_DB_PATH) ->
             chunk_id = str(c.get("chunk_id") or "")
             if not chunk_id:
                 continue
-            cur.execute("DELETE FROM chunks_fts WHERE chunk_id = ?", (chunk_id,))
-            cur.execute(
-                "INSERT INTO chunks_fts(chunk_id, doc_id, pipeline_version, chunk_index, source_file, job_id, content) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows.append(
                 (
+                    _chunk_rowid(chunk_id),
                     chunk_id,
                     c.get("doc_id"),
                     c.get("pipeline_version"),
@@ -94,8 +102,23 @@ def bulk_upsert(chunks: List[Dict[str, Any]], db_path: str = DEFAULT_DB_PATH) ->
                     c.get("source_file"),
                     c.get("job_id"),
                     c.get("content"),
-                ),
+                    c.get("input_type"),
+                    c.get("ingested_at"),
+                )
             )
+
+        # same chunk_id twice in one batch -> same rowid, the second INSERT would hit a
+        # UNIQUE constraint; keep the last copy (same as upserting them one by one)
+        rows = list({r[0]: r for r in rows}.values())
+
+        # speed: single transaction; delete by rowid is a b-tree lookup
+        # (chunk_id is UNINDEXED, DELETE ... WHERE chunk_id = ? scans the whole table per row)
+        cur = conn.cursor()
+        cur.executemany("DELETE FROM chunks_fts WHERE rowid = ?", [(r[0],) for r in rows])
+        cur.executemany(
+            "INSERT INTO chunks_fts(rowid, chunk_id, doc_id, pipeline_version, chunk_index, source_file, job_id, content, input_type, ingested_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
         conn.commit()
         return len(chunks)
     finally:
@@ -116,30 +139,65 @@ def _auto_prefix(q: str) -> str:
 
     return q
 
+# payload field (same names as the Qdrant filter) -> FTS column
+_FILTER_COLUMNS = {
+    "doc_id": "doc_id",
+    "pipeline_version": "pipeline_version",
+    "input_type": "input_type",
+    "source": "source_file",
+    "job_id": "job_id",
+    "chunk_index": "chunk_index",
+    "ingested_at": "ingested_at",
+}
+_RANGE_OPS = {"gte": ">=", "lte": "<=", "gt": ">", "lt": "<"}
+
+@track_outbound("sqlite", "search")
 def search_keyword(
     query: str,
     *,
     limit: int = 50,
     doc_id: Optional[str] = None,
     pipeline_version: Optional[str] = None,
+    match: Optional[Dict[str, List[Any]]] = None,
+    ranges: Optional[Dict[str, Dict[str, float]]] = None,
     db_path: str = DEFAULT_DB_PATH,
 ) -> List[Dict[str, Any]]:
     """
     FTS5 bm25(): smaller is better, so ORDER BY score ASC.
+
+    match / ranges use the same shape as qdrant_client.build_filter, so one
+    SearchFilters is pushed down to both backends.
+    NOTE: input_type / ingested_at columns only exist after /v1/reindex/fts.
     """
     init_fts(db_path)
 
     query2 = _auto_prefix(query)
     where = ["chunks_fts MATCH ?"]
-    params = [query2]
+    params: List[Any] = [query2]
 
+    match = dict(match or {})
     if doc_id:
-        where.append("doc_id = ?")
-        params.append(doc_id)
-
+        match.setdefault("doc_id", [doc_id])
     if pipeline_version:
-        where.append("pipeline_version = ?")
-        params.append(pipeline_version)
+        match.setdefault("pipeline_version", [pipeline_version])
+
+    for field, values in match.items():
+        col = _FILTER_COLUMNS.get(field)
+        values = [v for v in (values or []) if v is not None and v != ""]
+        if not col or not values:
+            continue
+        where.append(f"{col} IN ({', '.join('?' for _ in values)})")
+        params.extend(values)
+
+    for field, bounds in (ranges or {}).items():
+        col = _FILTER_COLUMNS.get(field)
+        if not col:
+            continue
+        for op, v in (bounds or {}).items():
+            if v is None or op not in _RANGE_OPS:
+                continue
+            where.append(f"{col} {_RANGE_OPS[op]} ?")
+            params.append(v)
 
     sql = f"""
         SELECT
@@ -1,12 +1,112 @@
 import os
+import json
+import threading
+import time
 import requests
-from typing import Any, Dict, Tuple, Optional
+from typing import Any, Dict, List, Tuple, Optional, Union
 
+from app.metrics import track_outbound
+from app.tracing import inject_context
+from app.resilience import call_with_resilience, split_urls, CircuitOpenError
+from app.jsonscan import JsonObjectScanner
 
-def _post_json(url: str, payload: Dict[str, Any], timeout: int = 60) -> Dict[str, Any]:
-    r = requests.post(url, json=payload, timeout=timeout)
-    r.raise_for_status()
-    return r.json()
+# VLM_STREAM=1：用 stream=True 邊收邊掃 JSON；VLM_STREAM_CANCEL=1 時 object 一完整就斷線（server 端停止生成）
+VLM_STREAM = os.getenv("VLM_STREAM", "0") == "1"
+VLM_STREAM_CANCEL = os.getenv("VLM_STREAM_CANCEL", "1") == "1"
+
+
+def _post_json(
+    url: Union[str, List[str]],
+    payload: Dict[str, Any],
+    timeout: int = 60,
+    target: str = "http",
+    idempotent: bool = False,
+) -> Dict[str, Any]:
+    """
+    url 可以是多個 replica（第一個為 primary）；經過 circuit breaker，
+    idempotent 且 target 在 HEDGE_TARGETS 時會對 replica 做 hedged request。
+    """
+    urls = [url] if isinstance(url, str) else list(url)
+    headers = inject_context()
+
+    def _one(u: str) -> Dict[str, Any]:
+        with track_outbound(target, "chat_completions"):
+            r = requests.post(u, json=payload, timeout=timeout, headers=headers)
+            r.raise_for_status()
+            return r.json()
+
+    return call_with_resilience(target, urls, _one, idempotent=idempotent)
+
+
+def _stream_chat(
+    urls: List[str],
+    payload: Dict[str, Any],
+    timeout: int = 60,
+    target: str = "http",
+    *,
+    cancel_on_json: bool = True,
+) -> Tuple[str, Optional[Dict[str, Any]], Dict[str, Any]]:
+    """
+    OpenAI-compatible streaming (SSE "data: {...}" lines with choices[0].delta.content).
+    Deltas are fed to a JsonObjectScanner; with cancel_on_json the connection is closed
+    as soon as the first JSON object is complete (vLLM / TGI abort the request on disconnect).
+    Returns (content_so_far, json_obj_or_None, stream_meta).
+    """
+    headers = inject_context()
+    body = {**payload, "stream": True}
+    # hedge 時兩條 stream 同時在生成：先回來的那條結束後關掉其他連線（server 才會停止生成）
+    finished = threading.Event()
+    streams: List[requests.Response] = []
+
+    def _one(u: str):
+        scanner = JsonObjectScanner()
+        parts: List[str] = []
+        meta: Dict[str, Any] = {"stream": True, "cancelled": False, "ttft_ms": None, "deltas": 0}
+        t0 = time.perf_counter()
+        with track_outbound(target, "chat_completions_stream"):
+            with requests.post(u, json=body, timeout=timeout, headers=headers, stream=True) as r:
+                streams.append(r)
+                r.raise_for_status()
+                # SSE 的 Content-Type 通常沒帶 charset，requests 會當 ISO-8859-1 解碼（中文變亂碼）
+                r.encoding = "utf-8"
+                try:
+                    for line in r.iter_lines(decode_unicode=True):
+                        if finished.is_set():
+                            break  # 另一條已經回傳
+                        if not line or not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        delta = (
+                            (json.loads(data).get("choices") or [{}])[0]
+                            .get("delta", {})
+                            .get("content")
+                        )
+                        if not delta:
+                            continue
+                        if meta["ttft_ms"] is None:
+                            meta["ttft_ms"] = int((time.perf_counter() - t0) * 1000)
+                        meta["deltas"] += 1
+                        parts.append(delta)
+                        if scanner.feed(delta) is not None and cancel_on_json:
+                            # 離開 with 會關閉連線 -> server 停止生成
+                            meta["cancelled"] = True
+                            break
+                except Exception:
+                    if not finished.is_set():
+                        raise
+                    # 輸掉的 hedge：連線被另一條關掉，結果不會被用到
+                    meta["cancelled"] = True
+        meta["latency_ms"] = int((time.perf_counter() - t0) * 1000)
+        return "".join(parts), scanner.result, meta
+
+    try:
+        return call_with_resilience(target, urls, _one, idempotent=True)
+    finally:
+        finished.set()
+        for r in list(streams):
+            r.close()
 
 
 def call_ocr(text: str, timeout: int = 60) -> Tuple[Dict[str, Any], Optional[str]]:
@@ -14,11 +114,11 @@ def call_ocr(text: str, timeout: int = 60) -> Tuple[Dict[str, Any], Optional[str
     Return: (payload, error)
     payload: normalized OCR result
     """
-    url = os.getenv("OCR_API_URL", "").strip()
+    urls = split_urls(os.getenv("OCR_API_URL", ""))
     model = os.getenv("OCR_MODEL", "").strip()
     
 
-    if not url:
+    if not urls:
         return {}, "OCR_API_URL is empty"
 
     # 依你們的 OpenAI-compatible /v1/chat/completions 形式去包
@@ -32,7 +132,7 @@ def call_ocr(text: str, timeout: int = 60) -> Tuple[Dict[str, Any], Optional[str
     }
 
     try:
-        raw = _post_json(url, req, timeout=timeout)
+        raw = _post_json(urls, req, timeout=timeout, target="ocr", idempotent=True)
         # 你可以先用最保守方式抽文字（依常見格式）
         content = (
             raw.get("choices", [{}])[0]
@@ -45,15 +145,17 @@ def call_ocr(text: str, timeout: int = 60) -> Tuple[Dict[str, Any], Optional[str
             "text": content,
             "tables": [],  # 之後你再把表格解析補上
         }, None
+    except CircuitOpenError:
+        raise  # 呼叫端要分辨「沒呼叫」與「呼叫失敗」，open 時走降級而不是當成空結果
     except Exception as e:
         return {}, f"OCR call failed: {e}"
 
 
 def call_vlm(text: str, timeout: int = 60) -> Tuple[Dict[str, Any], Optional[str]]:
-    url = os.getenv("VLM_API_URL", "").strip()
+    urls = split_urls(os.getenv("VLM_API_URL", ""))
     model = os.getenv("VLM_MODEL", "").strip()
 
-    if not url:
+    if not urls:
         return {}, "VLM_API_URL is empty"
 
     req = {
@@ -66,7 +168,11 @@ def call_vlm(text: str, timeout: int = 60) -> Tuple[Dict[str, Any], Optional[str
     }
 
     try:
-        raw = _post_json(url, req, timeout=timeout)
+        if VLM_STREAM:
+            content, obj, meta = _stream_chat(urls, req, timeout=timeout, target="vlm", cancel_on_json=VLM_STREAM_CANCEL)
+            # json：stream 時已掃出的 object，normalize 不必再掃一次
+            return {"engine": "vlm-api", "raw": meta, "caption": content, "json": obj}, None
+        raw = _post_json(urls, req, timeout=timeout, target="vlm", idempotent=True)
         content = (
             raw.get("choices", [{}])[0]
             .get("message", {})
@@ -77,6 +183,8 @@ def call_vlm(text: str, timeout: int = 60) -> Tuple[Dict[str, Any], Optional[str
             "raw": raw,
             "caption": content,
         }, None
+    except CircuitOpenError:
+        raise  # 同 call_ocr
     except Exception as e:
         return {}, f"VLM call failed: {e}"
     
@@ -96,13 +204,13 @@ def call_llm(prompt: str, timeout: int = 60) -> Tuple[str, Optional[str]]:
     - 預設使用 OpenAI-compatible /v1/chat/completions
     """
     # 兼容你前面提過的 LLM_URL，也兼容與 OCR/VLM 一樣的 LLM_API_URL
-    url = (os.getenv("LLM_URL", "") or os.getenv("LLM_API_URL", "")).strip()
+    urls = split_urls(os.getenv("LLM_URL", "") or os.getenv("LLM_API_URL", ""))
     model = os.getenv("LLM_MODEL", "").strip()
 
-    if not url:
+    if not urls:
         return "", "LLM_URL (or LLM_API_URL) is empty"
 
-    url = _normalize_chat_url(url)
+    urls = [_normalize_chat_url(u) for u in urls]
 
     req = {
         "model": model or "unknown",
@@ -114,7 +222,7 @@ def call_llm(prompt: str, timeout: int = 60) -> Tuple[str, Optional[str]]:
     }
 
     try:
-        raw = _post_json(url, req, timeout=timeout)
+        raw = _post_json(urls, req, timeout=timeout, target="llm", idempotent=True)
         content = (
             raw.get("choices", [{}])[0]
             .get("message", {})
@@ -1,5 +1,8 @@
 import os, uuid
-from typing import List, Optional
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar, Union
 
 from qdrant_client import QdrantClient
 from qdrant_client.http.models import (
@@ -9,44 +12,352 @@ from qdrant_client.http.models import (
     Filter,
     FieldCondition,
     MatchValue,
+    MatchAny,
+    Range,
+    PayloadSchemaType,
+    HnswConfigDiff,
+    SearchParams,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    ProductQuantization,
+    ProductQuantizationConfig,
+    CompressionRatio,
+    SparseVectorParams,
+    SparseIndexParams,
+    SparseVector,
+    Modifier,
+    Prefetch,
+    FusionQuery,
+    Fusion,
 )
 
+from app.metrics import track_outbound, record_cache
+from app.sparse import SPARSE_VECTOR_NAME
+from app.indexing import point_vector
+
+# Collection-creation knobs (only applied when the collection is first created)
+#   QDRANT_QUANTIZATION: none | scalar | binary | product
+#   QDRANT_VECTORS_ON_DISK: keep original float32 vectors on disk (mmap), quantized copy in RAM
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "none").strip().lower()
+QDRANT_VECTORS_ON_DISK = os.getenv("QDRANT_VECTORS_ON_DISK", "0") == "1"
+QDRANT_QUANTIZATION_ALWAYS_RAM = os.getenv("QDRANT_QUANTIZATION_ALWAYS_RAM", "1") == "1"
+QDRANT_PQ_COMPRESSION = os.getenv("QDRANT_PQ_COMPRESSION", "x16").strip().lower()
+QDRANT_HNSW_M = int(os.getenv("QDRANT_HNSW_M", "0")) or None
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "0")) or None
+#   QDRANT_SPARSE: new collections also get the named sparse vector SPARSE_VECTOR_NAME (BM25, IDF on the server)
+QDRANT_SPARSE = os.getenv("QDRANT_SPARSE", "1") == "1"
+
+# Payload fields that search filters push down to Qdrant -> index schema.
+# Without these indexes a filtered search degrades to a full payload scan.
+PAYLOAD_INDEXES: Dict[str, PayloadSchemaType] = {
+    "doc_id": PayloadSchemaType.KEYWORD,
+    "pipeline_version": PayloadSchemaType.KEYWORD,
+    "input_type": PayloadSchemaType.KEYWORD,
+    "source": PayloadSchemaType.KEYWORD,
+    "job_id": PayloadSchemaType.KEYWORD,
+    "chunk_index": PayloadSchemaType.INTEGER,
+    "ingested_at": PayloadSchemaType.INTEGER,  # epoch seconds
+}
+
+# minimal payload returned by search for fusion/citations; text is hydrated later
+FUSION_PAYLOAD_FIELDS: List[str] = ["doc_id", "pipeline_version", "chunk_index"]
+
+# collections already checked by this process (skip collection_exists/get_collection per job);
+# dropped again when a write / query finds the collection missing (see forget_collection)
+_ensured_collections: set = set()
+# collection -> (has sparse vector, checked at)；False 只 cache 一段時間（collection 可能之後才被 worker 建立）
+_sparse_collections: Dict[str, Tuple[bool, float]] = {}
+SPARSE_CHECK_TTL_SEC = 60
+
+# QDRANT_PATH：embedded local mode（不需要 qdrant server；":memory:" 或資料夾）
+#   local mode 會鎖住資料夾 -> 只適合單一 process（bench / eval script），API + worker 仍用 server
+QDRANT_PATH = os.getenv("QDRANT_PATH", "").strip()
+
+_client: Optional[QdrantClient] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+
 def get_qdrant() -> QdrantClient:
-    host = os.getenv("QDRANT_HOST", "qdrant")
-    port = int(os.getenv("QDRANT_PORT", "6333"))
-    return QdrantClient(host=host, port=port)
+    """
+    One client per process so requests reuse the HTTP connection pool.
+    Keyed by pid: an RQ work-horse is forked and must not share the parent's sockets.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            if QDRANT_PATH == ":memory:":
+                _client = QdrantClient(location=":memory:")
+            elif QDRANT_PATH:
+                _client = QdrantClient(path=QDRANT_PATH)
+            else:
+                host = os.getenv("QDRANT_HOST", "qdrant")
+                port = int(os.getenv("QDRANT_PORT", "6333"))
+                _client = QdrantClient(host=host, port=port)
+            _client_pid = pid
+    return _client
+
+def build_quantization_config(
+    kind: Optional[str] = None,
+    *,
+    always_ram: bool = QDRANT_QUANTIZATION_ALWAYS_RAM,
+    pq_compression: str = QDRANT_PQ_COMPRESSION,
+):
+    """
+    kind:
+      - none    -> None (plain float32)
+      - scalar  -> int8 per-dimension (4x smaller, tiny recall loss)
+      - binary  -> 1 bit per dimension (32x smaller, needs rescoring)
+      - product -> PQ with CompressionRatio (x4..x64)
+    """
+    kind = (kind or "none").strip().lower()
+    if kind in ("", "none", "off"):
+        return None
+    if kind == "scalar":
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=always_ram)
+        )
+    if kind == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=always_ram))
+    if kind == "product":
+        return ProductQuantization(
+            product=ProductQuantizationConfig(
+                compression=CompressionRatio(pq_compression),
+                always_ram=always_ram,
+            )
+        )
+    raise ValueError(f"Unknown quantization kind: {kind}")
+
+def ensure_collection(
+    client: QdrantClient,
+    collection: str,
+    dim: int,
+    *,
+    quantization: Optional[str] = None,
+    on_disk: Optional[bool] = None,
+    hnsw_m: Optional[int] = None,
+    hnsw_ef_construct: Optional[int] = None,
+):
+    """
+    Create the collection if missing. Options default to the QDRANT_* env vars.
+    Existing collections are left untouched (quantization/HNSW changes need a re-create or update_collection),
+    except that missing payload indexes are added.
+    """
+    if collection in _ensured_collections:
+        record_cache("qdrant_collection", True)
+        return
+    record_cache("qdrant_collection", False)
 
-def ensure_collection(client: QdrantClient, collection: str, dim: int):
     exists = client.collection_exists(collection_name=collection)
     if not exists:
+        on_disk = QDRANT_VECTORS_ON_DISK if on_disk is None else on_disk
+        hnsw_m = hnsw_m or QDRANT_HNSW_M
+        hnsw_ef_construct = hnsw_ef_construct or QDRANT_HNSW_EF_CONSTRUCT
+
+        hnsw_config = None
+        if hnsw_m or hnsw_ef_construct:
+            hnsw_config = HnswConfigDiff(m=hnsw_m, ef_construct=hnsw_ef_construct)
+
         client.create_collection(
             collection_name=collection,
-            vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+            vectors_config=VectorParams(size=dim, distance=Distance.COSINE, on_disk=on_disk),
+            sparse_vectors_config=build_sparse_config() if QDRANT_SPARSE else None,
+            hnsw_config=hnsw_config,
+            quantization_config=build_quantization_config(quantization or QDRANT_QUANTIZATION),
         )
 
+    ensure_payload_indexes(client, collection)
+    collection_has_sparse(client, collection, refresh=True)
+    _ensured_collections.add(collection)
+
+def ensure_payload_indexes(
+    client: QdrantClient,
+    collection: str,
+    fields: Optional[Dict[str, PayloadSchemaType]] = None,
+) -> List[str]:
+    """
+    Create payload indexes that do not exist yet. Returns the newly created field names.
+    """
+    fields = fields or PAYLOAD_INDEXES
+    info = client.get_collection(collection_name=collection)
+    existing = set((getattr(info, "payload_schema", None) or {}).keys())
+
+    created = []
+    for name, schema in fields.items():
+        if name in existing:
+            continue
+        client.create_payload_index(
+            collection_name=collection,
+            field_name=name,
+            field_schema=schema,
+            wait=True,
+        )
+        created.append(name)
+    return created
+
+def build_sparse_config() -> Dict[str, SparseVectorParams]:
+    """
+    Sparse vectors are stored as BM25 term-frequency weights; modifier=IDF makes Qdrant apply
+    the collection-wide IDF at query time, so stored vectors never need re-weighting.
+    Existing collections cannot gain a new sparse vector: re-create + re-ingest to enable it.
+    """
+    return {SPARSE_VECTOR_NAME: SparseVectorParams(index=SparseIndexParams(on_disk=False), modifier=Modifier.IDF)}
+
+def collection_has_sparse(client: QdrantClient, collection: str, *, refresh: bool = False) -> bool:
+    """Whether the collection has the BM25 sparse vector (decides hybrid backend / what the index stage writes)."""
+    cached = _sparse_collections.get(collection)
+    if cached is not None and not refresh and (cached[0] or time.monotonic() - cached[1] < SPARSE_CHECK_TTL_SEC):
+        return cached[0]
+    try:
+        info = client.get_collection(collection_name=collection)
+        sparse = getattr(info.config.params, "sparse_vectors", None) or {}
+        has = SPARSE_VECTOR_NAME in sparse
+    except Exception:
+        has = False
+    _sparse_collections[collection] = (has, time.monotonic())
+    return has
+
+def is_missing_collection(e: Exception) -> bool:
+    """404 (REST) / NOT_FOUND (gRPC) / local mode 的 "Collection x not found" """
+    status = getattr(e, "status_code", None)
+    if status is not None:
+        return status == 404
+    code = getattr(e, "code", None)
+    if callable(code):
+        return getattr(code(), "name", "") == "NOT_FOUND"
+    return isinstance(e, ValueError) and "not found" in str(e).lower()
+
+def forget_collection(collection: str) -> None:
+    """collection 被刪掉 / 重建後清掉本 process 的 cache，下次 ensure_collection / collection_has_sparse 重新檢查"""
+    _ensured_collections.discard(collection)
+    _sparse_collections.pop(collection, None)
+
+@contextmanager
+def _forget_if_missing(collection: str):
+    try:
+        yield
+    except Exception as e:
+        if is_missing_collection(e):
+            forget_collection(collection)
+        raise
+
+T = TypeVar("T")
+
+def ensure_and_write(client: QdrantClient, collection: str, dim: int, write: Callable[[], T]) -> T:
+    """
+    ensure_collection + write()。cache 說 collection 在、其實已被刪掉時 write 會 404：
+    清掉 cache（write 裡的 upsert 已清）後重新 ensure（重建）再寫一次。
+    write 要自己呼叫 collection_has_sparse：重建後的 collection 可能和之前的設定不同。
+    """
+    ensure_collection(client, collection, dim=dim)
+    try:
+        return write()
+    except Exception as e:
+        if not is_missing_collection(e):
+            raise
+    forget_collection(collection)
+    ensure_collection(client, collection, dim=dim)
+    return write()
+
+@track_outbound("qdrant", "upsert")
 def upsert_points(
     client: QdrantClient,
     collection: str,
     points: List[PointStruct],
 ):
-    client.upsert(collection_name=collection, points=points)
+    with _forget_if_missing(collection):
+        client.upsert(collection_name=collection, points=points)
+
+@track_outbound("qdrant", "upsert")
+def upload_batch(
+    client: QdrantClient,
+    collection: str,
+    ids: List[str],
+    vectors,
+    payloads: List[Dict[str, Any]],
+    *,
+    sparse: bool = False,
+):
+    """
+    One batch of (n, dim) ndarray vectors -> upload_collection (no PointStruct list);
+    wait=True so the job result only reports points that are actually written.
+    sparse=True also writes the BM25 sparse vector computed from payload["text"].
+    """
+    if sparse:
+        vectors = [point_vector(v, p.get("text"), sparse=True) for v, p in zip(vectors.tolist(), payloads)]
+    with _forget_if_missing(collection):
+        client.upload_collection(
+            collection_name=collection,
+            vectors=vectors,
+            payload=payloads,
+            ids=ids,
+            batch_size=max(1, len(ids)),
+            wait=True,
+        )
 
 def build_filter(
     *,
     doc_id: Optional[str] = None,
     pipeline_version: Optional[str] = None,
+    match: Optional[Dict[str, List[Any]]] = None,
+    ranges: Optional[Dict[str, Dict[str, float]]] = None,
 ) -> Optional[Filter]:
-    conditions = []
+    """
+    match:  {field: [v1, v2, ...]}   -> MatchValue (1 value) / MatchAny (OR within field)
+    ranges: {field: {"gte": .., "lte": .., "gt": .., "lt": ..}}
+    All fields are AND-ed together.
+    """
+    match = dict(match or {})
     if doc_id:
-        conditions.append(FieldCondition(key="doc_id", match=MatchValue(value=doc_id)))
+        match.setdefault("doc_id", [doc_id])
     if pipeline_version:
-        conditions.append(
-            FieldCondition(key="pipeline_version", match=MatchValue(value=pipeline_version))
-        )
+        match.setdefault("pipeline_version", [pipeline_version])
+
+    conditions = []
+    for key, values in match.items():
+        values = [v for v in (values or []) if v is not None and v != ""]
+        if not values:
+            continue
+        if len(values) == 1:
+            conditions.append(FieldCondition(key=key, match=MatchValue(value=values[0])))
+        else:
+            conditions.append(FieldCondition(key=key, match=MatchAny(any=values)))
+
+    for key, bounds in (ranges or {}).items():
+        bounds = {k: v for k, v in (bounds or {}).items() if v is not None}
+        if bounds:
+            conditions.append(FieldCondition(key=key, range=Range(**bounds)))
+
     if not conditions:
         return None
     return Filter(must=conditions)
 
+def build_search_params(
+    *,
+    hnsw_ef: Optional[int] = None,
+    exact: bool = False,
+    rescore: Optional[bool] = None,
+    oversampling: Optional[float] = None,
+) -> Optional[SearchParams]:
+    """
+    Per-request search params. Returns None when everything is default so the
+    server-side collection defaults apply.
+    """
+    quantization = None
+    if rescore is not None or oversampling is not None:
+        quantization = QuantizationSearchParams(rescore=rescore, oversampling=oversampling)
+
+    if hnsw_ef is None and not exact and quantization is None:
+        return None
+    return SearchParams(hnsw_ef=hnsw_ef, exact=exact, quantization=quantization)
+
+@track_outbound("qdrant", "search")
 def search_points(
     client: QdrantClient,
     collection: str,
@@ -54,7 +365,29 @@ def search_points(
     *,
     limit: int = 10,
     qdrant_filter: Optional[Filter] = None,
-    with_payload: bool = True,
+    with_payload: Union[bool, List[str]] = True,
+    search_params: Optional[SearchParams] = None,
+):
+    with _forget_if_missing(collection):
+        return _search_points(
+            client,
+            collection,
+            query_vector,
+            limit=limit,
+            qdrant_filter=qdrant_filter,
+            with_payload=with_payload,
+            search_params=search_params,
+        )
+
+def _search_points(
+    client: QdrantClient,
+    collection: str,
+    query_vector: List[float],
+    *,
+    limit: int = 10,
+    qdrant_filter: Optional[Filter] = None,
+    with_payload: Union[bool, List[str]] = True,
+    search_params: Optional[SearchParams] = None,
 ):
     """
     Compatibility wrapper for different qdrant-client versions.
@@ -73,6 +406,7 @@ def search_points(
                 limit=limit,
                 query_filter=qdrant_filter,
                 with_payload=with_payload,
+                search_params=search_params,
             )
         except TypeError:
             return client.search(
@@ -81,6 +415,7 @@ def search_points(
                 limit=limit,
                 filter=qdrant_filter,
                 with_payload=with_payload,
+                search_params=search_params,
             )
 
     # 2) Older style: client.search_points
@@ -92,6 +427,7 @@ def search_points(
                 limit=limit,
                 query_filter=qdrant_filter,
                 with_payload=with_payload,
+                search_params=search_params,
             )
         except TypeError:
             return client.search_points(
@@ -100,6 +436,7 @@ def search_points(
                 limit=limit,
                 filter=qdrant_filter,
                 with_payload=with_payload,
+                search_params=search_params,
             )
 
     # 3) Query API: client.query_points (often returns an object with `.points`)
@@ -111,6 +448,7 @@ def search_points(
                 limit=limit,
                 query_filter=qdrant_filter,
                 with_payload=with_payload,
+                search_params=search_params,
             )
         except TypeError:
             resp = client.query_points(
@@ -119,6 +457,7 @@ def search_points(
                 limit=limit,
                 filter=qdrant_filter,
                 with_payload=with_payload,
+                search_params=search_params,
             )
         return getattr(resp, "points", resp)
 
@@ -126,6 +465,107 @@ def search_points(
         "Unsupported qdrant-client: missing search/search_points/query_points methods"
     )
 
+# server 不支援可調 k 的 RrfQuery（舊版 Qdrant 回 4xx）時記下來，之後直接用預設 RRF，不再多一次失敗的 round-trip
+_rrf_k_unsupported = False
+
+def _rrf_query(rrf_k: Optional[int]):
+    # 可調 k 需要較新的 qdrant-client / server；舊版用 server 預設的 RRF
+    if rrf_k and not _rrf_k_unsupported:
+        try:
+            from qdrant_client.http.models import Rrf, RrfQuery
+        except ImportError:
+            pass
+        else:
+            return RrfQuery(rrf=Rrf(k=rrf_k))
+    return FusionQuery(fusion=Fusion.RRF)
+
+def rrf_k_supported() -> bool:
+    """False after the server rejected RrfQuery(k): hybrid results then use the server's default k."""
+    return not _rrf_k_unsupported
+
+def _is_rejected_query(e: Exception) -> bool:
+    if is_missing_collection(e):
+        return False  # 不是 RrfQuery 被拒：collection 不存在，fallback 也一樣會失敗
+    status = getattr(e, "status_code", None)  # REST：UnexpectedResponse
+    if status is not None:
+        return 400 <= status < 500
+    code = getattr(e, "code", None)  # gRPC：RpcError.code()
+    return callable(code) and getattr(code(), "name", "") == "INVALID_ARGUMENT"
+
+@track_outbound("qdrant", "hybrid")
+def hybrid_query(
+    client: QdrantClient,
+    collection: str,
+    query_vector: List[float],
+    sparse_query: Tuple[List[int], List[float]],
+    *,
+    dense_limit: int,
+    sparse_limit: int,
+    limit: int,
+    rrf_k: Optional[int] = None,
+    qdrant_filter: Optional[Filter] = None,
+    with_payload: Union[bool, List[str]] = True,
+    search_params: Optional[SearchParams] = None,
+):
+    """
+    Dense + BM25 sparse prefetch fused with RRF on the server: one round-trip instead of
+    Qdrant + SQLite FTS. Each prefetch applies the filter; point.score is the fused score.
+    A query without any lexical token runs the dense prefetch only.
+    """
+    prefetch = [Prefetch(query=query_vector, filter=qdrant_filter, params=search_params, limit=dense_limit)]
+    indices, values = sparse_query
+    if indices:
+        prefetch.append(
+            Prefetch(
+                query=SparseVector(indices=indices, values=values),
+                using=SPARSE_VECTOR_NAME,
+                filter=qdrant_filter,
+                limit=sparse_limit,
+            )
+        )
+    global _rrf_k_unsupported
+    query = _rrf_query(rrf_k)
+    try:
+        with _forget_if_missing(collection):
+            resp = client.query_points(
+                collection_name=collection, prefetch=prefetch, query=query, limit=limit, with_payload=with_payload
+            )
+    except Exception as e:
+        if isinstance(query, FusionQuery) or not _is_rejected_query(e):
+            raise
+        resp = client.query_points(
+            collection_name=collection,
+            prefetch=prefetch,
+            query=FusionQuery(fusion=Fusion.RRF),
+            limit=limit,
+            with_payload=with_payload,
+        )
+        _rrf_k_unsupported = True  # fallback 成功才記：其他 4xx（例如 filter 錯）照樣 raise
+    return getattr(resp, "points", resp)
+
+@track_outbound("qdrant", "retrieve")
+def retrieve_payloads(
+    client: QdrantClient,
+    collection: str,
+    ids: List[str],
+    *,
+    fields: Optional[List[str]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Bulk fetch payloads by point id (one round-trip, no vectors).
+    fields=None -> full payload, otherwise only the listed keys.
+    Returns: {point_id: payload}
+    """
+    if not ids:
+        return {}
+    points = client.retrieve(
+        collection_name=collection,
+        ids=list(ids),
+        with_payload=fields if fields else True,
+        with_vectors=False,
+    )
+    return {str(getattr(p, "id", "")): (getattr(p, "payload", None) or {}) for p in points}
+
 def normalize_point_id(value) -> str:
     """
     Qdrant point id must be unsigned int or UUID.
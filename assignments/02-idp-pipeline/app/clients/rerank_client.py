@@ -2,7 +2,12 @@ import os
 import requests
 from typing import Dict, List, Any, Optional, Tuple
 
+from app.metrics import track_outbound
+from app.tracing import inject_context
+from app.resilience import call_with_resilience, split_urls, CircuitOpenError
+
 RERANK_URL = os.getenv("RERANK_URL", "").strip()
+RERANK_URLS = split_urls(RERANK_URL)  # 多個 replica 時第一個為 primary
 
 class RerankError(RuntimeError):
     pass
@@ -20,15 +25,21 @@ def rerank_remote(
         raise RerankError("RERANK_URL is not set")
 
     payload = {"query": query, "candidates": candidates}
+    headers = inject_context()
+
+    def _one(url: str) -> Dict[str, Any]:
+        with track_outbound("rerank", "rerank"):
+            resp = requests.post(
+                url,
+                json=payload,
+                timeout=timeout_ms / 1000.0,
+                headers=headers,
+            )
+            resp.raise_for_status()
+            return resp.json()
 
     try:
-        resp = requests.post(
-            RERANK_URL,
-            json=payload,
-            timeout=timeout_ms / 1000.0,
-        )
-        resp.raise_for_status()
-        data = resp.json()
+        data = call_with_resilience("rerank", RERANK_URLS, _one, idempotent=True)
 
         scores_list = data.get("scores", [])
         out: Dict[str, float] = {}
@@ -41,6 +52,8 @@ def rerank_remote(
         latency_ms = int(data.get("latency_ms", 0))  # optional from server
         return out, latency_ms
 
+    except CircuitOpenError as e:
+        raise RerankError(str(e)) from e
     except requests.exceptions.Timeout as e:
         raise RerankError(f"timeout after {timeout_ms}ms") from e
     except Exception as e:
@@ -0,0 +1,72 @@
+import os
+import time
+from typing import List, Optional
+
+# ----------------------------
+# Request-level latency budget（/v1/search、/v1/answer）
+#   budget 來源：header `X-Request-Budget-Ms` > body `budget_ms` > DEFAULT_REQUEST_BUDGET_MS
+#   每個 phase 開始前看剩餘時間：不夠就 skip / 降級，並把原因記到 debug.degradations
+# ----------------------------
+DEFAULT_REQUEST_BUDGET_MS = int(os.getenv("DEFAULT_REQUEST_BUDGET_MS", "0"))  # 0 = 不限制
+
+# 各 phase 至少需要的剩餘時間（低於此值就 skip）
+BUDGET_MIN_FTS_MS = int(os.getenv("BUDGET_MIN_FTS_MS", "30"))
+BUDGET_MIN_RERANK_MS = int(os.getenv("BUDGET_MIN_RERANK_MS", "200"))
+BUDGET_MIN_LLM_MS = int(os.getenv("BUDGET_MIN_LLM_MS", "1500"))
+BUDGET_MIN_GAP_FILL_MS = int(os.getenv("BUDGET_MIN_GAP_FILL_MS", "50"))
+
+# /v1/answer：search 階段最多用掉 budget 的這個比例，其餘留給 LLM
+BUDGET_SEARCH_SHARE = float(os.getenv("BUDGET_SEARCH_SHARE", "0.3"))
+# LLM 剩餘時間低於此值時，context 依比例縮小（prefill 時間 ~ context 長度）
+BUDGET_LLM_FULL_CONTEXT_MS = int(os.getenv("BUDGET_LLM_FULL_CONTEXT_MS", "8000"))
+# rerank / hydrate 之後還要留給 response 組裝的時間
+BUDGET_TAIL_RESERVE_MS = int(os.getenv("BUDGET_TAIL_RESERVE_MS", "20"))
+
+
+class Deadline:
+    """
+    A monotonic deadline shared by all phases of one request.
+    budget_ms=None means unlimited: every check passes and timeouts keep their defaults.
+    """
+
+    def __init__(self, budget_ms: Optional[int], *, degradations: Optional[List[str]] = None):
+        self.budget_ms = budget_ms if budget_ms and budget_ms > 0 else None
+        self.started = time.perf_counter()
+        self.expires = self.started + self.budget_ms / 1000.0 if self.budget_ms else None
+        # child deadline 與 parent 共用同一個 list，answer 可以一次看到 search 的降級
+        self.degradations: List[str] = degradations if degradations is not None else []
+
+    @classmethod
+    def from_request(cls, header_ms: Optional[int], body_ms: Optional[int]) -> "Deadline":
+        return cls(header_ms or body_ms or DEFAULT_REQUEST_BUDGET_MS)
+
+    @property
+    def limited(self) -> bool:
+        return self.expires is not None
+
+    def remaining_ms(self) -> Optional[int]:
+        if self.expires is None:
+            return None
+        return max(0, int((self.expires - time.perf_counter()) * 1000))
+
+    def allows(self, min_ms: int) -> bool:
+        rem = self.remaining_ms()
+        return rem is None or rem >= min_ms
+
+    def cap_ms(self, default_ms: int, *, reserve_ms: int = 0) -> int:
+        """Timeout for a phase: default_ms, capped by what is left of the budget."""
+        rem = self.remaining_ms()
+        if rem is None:
+            return default_ms
+        return max(0, min(default_ms, rem - reserve_ms))
+
+    def child(self, share: float) -> "Deadline":
+        """Sub-deadline taking at most `share` of what is left (same degradation list)."""
+        rem = self.remaining_ms()
+        if rem is None:
+            return Deadline(None, degradations=self.degradations)
+        return Deadline(max(1, int(rem * share)), degradations=self.degradations)
+
+    def degrade(self, reason: str):
+        if reason not in self.degradations:
+            self.degradations.append(reason)
@@ -0,0 +1,238 @@
+import os
+import time
+import uuid
+from hashlib import sha256
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from qdrant_client.http.models import PointStruct, SparseVector
+
+from app.sparse import SPARSE_VECTOR_NAME, doc_vector
+
+# ----------------------------
+# Chunk / index helpers shared by the worker pipeline, /v1/reindex/fts and bench/
+# ----------------------------
+CHUNK_SIZE = 300
+CHUNK_OVERLAP = 50
+PIPELINE_VERSION = "v1"
+# streaming pipeline：每批 embed + upsert 的 chunk 數（記憶體上限 ≈ batch_size × (chunk + vector)）
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "64"))
+
+# chunk point id = uuid5(DOC_NS, "{doc_id}:{chunk_index}")（同一 doc 重跑會覆蓋同一批 point）
+DOC_NS = uuid.UUID("12345678-1234-5678-1234-567812345678")
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[Dict[str, Any]]:
+    """Fixed-size character windows with overlap: [{"i": 0, "text": ...}, ...]"""
+    chunks = []
+    start = 0
+    idx = 0
+    while start < len(text):
+        end = start + chunk_size
+        chunks.append({"i": idx, "text": text[start:end]})
+        idx += 1
+        start = max(0, end - overlap)
+        if start >= len(text):
+            break
+    return chunks
+
+
+def iter_chunks(
+    segments: Iterable[str], chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP
+) -> Iterator[Dict[str, Any]]:
+    """
+    Streaming chunk_text：segments（例如逐頁文字）依序接起來切，
+    結果與 chunk_text("".join(segments)) 完全相同（chunk index / point id 也就一樣）。
+    只保留 carry buffer（上一段切剩的尾巴 + 目前這段），整份文字不需要同時在記憶體。
+    """
+    step = chunk_size - overlap
+    if step <= 0:
+        raise ValueError("overlap must be smaller than chunk_size")
+    buf, pos, idx = "", 0, 0
+    for seg in segments:
+        if not seg:
+            continue
+        buf = buf[pos:] + seg
+        pos = 0
+        while len(buf) - pos >= chunk_size:
+            yield {"i": idx, "text": buf[pos : pos + chunk_size]}
+            idx += 1
+            pos += step
+    while pos < len(buf):
+        yield {"i": idx, "text": buf[pos : pos + chunk_size]}
+        idx += 1
+        pos += step
+
+
+def iter_batches(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    it = iter(items)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def make_doc_id(job_id: str, source: str, input_type: str) -> str:
+    # doc_id：用 input（例如檔案路徑）+ job_id 生成一個可追溯 id（最小 lineage）
+    return sha256(f"{job_id}:{source}:{input_type}".encode("utf-8")).hexdigest()[:16]
+
+
+def chunk_point_id(doc_id: str, chunk_index: int) -> str:
+    return str(uuid.uuid5(DOC_NS, f"{doc_id}:{chunk_index}"))
+
+
+def point_vector(dense, text: Optional[str], *, sparse: bool):
+    """
+    sparse=False -> the unnamed dense vector as-is.
+    sparse=True  -> {"": dense, "bm25": SparseVector}（collection 有 sparse vector 時，hybrid 查詢用）
+    """
+    if not sparse:
+        return dense
+    indices, values = doc_vector(text or "")
+    return {"": dense, SPARSE_VECTOR_NAME: SparseVector(indices=indices, values=values)}
+
+
+def build_points(
+    chunks: Sequence[Dict[str, Any]],
+    vectors: Sequence[Sequence[float]],
+    *,
+    doc_id: str,
+    job_id: Optional[str],
+    input_type: str,
+    source: Optional[str],
+    pipeline_version: str = PIPELINE_VERSION,
+    ingested_at: Optional[int] = None,
+    sparse: bool = False,
+) -> List[PointStruct]:
+    ingested_at = int(time.time()) if ingested_at is None else ingested_at
+    return [
+        PointStruct(
+            id=chunk_point_id(doc_id, c["i"]),
+            vector=point_vector(v, c["text"], sparse=sparse),
+            payload=point_payload(
+                c,
+                doc_id=doc_id,
+                job_id=job_id,
+                input_type=input_type,
+                source=source,
+                pipeline_version=pipeline_version,
+                ingested_at=ingested_at,
+            ),
+        )
+        for c, v in zip(chunks, vectors)
+    ]
+
+
+def point_payload(
+    chunk: Dict[str, Any],
+    *,
+    doc_id: str,
+    job_id: Optional[str],
+    input_type: str,
+    source: Optional[str],
+    pipeline_version: str,
+    ingested_at: int,
+) -> Dict[str, Any]:
+    return {
+        "doc_id": doc_id,
+        "job_id": job_id,
+        "chunk_index": chunk["i"],
+        "input_type": input_type,
+        "source": source,
+        "text": chunk["text"],
+        "pipeline_version": pipeline_version,
+        "ingested_at": ingested_at,
+    }
+
+
+def index_stream(
+    chunks: Iterable[Dict[str, Any]],
+    *,
+    embed: Callable[[List[str]], Any],
+    upload: Callable[[List[str], Any, List[Dict[str, Any]]], None],
+    doc_id: str,
+    job_id: Optional[str],
+    input_type: str,
+    source: Optional[str],
+    pipeline_version: str = PIPELINE_VERSION,
+    ingested_at: Optional[int] = None,
+    batch_size: int = INDEX_BATCH_SIZE,
+) -> Dict[str, Any]:
+    """
+    chunks（generator）→ 每 batch_size 個：embed(texts) -> (n, dim) ndarray → upload(ids, vectors, payloads)。
+    同一時間只有一個 batch 的 chunk / vector / payload 在記憶體；回傳 summary（不含 chunk 內容）。
+    point id / payload 與 build_points 相同，streaming 與一般模式重跑同一份 doc 會覆蓋同一批 point。
+    """
+    ingested_at = int(time.time()) if ingested_at is None else ingested_at
+    summary: Dict[str, Any] = {"chunks": 0, "batches": 0, "chars": 0, "dim": 0, "embed_ms": 0.0, "upload_ms": 0.0}
+    for batch in iter_batches(chunks, batch_size):
+        texts = [c["text"] for c in batch]
+        t0 = time.perf_counter()
+        vectors = embed(texts)
+        t1 = time.perf_counter()
+        upload(
+            [chunk_point_id(doc_id, c["i"]) for c in batch],
+            vectors,
+            [
+                point_payload(
+                    c,
+                    doc_id=doc_id,
+                    job_id=job_id,
+                    input_type=input_type,
+                    source=source,
+                    pipeline_version=pipeline_version,
+                    ingested_at=ingested_at,
+                )
+                for c in batch
+            ],
+        )
+        t2 = time.perf_counter()
+        summary["chunks"] += len(batch)
+        summary["batches"] += 1
+        summary["chars"] += sum(len(t) for t in texts)
+        summary["dim"] = int(vectors.shape[1]) if len(vectors) else summary["dim"]
+        summary["embed_ms"] += (t1 - t0) * 1000
+        summary["upload_ms"] += (t2 - t1) * 1000
+    summary["embed_ms"] = round(summary["embed_ms"], 2)
+    summary["upload_ms"] = round(summary["upload_ms"], 2)
+    return summary
+
+
+def fts_row(point_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Qdrant payload -> row for fts_client.bulk_upsert."""
+    doc_id = payload.get("doc_id")
+    pv = payload.get("pipeline_version")
+    # these might or might not exist in payload depending on your pipeline
+    source_file = payload.get("source_file") or payload.get("source")  # fallback
+    job_id = payload.get("job_id")
+
+    text = payload.get("text") or ""
+    if not isinstance(text, str):
+        text = str(text)
+
+    # searchable content = text + selected metadata (keyword-friendly)
+    # NOTE: avoid ':' tokenization pitfalls by also adding space-separated variants
+    parts = [text]
+    if doc_id:
+        parts.append(f"doc_id {doc_id}")
+    if source_file:
+        parts.append(f"source_file {source_file}")
+    if job_id:
+        parts.append(f"job_id {job_id}")
+    if pv:
+        parts.append(f"pipeline_version {pv}")
+
+    return {
+        "chunk_id": point_id,
+        "doc_id": doc_id,
+        "pipeline_version": pv,
+        "chunk_index": payload.get("chunk_index"),
+        "source_file": source_file,
+        "job_id": job_id,
+        "input_type": payload.get("input_type"),
+        "ingested_at": payload.get("ingested_at"),
+        "content": "\n".join([x for x in parts if x]),
+        # keep raw text too (optional)
+        "text": text,
+    }
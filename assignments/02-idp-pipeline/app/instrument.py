@@ -0,0 +1,95 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from app import tracing
+
+try:
+    import resource
+except ImportError:  # non-POSIX
+    resource = None
+
+_PAGE_KB = (os.sysconf("SC_PAGE_SIZE") // 1024) if hasattr(os, "sysconf") else 4
+
+
+def rss_kb() -> Optional[int]:
+    """Current RSS (KB) from /proc, None when unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_KB
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_kb() -> Optional[int]:
+    """Process high-water mark RSS (KB; Linux ru_maxrss unit)."""
+    if resource is None:
+        return None
+    return int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+class StageRecorder:
+    """
+    Per-stage wall time / CPU time / RSS delta / item counts for one job.
+
+    with rec.stage("embed") as m:
+        vectors = embed_texts(texts)
+        m["vectors"] = len(vectors)
+
+    on_enter(stage, index) is called before the stage body (progress events),
+    on_record(records) after each stage (e.g. persist into RQ job.meta).
+    """
+
+    def __init__(
+        self,
+        *,
+        on_enter: Optional[Callable[[str, int], None]] = None,
+        on_record: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+    ):
+        self.stages: List[str] = []
+        self.records: List[Dict[str, Any]] = []
+        self._on_enter = on_enter
+        self._on_record = on_record
+
+    @contextmanager
+    def stage(self, name: str):
+        self.stages.append(name)
+        if self._on_enter:
+            self._on_enter(name, len(self.stages) - 1)
+
+        counts: Dict[str, Any] = {}
+        rss0, peak0 = rss_kb(), peak_rss_kb()
+        cpu0 = time.process_time()
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            with tracing.span(f"stage.{name}", stage=name) as sp:
+                yield counts
+                tracing.set_attributes(sp, **{f"count.{k}": v for k, v in counts.items()})
+            ok = True
+        finally:
+            wall_ms = (time.perf_counter() - t0) * 1000
+            cpu_ms = (time.process_time() - cpu0) * 1000
+            rss1, peak1 = rss_kb(), peak_rss_kb()
+            self.records.append(
+                {
+                    "stage": name,
+                    "ok": ok,
+                    "wall_ms": round(wall_ms, 2),
+                    "cpu_ms": round(cpu_ms, 2),
+                    "rss_delta_kb": (rss1 - rss0) if (rss0 is not None and rss1 is not None) else None,
+                    "peak_rss_delta_kb": (peak1 - peak0) if (peak0 is not None and peak1 is not None) else None,
+                    "peak_rss_kb": peak1,
+                    "counts": counts,
+                }
+            )
+            if self._on_record:
+                self._on_record(self.records)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "stages": self.records,
+            "total_wall_ms": round(sum(r["wall_ms"] for r in self.records), 2),
+            "total_cpu_ms": round(sum(r["cpu_ms"] for r in self.records), 2),
+        }
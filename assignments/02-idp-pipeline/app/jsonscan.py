@@ -0,0 +1,119 @@
+import json
+import re
+from typing import Any, Dict, Optional
+
+# inside an object only these characters change state; everything else is skipped by the regex engine
+_IN_OBJ = re.compile(r'[{}"]')
+_IN_STR = re.compile(r'["\\]')
+_DECODER = json.JSONDecoder()
+
+
+class JsonObjectScanner:
+    """
+    Single-pass, brace-aware scanner for the first complete JSON object in a text stream.
+
+    feed() can be called with arbitrary chunks (e.g. streamed VLM deltas); it returns the
+    object as soon as its closing brace arrives. Braces inside JSON strings (and escaped
+    quotes) are handled. A balanced {...} span that is not valid JSON (e.g. prose
+    "{like this}") is skipped and scanning resumes right after its opening brace.
+
+    Covers the old extract_json_obj cases in one pass: ```json fences, a bare JSON
+    document, and JSON embedded in prose.
+    """
+
+    def __init__(self):
+        self._text = ""      # buffered text; index 0 is the open candidate's '{' when _depth > 0
+        self._pos = 0        # next index to scan
+        self._depth = 0
+        self._in_str = False
+        self._esc = False    # previous chunk ended with a backslash inside a string
+        self.result: Optional[Dict[str, Any]] = None
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None
+
+    def feed(self, chunk: str) -> Optional[Dict[str, Any]]:
+        if self.result is not None or not chunk:
+            return self.result
+        self._text += chunk
+        self._scan()
+        return self.result
+
+    def _scan(self):
+        t = self._text
+        n = len(t)
+        while True:
+            if self._depth == 0:
+                i = t.find("{", self._pos)
+                if i < 0:
+                    # no candidate open: nothing before the end needs to be kept
+                    self._text, self._pos = "", 0
+                    return
+                t = self._text = t[i:]
+                n = len(t)
+                self._pos, self._depth, self._in_str, self._esc = 1, 1, False, False
+                continue
+
+            if self._esc:
+                if self._pos >= n:
+                    return
+                self._pos += 1
+                self._esc = False
+
+            m = (_IN_STR if self._in_str else _IN_OBJ).search(t, self._pos)
+            if m is None:
+                self._pos = n
+                return
+            ch = m.group()
+            self._pos = m.end()
+
+            if self._in_str:
+                if ch == "\\":
+                    self._esc = True
+                else:
+                    self._in_str = False
+            elif ch == '"':
+                self._in_str = True
+            elif ch == "{":
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        obj = json.loads(t[: self._pos])
+                    except ValueError:
+                        obj = None
+                    if isinstance(obj, dict):
+                        self.result = obj
+                        self._text = ""
+                        return
+                    # not JSON: retry from the next '{' inside this span
+                    self._pos = 1
+
+
+def extract_json_obj(text: str) -> Optional[Dict[str, Any]]:
+    """
+    嘗試從 LLM/VLM 回傳的 content 中抽出「第一個可 parse 的 JSON object」。
+
+    支援情境（單次掃描）：
+    1) ```json ... ``` code fence
+    2) content 本身就是 JSON
+    3) 文字中夾雜 JSON
+
+    成功回傳 dict，失敗回 None
+    """
+    if not text:
+        return None
+    i = text.find("{")
+    if i < 0:
+        return None
+    # fast path（全文已到齊）：C decoder 從第一個 '{' 解析到 object 結尾即停，後面的文字不看
+    try:
+        obj, _ = _DECODER.raw_decode(text, i)
+        if isinstance(obj, dict):
+            return obj
+    except ValueError:
+        pass
+    # 第一個 {...} 不是 JSON（或不完整）：交給 scanner 找下一個完整 object
+    return JsonObjectScanner().feed(text[i:])
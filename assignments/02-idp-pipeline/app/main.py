@@ -1,37 +1,124 @@
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Header, Query, Request
+from fastapi.responses import StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
 from rq import Retry
-import os, re, requests
+import os, re, requests, uuid
 import time
+import json
 from time import perf_counter
 import traceback
+from typing import Any, Dict, List, Optional
 
 from .schemas import AnswerRequest, AnswerResponse, CitationItem, AnswerDebug
 
-from app.queue import queue, redis_conn
-from app.router import decide_route
-from app.state import Route
+from app.queue import queues, redis_conn
+from app.router import decide_route, decide_priority
+from app.admission import check_admission, AdmissionRejected
+from app.resilience import breaker_states
+from app.deadline import (
+    Deadline,
+    BUDGET_MIN_FTS_MS,
+    BUDGET_MIN_RERANK_MS,
+    BUDGET_MIN_LLM_MS,
+    BUDGET_MIN_GAP_FILL_MS,
+    BUDGET_SEARCH_SHARE,
+    BUDGET_LLM_FULL_CONTEXT_MS,
+    BUDGET_TAIL_RESERVE_MS,
+)
+from app.state import Route, JobPriority
+from app.blobstore import BlobNotFound, resolve_path
+from app.uploads import StreamingUpload, UploadError, check_declared_length
 
 from .schemas import (
     CreateJobRequest,
+    UploadResponse,
     GetJobResponse,
+    JobsStatusRequest,
+    JobsStatusResponse,
+    JobStatusItem,
     SearchRequest,
     SearchResponse,
     SearchResultItem,
     SearchDebug,
 )
 from .state import JobStatus
-from .queue import get_status, get_result, get_error
+from .queue import (
+    async_redis_conn,
+    aget_job_state,
+    aread_events,
+    get_job_states,
+    set_job_state,
+    touch_blobs,
+    expand_result,
+    BLOB_UPLOAD_TTL_SEC,
+    TERMINAL_STATUSES,
+)
 
 from app.clients.embedding import embed_texts
-from app.clients.qdrant_client import get_qdrant, build_filter, search_points
+from app.clients.qdrant_client import (
+    get_qdrant,
+    build_filter,
+    build_search_params,
+    search_points,
+    retrieve_payloads,
+    hybrid_query,
+    rrf_k_supported,
+    collection_has_sparse,
+    FUSION_PAYLOAD_FIELDS,
+)
 from app.clients.fts_client import reset_fts, bulk_upsert, search_keyword
-from app.retrieval import rrf_fuse
+from app.retrieval import rrf_fuse, filter_spec
+from app.sparse import query_vector as sparse_query_vector
+from app.indexing import fts_row, chunk_point_id
+from app.packing import pack_context, render_blocks
 from app.clients.rerank_client import rerank_remote, RerankError
 from app.clients.model_api import call_llm
+from app import metrics, tracing
+from app.metrics import observe_phase
+from app import singleflight
 
 app = FastAPI(title="IDP Pipeline MVP", version="0.3.0")
+tracing.init_tracing("idp-api")
 DEFAULT_JOB_TIMEOUT_SEC = int(os.getenv("DEFAULT_TIMEOUT_SEC", "20"))
+JOB_TIMEOUT_SEC = {
+    "interactive": DEFAULT_JOB_TIMEOUT_SEC,
+    "normal": DEFAULT_JOB_TIMEOUT_SEC,
+    "bulk": int(os.getenv("BULK_JOB_TIMEOUT_SEC", str(DEFAULT_JOB_TIMEOUT_SEC * 30))),
+}
 QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "idp_chunks")
+# hybrid 的關鍵字端：auto = collection 有 BM25 sparse vector 就用（一次 Qdrant query），否則用 SQLite FTS
+HYBRID_LEXICAL = os.getenv("HYBRID_LEXICAL", "auto").strip().lower()
+# job 結果已存在 job:{id} hash，RQ 自己的 return value 不需要再保留一份
+RQ_RESULT_TTL_SEC = int(os.getenv("RQ_RESULT_TTL_SEC", "0"))
+JOB_WAIT_MAX_SEC = int(os.getenv("JOB_WAIT_MAX_SEC", "60"))
+SSE_MAX_SEC = int(os.getenv("SSE_MAX_SEC", "900"))
+SSE_KEEPALIVE_SEC = int(os.getenv("SSE_KEEPALIVE_SEC", "15"))
+
+@app.middleware("http")
+async def _http_metrics(request: Request, call_next):
+    t0 = time.perf_counter()
+    status = 500
+    with tracing.span("http.request", **{"http.method": request.method}) as sp:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # 用 route template（/v1/jobs/{job_id}）當 label，避免 job_id 造成 label 爆量
+            route = request.scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            if sp is not None:
+                sp.update_name(f"{request.method} {endpoint}")
+            tracing.set_attributes(sp, **{"http.route": endpoint, "http.status_code": status})
+            metrics.HTTP_LATENCY.labels(
+                method=request.method, endpoint=endpoint, status=str(status)
+            ).observe(time.perf_counter() - t0)
+
+@app.get("/metrics")
+def prometheus_metrics():
+    body, content_type = metrics.render_latest([metrics.QueueDepthCollector(queues.values())])
+    return Response(content=body, media_type=content_type)
 
 @app.get("/")
 def root():
@@ -41,11 +128,51 @@ def root():
 def health():
     return {"status": "ok"}
 
+def _client_id(request: Request) -> str:
+    # 有帶 X-Client-Id 就用它（gateway 後面時 IP 都一樣），否則用來源 IP
+    cid = (request.headers.get("x-client-id") or "").strip()
+    if cid:
+        return cid[:128]
+    return request.client.host if request.client else "unknown"
+
+def _admit(target_queue, request: Request, *, rate_limit: bool = True) -> Dict[str, Any]:
+    # admission control：queue 太深或 client 超速 → 429 + Retry-After
+    try:
+        return check_admission(redis_conn, target_queue, _client_id(request), rate_limit=rate_limit)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail={"error": e.reason, "retry_after_sec": e.retry_after_sec, **e.info},
+            headers={"Retry-After": str(e.retry_after_sec)},
+        )
+
 @app.post("/v1/jobs")
-def create_job(req: CreateJobRequest):
+def create_job(req: CreateJobRequest, request: Request):
+    return _create_job(req, request)
+
+def _create_job(req: CreateJobRequest, request: Request, *, pre_admitted: bool = False):
+    """pre_admitted：client 的 token 已在讀 body 前扣過（/v1/jobs:upload），這裡只對最終的 queue 檢查深度"""
     # 使用者要求的 route（auto/ocr/vlm）
     route_request = req.route.value
 
+    # blob_key：檔案已在 blob store（POST /v1/uploads），worker 只拿 key
+    blob_size = None
+    if req.blob_key:
+        try:
+            blob_size = os.path.getsize(resolve_path(req.blob_key))
+        except BlobNotFound:
+            raise HTTPException(status_code=404, detail=f"blob not found: {req.blob_key}")
+    elif not req.text.strip():
+        raise HTTPException(status_code=422, detail="text or blob_key is required")
+
+    # priority / 估算成本 → 決定進哪個 queue（interactive / default / bulk）
+    priority, est_cost, priority_reason = decide_priority(
+        req.priority, req.text, req.input_type.value, req.page_count, blob_size
+    )
+    target_queue = queues[priority.value]
+
+    admission = _admit(target_queue, request, rate_limit=not pre_admitted)
+
     # route_hint：只有展示用（A 先保留），真正 chosen_route 以 worker 結果為準
     if req.route == Route.auto:
         hint_route, hint_conf, hint_reason = decide_route(req.text)
@@ -55,48 +182,268 @@ def create_job(req: CreateJobRequest):
         route_hint = {"route": route_request, "confidence": 1.0, "reason": "Route forced by request"}
         route_for_worker = route_request
 
-    job = queue.enqueue(
-        "app.tasks.run_job",
-        req.text,
-        route_for_worker,
-        req.input_type.value,                 # ✅ 新增：傳 input_type
-        job_timeout=DEFAULT_JOB_TIMEOUT_SEC,  # ✅ 新增：RQ timeout
-        retry=Retry(max=2, interval=[1, 3])   # ✅ 新增：最小 retry
-    )
+    # 先寫 queued 狀態再 enqueue，避免 worker 已 started 又被覆寫回 queued
+    job_id = str(uuid.uuid4())
+    with tracing.span("job.enqueue", job_id=job_id, route=route_for_worker, input_type=req.input_type.value):
+        set_job_state(redis_conn, job_id, JobStatus.queued.value, blobs=[req.blob_key])
+
+        job = target_queue.enqueue(
+            "app.tasks.run_job",
+            req.text,
+            route_for_worker,
+            req.input_type.value,                 # ✅ 新增：傳 input_type
+            req.blob_key,                         # 只傳 key，檔案內容不經過 Redis
+            req.doc_options.model_dump() if req.doc_options else None,
+            job_id=job_id,
+            job_timeout=JOB_TIMEOUT_SEC[priority.value],  # ✅ 新增：RQ timeout（依 priority）
+            result_ttl=RQ_RESULT_TTL_SEC,
+            retry=Retry(max=2, interval=[1, 3]),  # ✅ 新增：最小 retry
+            # trace context + enqueue 時間：worker 端接續 trace，並產生 queue.wait span
+            meta={"trace": tracing.inject_context(), "enqueued_at_ns": time.time_ns()},
+        )
 
     return {
         "job_id": job.id,
         "status": "queued",
         "queue": job.origin,
+        "priority": priority.value,
+        "priority_reason": priority_reason,
+        "estimated_cost": round(est_cost, 2),
         "route_request": route_request,
         "route_hint": route_hint,
         "input_type": req.input_type.value,
+        "blob_key": req.blob_key,
+        "queue_depth": admission["queue_depth"],
+        "estimated_start_sec": admission["estimated_start_sec"],
     }
 
+async def _receive_upload(request: Request) -> dict:
+    """
+    Request body 邊收邊寫進 blob store（multipart 的 `file` part，或整個 raw body）。
+    每個 chunk 丟到 threadpool 寫檔 + hash，不卡 event loop；API 記憶體只留當下的 chunk。
+    """
+    try:
+        check_declared_length(request.headers.get("content-length"))
+        sink = StreamingUpload(request.headers.get("content-type"))
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(sink.feed, chunk)
+        info = await run_in_threadpool(sink.finish)
+        # 沒被任何 job 用到的上傳在 BLOB_UPLOAD_TTL_SEC 後由 worker 清掉
+        await run_in_threadpool(touch_blobs, redis_conn, [info["blob_key"]], BLOB_UPLOAD_TTL_SEC)
+        return info
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        sink.abort()  # client 中途斷線等：不留 temp file（已 commit 則 no-op）
+
+def _guess_input_type(content_type: Optional[str], filename: Optional[str]) -> str:
+    ct = (content_type or "").lower()
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ct == "application/pdf" or ext == ".pdf":
+        return "pdf"
+    if ct.startswith("image/") or ext in (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp"):
+        return "image"
+    return "text"
+
+@app.post("/v1/uploads", response_model=UploadResponse)
+async def upload_blob(request: Request):
+    """
+    串流上傳（multipart/form-data 的 `file` 欄位，或 raw body 例如 Content-Type: application/pdf）
+    → content-addressed blob store；回傳的 blob_key 給 POST /v1/jobs 使用。
+    """
+    return await _receive_upload(request)
+
+def _upload_queue(request: Request, priority: Optional[str]):
+    """
+    body 還沒讀時估計 job 會進哪個 queue：?priority= 有給就用它，
+    否則用 Content-Length 當檔案大小粗估（與建 job 時的 decide_priority 同一套規則）
+    """
+    if priority:
+        try:
+            return queues[JobPriority(priority).value]
+        except ValueError:
+            raise HTTPException(status_code=422, detail=f"invalid priority: {priority}")
+    length = request.headers.get("content-length")
+    size = int(length) if length and length.isdigit() else None
+    input_type = request.query_params.get("input_type") or _guess_input_type(request.headers.get("content-type"), None)
+    est_priority, _, _ = decide_priority(None, "", input_type, None, size)
+    return queues[est_priority.value]
+
+@app.post("/v1/jobs:upload")
+async def create_job_upload(request: Request, priority: Optional[str] = Query(None)):
+    """
+    一次完成：multipart `file` + 表單欄位（input_type / route / priority / page_count / ocr / table_structure）
+    → 上傳 + 建 job。
+    input_type 沒給時依 Content-Type / 副檔名判斷（pdf / image，其他當 text）。
+    admission 在讀 body 之前（client id 來自 header；queue 依 ?priority= 或 Content-Length 估計），
+    被 429 的 client 不必先傳完整個檔案；body 收完後再對實際的 queue 檢查一次深度（不再扣 token）。
+    """
+    await run_in_threadpool(_admit, _upload_queue(request, priority), request)
+    info = await _receive_upload(request)
+    fields = info["fields"]
+    try:
+        req = CreateJobRequest(
+            blob_key=info["blob_key"],
+            input_type=fields.get("input_type")
+            or request.query_params.get("input_type")
+            or _guess_input_type(info["content_type"], info["filename"]),
+            route=fields.get("route") or Route.auto.value,
+            priority=fields.get("priority") or priority,
+            page_count=fields.get("page_count") or None,
+            doc_options={k: fields[k] for k in ("ocr", "table_structure") if fields.get(k)} or None,
+        )
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=json.loads(e.json()))
+    resp = await run_in_threadpool(_create_job, req, request, pre_admitted=True)
+    return {**resp, "blob": {k: info[k] for k in ("bytes", "filename", "content_type")}}
+
 @app.get("/v1/jobs/{job_id}", response_model=GetJobResponse)
-def get_job(job_id: str):
-    status = get_status(redis_conn, job_id)
-    if not status:
+async def get_job(
+    job_id: str,
+    expand: bool = False,
+    wait: float = Query(0, ge=0, description="long-poll：最多等待秒數，直到 job finished/failed"),
+):
+    """
+    expand=false：大欄位（chunks / raw）以 {"$blob": key, "bytes": n} 回傳
+    expand=true ：從 blob store 讀回完整內容
+    wait>0      ：job 尚未結束時，等在 job event stream 上（async XREAD BLOCK，不佔 thread），結束（或逾時）才回傳
+    """
+    state = await aget_job_state(async_redis_conn, job_id)  # HMGET：一次 round-trip
+    if not state or not state.get("status"):
         # 代表 job_id 根本不存在/過期/被清掉
         raise HTTPException(status_code=404, detail="Job not found")
 
-    result = get_result(redis_conn, job_id) if status == JobStatus.finished.value else None
-    error = get_error(redis_conn, job_id) if status == JobStatus.failed.value else None
+    if wait > 0 and state["status"] not in TERMINAL_STATUSES:
+        if await _wait_terminal(job_id, min(wait, JOB_WAIT_MAX_SEC)):
+            state = await aget_job_state(async_redis_conn, job_id) or state
+
+    status = state["status"]
+    result = state.get("result") if status == JobStatus.finished.value else None
+    error = state.get("error") if status == JobStatus.failed.value else None
+    if expand and result is not None:
+        result = await run_in_threadpool(expand_result, result)  # 讀 blob store（disk）
 
     return GetJobResponse(job_id=job_id, status=status, result=result, error=error)
 
+@app.post("/v1/jobs:status", response_model=JobsStatusResponse, response_model_exclude_unset=True)
+def get_jobs_status(req: JobsStatusRequest):
+    """
+    批次查詢 job 狀態：一次 pipeline HMGET 取回全部，fields 控制是否帶 result/error。
+    """
+    job_ids = list(dict.fromkeys(req.job_ids))  # 去重但保留順序
+    fields = tuple(dict.fromkeys(["status", *req.fields]))
+    states = get_job_states(redis_conn, job_ids, fields=fields)
+
+    jobs, missing = [], []
+    for job_id in job_ids:
+        state = states.get(job_id)
+        if not state or not state.get("status"):
+            missing.append(job_id)
+            continue
+
+        item = {"job_id": job_id, "status": state["status"]}
+        if "result" in req.fields:
+            result = state.get("result")
+            item["result"] = expand_result(result) if (req.expand and result is not None) else result
+        if "error" in req.fields:
+            # 與 GET /v1/jobs/{id} 相同：只有 failed 帶 error
+            item["error"] = state.get("error") if state["status"] == JobStatus.failed.value else None
+        jobs.append(JobStatusItem(**item))
+
+    return JobsStatusResponse(jobs=jobs, missing=missing)
+
+async def _wait_terminal(job_id: str, timeout_sec: float) -> bool:
+    """
+    Block on the job event stream until a finished/failed status event shows up.
+    Reads from the start of the stream so an event written right after the
+    HMGET above is never missed.
+    """
+    deadline = time.monotonic() + timeout_sec
+    last_id = "0-0"
+    while True:
+        remain_ms = int((deadline - time.monotonic()) * 1000)
+        if remain_ms <= 0:
+            return False
+        for eid, event, data in await aread_events(async_redis_conn, job_id, last_id, block_ms=remain_ms):
+            last_id = eid
+            if event == "status" and data.get("status") in TERMINAL_STATUSES:
+                return True
+
+@app.get("/v1/jobs/{job_id}/events")
+async def job_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-Sent Events：推送 status（queued/started/finished/failed）與
+    pipeline stage（ocr/vlm/normalize/chunk/embed/index）進度，job 結束後關閉連線。
+    斷線重連時瀏覽器會帶 Last-Event-ID，從該事件之後繼續。
+    async generator：等待中的連線只是一個掛起的 coroutine，不佔 threadpool。
+    """
+    if not await aget_job_state(async_redis_conn, job_id, fields=("status",)):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def _stream():
+        last_id = last_event_id or "0-0"
+        deadline = time.monotonic() + SSE_MAX_SEC
+        while time.monotonic() < deadline:
+            events = await aread_events(async_redis_conn, job_id, last_id, block_ms=SSE_KEEPALIVE_SEC * 1000)
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for eid, event, data in events:
+                last_id = eid
+                yield f"id: {eid}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                if event == "status" and data.get("status") in TERMINAL_STATUSES:
+                    return
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # ----------------------------
 # Day5: Semantic Search API v1
 # ----------------------------
 
+def _single_flight(kind: str, req, deadline: Deadline, fn, response_cls):
+    """
+    同時進來的相同 request 只執行一次（process 內 + 跨 replica），其餘拿同一份 response（debug.coalesced=True）。
+    budget 不算進 key：follower 最多等到自己的 deadline，等不到就自己算；
+    leader 因自己的 budget 降級過（debug.degradations 非空）的 response 不分享，follower 依自己的 budget 重算。
+    """
+    payload = {"collection": QDRANT_COLLECTION, **req.model_dump(mode="json", exclude={"budget_ms"})}
+    remaining_ms = deadline.remaining_ms()
+    resp, coalesced = singleflight.do(
+        kind,
+        singleflight.request_key(kind, payload),
+        fn,
+        dumps=lambda r: r.model_dump_json(),
+        loads=response_cls.model_validate_json,
+        wait_s=None if remaining_ms is None else remaining_ms / 1000.0,
+        shareable=lambda r: not r.debug.degradations,
+    )
+    if coalesced:
+        resp = resp.model_copy(deep=True)  # process 內的 follower 拿到的是 leader 的同一個物件
+        resp.debug.coalesced = True
+    return resp
+
+
 @app.post("/v1/search", response_model=SearchResponse)
-def semantic_search(req: SearchRequest):
+def semantic_search(req: SearchRequest, x_request_budget_ms: Optional[int] = Header(None)):
+    deadline = Deadline.from_request(x_request_budget_ms, req.budget_ms)
+    return _single_flight("search", req, deadline, lambda: _semantic_search(req, deadline), SearchResponse)
+
+
+def _semantic_search(req: SearchRequest, deadline: Deadline) -> SearchResponse:
     t0 = time.perf_counter()
 
     # ----------------
     # 0) helpers
     # ----------------
     def _item_from_dense_hit(h, score: float) -> SearchResultItem:
+        # dense hits only carry FUSION_PAYLOAD_FIELDS; text/payload are hydrated later
         payload = h.payload or {}
         return SearchResultItem(
             score=float(score),
@@ -104,10 +451,38 @@ def semantic_search(req: SearchRequest):
             doc_id=payload.get("doc_id"),
             pipeline_version=payload.get("pipeline_version"),
             chunk_index=payload.get("chunk_index"),
-            text=payload.get("text"),
-            payload=payload if req.include_payload else None,
+            text=None,
+            payload=None,
         )
 
+    def _hydrate_inplace(items: list[SearchResultItem]) -> int:
+        """
+        Bulk-fetch text (or the full payload when include_payload) for dense-origin
+        items in one Qdrant retrieve call. Returns number of hydrated items.
+        """
+        ids = [it.chunk_id for it in items if it.text is None]
+        if not ids:
+            return 0
+        try:
+            with observe_phase("hydrate"):
+                payloads = retrieve_payloads(
+                    qdrant,
+                    QDRANT_COLLECTION,
+                    ids,
+                    fields=None if req.include_payload else ["text"],
+                )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Qdrant hydrate failed: {e}")
+
+        for it in items:
+            p = payloads.get(it.chunk_id)
+            if p is None:
+                continue
+            it.text = p.get("text")
+            if req.include_payload:
+                it.payload = p
+        return len(payloads)
+
     def _item_from_bm25_row(pid: str, r: dict, score: float) -> SearchResultItem:
         payload = {
             "doc_id": r.get("doc_id"),
@@ -149,13 +524,22 @@ def semantic_search(req: SearchRequest):
         if not candidates:
             return False, 0, "no candidates with text"
 
+        # budget：剩餘時間不夠一次 rerank 就保留 fusion 排序；夠的話 timeout 不超過剩餘時間
+        if not deadline.allows(BUDGET_MIN_RERANK_MS + BUDGET_TAIL_RESERVE_MS):
+            deadline.degrade("rerank_skipped")
+            return False, 0, "latency budget exhausted"
+        timeout_ms = deadline.cap_ms(req.rerank.timeout_ms, reserve_ms=BUDGET_TAIL_RESERVE_MS)
+        if timeout_ms < req.rerank.timeout_ms:
+            deadline.degrade("rerank_timeout_capped")
+
         rr_t0 = time.perf_counter()
         try:
-            score_map, rr_lat = rerank_remote(
-                req.query,
-                candidates,
-                timeout_ms=req.rerank.timeout_ms,
-            )
+            with observe_phase("rerank"):
+                score_map, rr_lat = rerank_remote(
+                    req.query,
+                    candidates,
+                    timeout_ms=timeout_ms,
+                )
             rr_t1 = time.perf_counter()
 
             # prefer server-reported latency if present, else local measured
@@ -183,21 +567,92 @@ def semantic_search(req: SearchRequest):
     # 1) embed query
     # ----------------
     try:
-        qvec = embed_texts([req.query])[0]
+        with observe_phase("embed"):
+            qvec = embed_texts([req.query])[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Embedding failed: {e}")
 
     # ----------------
     # 2) filters
     # ----------------
-    doc_id = req.filters.doc_id if req.filters else None
-    pipeline_version = req.filters.pipeline_version if req.filters else None
-    qfilter = build_filter(doc_id=doc_id, pipeline_version=pipeline_version)
+    match, ranges = filter_spec(req.filters)
+    qfilter = build_filter(match=match, ranges=ranges)
 
     mode = req.retrieval.mode
     dense_top_k = req.retrieval.dense_top_k
     bm25_top_k = req.retrieval.bm25_top_k
     rrf_k = req.retrieval.rrf_k
+    search_params = build_search_params(
+        hnsw_ef=req.retrieval.hnsw_ef,
+        exact=req.retrieval.exact,
+        rescore=req.retrieval.rescore,
+        oversampling=req.retrieval.oversampling,
+    )
+
+    # ----------------
+    # 2b) hybrid on Qdrant sparse vectors: dense + BM25 prefetch, RRF on the server (one round-trip)
+    # ----------------
+    qdrant = get_qdrant()
+    lexical = _hybrid_lexical(req, qdrant) if mode == "hybrid" else None
+    if lexical == "sparse":
+        candidate_n = req.rerank.top_n if req.rerank.enabled else req.top_k
+        sparse_q = sparse_query_vector(req.query)
+        try:
+            with observe_phase("hybrid"):
+                fused_hits = hybrid_query(
+                    qdrant,
+                    QDRANT_COLLECTION,
+                    qvec,
+                    sparse_q,
+                    dense_limit=dense_top_k,
+                    sparse_limit=bm25_top_k,
+                    limit=candidate_n,
+                    rrf_k=rrf_k,
+                    qdrant_filter=qfilter,
+                    with_payload=FUSION_PAYLOAD_FIELDS,
+                    search_params=search_params,
+                )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Qdrant hybrid query failed: {e}")
+
+        candidates_items = [_item_from_dense_hit(h, float(getattr(h, "score", 0.0))) for h in fused_hits]
+        hydrated_n = _hydrate_inplace(candidates_items)
+        if req.include_payload:
+            for it in candidates_items:
+                if it.payload is not None:
+                    it.payload["fused_score"] = it.score
+
+        rerank_used, rerank_latency_ms, rerank_reason = _apply_rerank_inplace(candidates_items)
+        results = candidates_items[: req.top_k]
+
+        latency_ms = int((time.perf_counter() - t0) * 1000)
+        return SearchResponse(
+            query=req.query,
+            results=results,
+            debug=SearchDebug(
+                latency_ms=latency_ms,
+                collection=QDRANT_COLLECTION,
+                used_filter=bool(qfilter),
+                top_k=req.top_k,
+                mode="hybrid",
+                # fusion 在 server，拿不到各分支實際筆數（prefetch 上限見 dense_top_k / bm25_top_k）
+                dense_hits=None,
+                bm25_hits=None,
+                dense_top_k=dense_top_k,
+                bm25_top_k=bm25_top_k,
+                rrf_k=rrf_k if rrf_k_supported() else 0,
+                rerank_used=rerank_used,
+                rerank_latency_ms=rerank_latency_ms,
+                rerank_fallback_reason=rerank_reason,
+                breakers=breaker_states("rerank") if req.rerank.enabled else None,
+                candidates_n=len(candidates_items),
+                hydrated_n=hydrated_n,
+                lexical="sparse",
+                budget_ms=deadline.budget_ms,
+                budget_remaining_ms=deadline.remaining_ms(),
+                degradations=deadline.degradations,
+            ),
+        )
 
     # ----------------
     # 3) dense search
@@ -205,19 +660,19 @@ def semantic_search(req: SearchRequest):
     dense_hits = []
     dense_by_id = {}
     try:
-        qdrant = get_qdrant()
-
         # if rerank enabled, we need more candidates than top_k
         dense_limit = dense_top_k if mode == "hybrid" else (req.rerank.top_n if req.rerank.enabled else req.top_k)
 
-        dense_hits = search_points(
-            qdrant,
-            QDRANT_COLLECTION,
-            qvec,
-            limit=dense_limit,
-            qdrant_filter=qfilter,
-            with_payload=req.include_payload,
-        )
+        with observe_phase("dense"):
+            dense_hits = search_points(
+                qdrant,
+                QDRANT_COLLECTION,
+                qvec,
+                limit=dense_limit,
+                qdrant_filter=qfilter,
+                with_payload=FUSION_PAYLOAD_FIELDS,
+                search_params=search_params,
+            )
         for i, h in enumerate(dense_hits, start=1):
             dense_by_id[str(getattr(h, "id", ""))] = (i, h)
     except Exception as e:
@@ -228,6 +683,7 @@ def semantic_search(req: SearchRequest):
     # ----------------------------
     if mode != "hybrid":
         candidates_items = [_item_from_dense_hit(h, float(getattr(h, "score", 0.0))) for h in dense_hits]
+        hydrated_n = _hydrate_inplace(candidates_items)
 
         # rerank (optional)
         rerank_used, rerank_latency_ms, rerank_reason = _apply_rerank_inplace(candidates_items)
@@ -254,7 +710,12 @@ def semantic_search(req: SearchRequest):
                 rerank_used=rerank_used,
                 rerank_latency_ms=rerank_latency_ms,
                 rerank_fallback_reason=rerank_reason,
+                breakers=breaker_states("rerank") if req.rerank.enabled else None,
                 candidates_n=len(candidates_items),
+                hydrated_n=hydrated_n,
+                budget_ms=deadline.budget_ms,
+                budget_remaining_ms=deadline.remaining_ms(),
+                degradations=deadline.degradations,
             ),
         )
 
@@ -263,28 +724,34 @@ def semantic_search(req: SearchRequest):
     # ----------------
     bm25_rows = []
     bm25_by_id = {}
-    try:
-        bm25_rows = search_keyword(
-            req.query,
-            limit=bm25_top_k,
-            doc_id=doc_id,
-            pipeline_version=pipeline_version,
-        )
-        for i, r in enumerate(bm25_rows, start=1):
-            bm25_by_id[str(r["chunk_id"])] = (i, r)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"FTS keyword search failed: {e}")
+    if not deadline.allows(BUDGET_MIN_FTS_MS + BUDGET_TAIL_RESERVE_MS):
+        # dense 已經用掉 budget：只用 dense 排名做 fusion
+        deadline.degrade("fts_skipped")
+    else:
+        try:
+            with observe_phase("fts"):
+                bm25_rows = search_keyword(
+                    req.query,
+                    limit=bm25_top_k,
+                    match=match,
+                    ranges=ranges,
+                )
+            for i, r in enumerate(bm25_rows, start=1):
+                bm25_by_id[str(r["chunk_id"])] = (i, r)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"FTS keyword search failed: {e}")
 
     # ----------------
     # 6) hybrid: RRF fusion
     # ----------------
-    dense_rank = {pid: rank for pid, (rank, _) in dense_by_id.items()}
-    bm25_rank = {pid: rank for pid, (rank, _) in bm25_by_id.items()}
-    fused = rrf_fuse(dense_rank=dense_rank, bm25_rank=bm25_rank, rrf_k=rrf_k)
+    with observe_phase("fusion"):
+        dense_rank = {pid: rank for pid, (rank, _) in dense_by_id.items()}
+        bm25_rank = {pid: rank for pid, (rank, _) in bm25_by_id.items()}
+        fused = rrf_fuse(dense_rank=dense_rank, bm25_rank=bm25_rank, rrf_k=rrf_k)
 
-    # candidates: take top_n if rerank enabled, else top_k
-    candidate_n = req.rerank.top_n if req.rerank.enabled else req.top_k
-    fused_sorted = sorted(fused.items(), key=lambda x: x[1], reverse=True)[:candidate_n]
+        # candidates: take top_n if rerank enabled, else top_k
+        candidate_n = req.rerank.top_n if req.rerank.enabled else req.top_k
+        fused_sorted = sorted(fused.items(), key=lambda x: x[1], reverse=True)[:candidate_n]
 
     candidates_items: list[SearchResultItem] = []
     for pid, fused_score in fused_sorted:
@@ -295,12 +762,17 @@ def semantic_search(req: SearchRequest):
             _, r = bm25_by_id[pid]
             it = _item_from_bm25_row(pid, r, float(fused_score))
 
-        # keep fused score in payload for debugging if you want (only when include_payload)
-        if req.include_payload and it.payload is not None:
-            it.payload["fused_score"] = float(fused_score)
-
         candidates_items.append(it)
 
+    # only the final candidates (top_n for rerank, else top_k) pay for text transfer
+    hydrated_n = _hydrate_inplace(candidates_items)
+
+    # keep fused score in payload for debugging if you want (only when include_payload)
+    if req.include_payload:
+        for it, (_, fused_score) in zip(candidates_items, fused_sorted):
+            if it.payload is not None:
+                it.payload["fused_score"] = float(fused_score)
+
     # ----------------
     # 7) rerank (optional) then slice top_k
     # ----------------
@@ -326,11 +798,23 @@ def semantic_search(req: SearchRequest):
             rerank_used=rerank_used,
             rerank_latency_ms=rerank_latency_ms,
             rerank_fallback_reason=rerank_reason,
+            breakers=breaker_states("rerank") if req.rerank.enabled else None,
             candidates_n=len(candidates_items),
+            hydrated_n=hydrated_n,
+            lexical="fts",
+            budget_ms=deadline.budget_ms,
+            budget_remaining_ms=deadline.remaining_ms(),
+            degradations=deadline.degradations,
         ),
     )
 
-def call_llm_for_answer(prompt: str, *, return_meta: bool = False):
+def _hybrid_lexical(req: SearchRequest, qdrant) -> str:
+    choice = req.retrieval.lexical or HYBRID_LEXICAL
+    if choice in ("sparse", "fts"):
+        return choice
+    return "sparse" if collection_has_sparse(qdrant, QDRANT_COLLECTION) else "fts"
+
+def call_llm_for_answer(prompt: str, *, return_meta: bool = False, timeout: float = 60):
     llm_url = os.getenv("LLM_API_URL", "").strip()
 
     # fallback：不呼叫遠端 LLM
@@ -342,7 +826,7 @@ def call_llm_for_answer(prompt: str, *, return_meta: bool = False):
 
     try:
         # 你原本呼叫 model_api 的邏輯放這裡（保留你原本的實作）
-        answer, err = call_llm(prompt, timeout=60)
+        answer, err = call_llm(prompt, timeout=timeout)
         if err:
             raise RuntimeError(err)
         if return_meta:
@@ -356,8 +840,46 @@ def call_llm_for_answer(prompt: str, *, return_meta: bool = False):
         return answer
 
 
+def _pack_answer_context(
+    hits, max_tokens: Optional[int], max_chars: Optional[int], fill_gaps: int, deadline: Deadline
+) -> Dict[str, Any]:
+    """
+    search hits -> pack_context blocks。
+    同 doc 兩個命中之間缺 <= fill_gaps 個 chunk 時，用一次 Qdrant retrieve 補上（point id 可由 doc_id + chunk_index 算出）；
+    補失敗 / budget 不夠就照原本的命中 pack。
+    """
+    items = [
+        {
+            "chunk_id": h.chunk_id,
+            "doc_id": getattr(h, "doc_id", None),
+            "chunk_index": getattr(h, "chunk_index", None),
+            "text": getattr(h, "text", None) or "",
+        }
+        for h in hits
+    ]
+
+    def fetch(wanted: Dict[str, List[int]]) -> List[Dict[str, Any]]:
+        if not deadline.allows(BUDGET_MIN_GAP_FILL_MS + BUDGET_MIN_LLM_MS):
+            deadline.degrade("gap_fill_skipped")
+            return []
+        ids = [chunk_point_id(doc_id, i) for doc_id, idxs in wanted.items() for i in idxs]
+        try:
+            payloads = retrieve_payloads(get_qdrant(), QDRANT_COLLECTION, ids, fields=["doc_id", "chunk_index", "text"])
+        except Exception:
+            deadline.degrade("gap_fill_failed")
+            return []
+        return [{"chunk_id": pid, **p} for pid, p in payloads.items()]
+
+    return pack_context(items, max_tokens=max_tokens, max_chars=max_chars, max_gap=fill_gaps, fetch=fetch)
+
+
 @app.post("/v1/answer", response_model=AnswerResponse)
-def answer_v1(req: AnswerRequest):
+def answer_v1(req: AnswerRequest, x_request_budget_ms: Optional[int] = Header(None)):
+    deadline = Deadline.from_request(x_request_budget_ms, req.budget_ms)
+    return _single_flight("answer", req, deadline, lambda: _answer(req, deadline), AnswerResponse)
+
+
+def _answer(req: AnswerRequest, deadline: Deadline) -> AnswerResponse:
     t0 = time.perf_counter()
 
     # 1) run search (reuse /v1/search logic by direct function call)
@@ -370,7 +892,8 @@ def answer_v1(req: AnswerRequest):
             rerank=req.rerank,
             include_payload=True,
         )
-        search_resp = semantic_search(search_req)  # <-- your /v1/search handler in same file
+        # search 最多用 BUDGET_SEARCH_SHARE，其餘留給 LLM（search 提早結束的時間也會留給 LLM）
+        search_resp = _semantic_search(search_req, deadline.child(BUDGET_SEARCH_SHARE))
     except HTTPException:
         raise
     except Exception as e:
@@ -389,6 +912,20 @@ def answer_v1(req: AnswerRequest):
     if getattr(req, "gen", None) and getattr(req.gen, "max_context_chars", None):
         max_ctx = int(req.gen.max_context_chars)
 
+    # packing 的 token 預算：沒給就只用字元上限（不以 4 字元 / token 換算，CJK 會被砍成 1/4）
+    max_tokens = req.gen.max_context_tokens
+
+    # budget 不夠跑完整 context 時，依剩餘時間等比例縮小 context（prefill 時間 ~ context 長度）
+    remaining_ms = deadline.remaining_ms()
+    if remaining_ms is not None and remaining_ms < BUDGET_LLM_FULL_CONTEXT_MS:
+        ratio = remaining_ms / BUDGET_LLM_FULL_CONTEXT_MS
+        shrunk = max(500, int(max_ctx * ratio))
+        if shrunk < max_ctx:
+            max_ctx = shrunk
+            if max_tokens is not None:
+                max_tokens = max(125, int(max_tokens * ratio))  # 下限同字元的 500（約 125 個英文 token）
+            deadline.degrade("context_shrunk")
+
     cur_len = 0
 
     for h in hits[: req.top_k]:
@@ -407,6 +944,9 @@ def answer_v1(req: AnswerRequest):
             )
         )
 
+        if req.gen.packing:
+            continue  # contexts 在迴圈後一次 pack
+
         # ✅ contexts：只餵「純文字 chunk」給 LLM（避免把 citations dict 印進 prompt）
         chunk_text = (getattr(h, "text", None) or "").strip()
         if not chunk_text:
@@ -423,6 +963,16 @@ def answer_v1(req: AnswerRequest):
         contexts.append(block)
         cur_len += len(block)
 
+    packing_stats = None
+    context_tokens = None
+    if req.gen.packing:
+        packed = _pack_answer_context(
+            hits[: req.top_k], max_tokens, None if max_tokens else max_ctx, req.gen.fill_gaps, deadline
+        )
+        contexts = [render_blocks(packed["blocks"])] if packed["blocks"] else []
+        packing_stats = packed["stats"]
+        context_tokens = packing_stats["tokens"]
+
     # 3) prompt：乾淨、可追溯、RAG 友善
     chunks_section = "\n".join(contexts) if contexts else "(no chunks)"
 
@@ -436,7 +986,17 @@ def answer_v1(req: AnswerRequest):
     )
     # 3) LLM generate
     t1 = perf_counter()
-    answer_text, llm_used, llm_reason = call_llm_for_answer(prompt, return_meta=True)
+    if not deadline.allows(BUDGET_MIN_LLM_MS):
+        deadline.degrade("llm_skipped")
+        llm_reason = "latency budget exhausted"
+        answer_text, llm_used = f"(fallback) {llm_reason}\n\n{prompt}", False
+    else:
+        with observe_phase("llm"):
+            answer_text, llm_used, llm_reason = call_llm_for_answer(
+                prompt,
+                return_meta=True,
+                timeout=deadline.cap_ms(60_000) / 1000.0,
+            )
     llm_latency_ms = int((perf_counter() - t1) * 1000)
 
     # 4) debug
@@ -456,6 +1016,11 @@ def answer_v1(req: AnswerRequest):
             used_chunk_ids=used_chunk_ids,
             llm_used=llm_used,
             llm_fallback_reason=llm_reason,
+            breakers={**(getattr(debug, "breakers", None) or {}), **breaker_states("llm")},
+            budget_ms=deadline.budget_ms,
+            degradations=deadline.degradations,
+            context_tokens=context_tokens,
+            packing=packing_stats,
         ),
     )
 
@@ -537,45 +1102,7 @@ def reindex_fts(batch_size: int = 256):
                 pid = str(getattr(p, "id", ""))
 
                 payload = getattr(p, "payload", None) or {}
-                doc_id = payload.get("doc_id")
-                pv = payload.get("pipeline_version")
-                chunk_index = payload.get("chunk_index")
-
-                # these might or might not exist in payload depending on your pipeline
-                source_file = payload.get("source_file") or payload.get("source")  # fallback
-                job_id = payload.get("job_id")
-
-                text = payload.get("text") or ""
-                if not isinstance(text, str):
-                    text = str(text)
-
-                # searchable content = text + selected metadata (keyword-friendly)
-                # NOTE: avoid ':' tokenization pitfalls by also adding space-separated variants
-                parts = [text]
-                if doc_id:
-                    parts.append(f"doc_id {doc_id}")
-                if source_file:
-                    parts.append(f"source_file {source_file}")
-                if job_id:
-                    parts.append(f"job_id {job_id}")
-                if pv:
-                    parts.append(f"pipeline_version {pv}")
-
-                content = "\n".join([x for x in parts if x])
-
-                chunks.append(
-                    {
-                        "chunk_id": pid,
-                        "doc_id": doc_id,
-                        "pipeline_version": pv,
-                        "chunk_index": chunk_index,
-                        "source_file": source_file,
-                        "job_id": job_id,
-                        "content": content,
-                        # keep raw text too (optional)
-                        "text": text,
-                    }
-                )
+                chunks.append(fts_row(pid, payload))
 
             # 3) write to sqlite
             try:
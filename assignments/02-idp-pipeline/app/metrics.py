@@ -0,0 +1,240 @@
+import glob
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Optional, Tuple
+
+from app import tracing
+
+try:  # optional: metrics are a no-op when prometheus_client is missing
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST,
+        REGISTRY,
+        CollectorRegistry,
+        Counter,
+        Histogram,
+        generate_latest,
+        multiprocess,
+        start_http_server,
+    )
+    from prometheus_client.core import GaugeMetricFamily
+    from prometheus_client.mmap_dict import MmapedDict
+except ImportError:
+    Counter = Histogram = None
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# RQ worker 每個 job fork 一個 work-horse，metrics 要靠 multiprocess mode 匯總
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "").strip()
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, *args, **kwargs):
+        pass
+
+    def inc(self, *args, **kwargs):
+        pass
+
+
+def _histogram(name: str, doc: str, labels: Iterable[str], buckets=_LATENCY_BUCKETS):
+    if Histogram is None:
+        return _NoopMetric()
+    return Histogram(name, doc, list(labels), buckets=buckets)
+
+
+def _counter(name: str, doc: str, labels: Iterable[str]):
+    if Counter is None:
+        return _NoopMetric()
+    return Counter(name, doc, list(labels))
+
+
+HTTP_LATENCY = _histogram(
+    "idp_http_request_seconds", "API request latency", ["method", "endpoint", "status"]
+)
+SEARCH_PHASE_LATENCY = _histogram(
+    "idp_search_phase_seconds", "Search/answer phase latency", ["phase"]
+)
+STAGE_LATENCY = _histogram(
+    "idp_pipeline_stage_seconds", "Pipeline stage wall time", ["stage"], buckets=_STAGE_BUCKETS
+)
+OUTBOUND_LATENCY = _histogram(
+    "idp_outbound_seconds", "Outbound dependency call latency", ["target", "op", "outcome"]
+)
+JOBS_TOTAL = _counter("idp_jobs_total", "Finished jobs by route and outcome", ["route", "outcome"])
+CACHE_REQUESTS = _counter("idp_cache_requests_total", "Cache lookups", ["cache", "result"])
+SINGLEFLIGHT = _counter(
+    "idp_singleflight_total", "Single-flight outcomes (leader / local / remote / timeout / unshared)", ["kind", "role"]
+)
+
+
+@contextmanager
+def observe(metric, **labels):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric.labels(**labels).observe(time.perf_counter() - t0)
+
+
+@contextmanager
+def track_outbound(target: str, op: str = "call"):
+    """
+    Time an outbound call (OCR/VLM/LLM/rerank/Qdrant/SQLite).
+    Also usable as a decorator: @track_outbound("qdrant", "search")
+    """
+    t0 = time.perf_counter()
+    outcome = "error"
+    try:
+        with tracing.span(f"{target}.{op}", **{"peer.service": target}):
+            yield
+        outcome = "ok"
+    finally:
+        OUTBOUND_LATENCY.labels(target=target, op=op, outcome=outcome).observe(time.perf_counter() - t0)
+
+
+def observe_phase(phase: str):
+    return observe(SEARCH_PHASE_LATENCY, phase=phase)
+
+
+def record_stage(stage: str, wall_ms: float):
+    STAGE_LATENCY.labels(stage=stage).observe(wall_ms / 1000.0)
+
+
+def record_job(route: str, outcome: str):
+    JOBS_TOTAL.labels(route=route or "unknown", outcome=outcome).inc()
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def record_singleflight(kind: str, role: str):
+    SINGLEFLIGHT.labels(kind=kind, role=role).inc()
+
+
+# ----------------------------
+# scrape-time collectors / exposition
+# ----------------------------
+
+class QueueDepthCollector:
+    """
+    Reads RQ queue depth / started-job counts at scrape time (no background polling).
+    """
+
+    def __init__(self, queues):
+        self._queues = list(queues)
+
+    def collect(self):
+        depth = GaugeMetricFamily("idp_queue_depth", "Jobs waiting in RQ queue", labels=["queue"])
+        started = GaugeMetricFamily("idp_queue_started", "Jobs currently running", labels=["queue"])
+        for q in self._queues:
+            try:
+                depth.add_metric([q.name], q.count)
+                started.add_metric([q.name], q.started_job_registry.count)
+            except Exception:
+                continue
+        yield depth
+        yield started
+
+
+class _DefaultRegistryProxy:
+    # expose everything registered on the global REGISTRY inside a per-scrape registry
+    def collect(self):
+        return REGISTRY.collect()
+
+
+# ----------------------------
+# Multiprocess 檔案壓縮
+#   每個 work-horse（每個 job 一個 pid）各留一份 counter_<pid>.db / histogram_<pid>.db，
+#   scrape 要讀的檔案數會隨處理過的 job 數一直長。worker 的 maintenance 週期把已結束 pid 的檔案
+#   加總進 <type>_compacted.db 後刪掉：counter 與 histogram（bucket / sum / count，檔案裡的 bucket
+#   不是累積值）都可以直接相加，scrape 結果不變。
+#   只處理本 process 的 exporter 讀的目錄（一個 worker 一個目錄，見 worker._reset_multiproc_dir）；
+#   壓縮與 scrape 共用 _multiproc_lock，scrape 不會看到加了兩次或被刪到一半的檔案。
+# ----------------------------
+_multiproc_lock = threading.Lock()
+_COMPACTED_SUFFIX = "compacted"
+_COMPACTABLE_TYPES = ("counter", "histogram", "summary")
+
+
+class _LockedMultiProcessCollector:
+    def __init__(self, path: str):
+        self._collector = multiprocess.MultiProcessCollector(None, path=path)
+
+    def collect(self):
+        with _multiproc_lock:
+            return list(self._collector.collect())
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def compact_dead_pid_files(path: str = PROMETHEUS_MULTIPROC_DIR) -> int:
+    """已結束 pid 的 counter / histogram / summary 檔加總進 <type>_compacted.db；回傳刪掉的檔案數"""
+    if not path or Histogram is None:
+        return 0
+    removed = 0
+    with _multiproc_lock:
+        for typ in _COMPACTABLE_TYPES:
+            dead = []
+            for f in glob.glob(os.path.join(path, f"{typ}_*.db")):
+                pid = os.path.basename(f)[len(typ) + 1 : -3]
+                if pid.isdigit() and not _pid_alive(int(pid)):
+                    dead.append(f)
+            if not dead:
+                continue
+            target = MmapedDict(os.path.join(path, f"{typ}_{_COMPACTED_SUFFIX}.db"))
+            try:
+                for f in dead:
+                    for key, value, timestamp, _ in MmapedDict.read_all_values_from_file(f):
+                        total, _ = target.read_value(key)
+                        target.write_value(key, total + value, timestamp)
+            finally:
+                target.close()
+            for f in dead:
+                os.remove(f)
+                removed += 1
+    return removed
+
+
+def build_registry(extra_collectors: Iterable = ()):
+    if Histogram is None:
+        return None
+    registry = CollectorRegistry()
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry.register(_LockedMultiProcessCollector(PROMETHEUS_MULTIPROC_DIR))
+    else:
+        registry.register(_DefaultRegistryProxy())
+    for c in extra_collectors:
+        registry.register(c)
+    return registry
+
+
+def render_latest(extra_collectors: Iterable = ()) -> Tuple[bytes, str]:
+    registry = build_registry(extra_collectors)
+    if registry is None:
+        return b"# prometheus_client not installed\n", CONTENT_TYPE_LATEST
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def start_exporter(port: int, extra_collectors: Iterable = ()) -> Optional[object]:
+    """
+    Standalone /metrics HTTP server (used by the RQ worker process).
+    """
+    registry = build_registry(extra_collectors)
+    if registry is None:
+        return None
+    return start_http_server(port, registry=registry)
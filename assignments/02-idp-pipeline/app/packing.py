@@ -0,0 +1,189 @@
+import re
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from app.indexing import CHUNK_OVERLAP
+
+# ----------------------------
+# Context packing for /v1/answer
+#   hits（rank 順序）→ 依 doc_id 分組 → 連續 chunk_index 合併成一段（去掉 chunk 間重疊的文字）
+#   → 小缺口可用一次 bulk retrieve 補上 → 依 token 預算塞進 prompt
+# ----------------------------
+
+# CJK 大約 1 字 1 token，其他語言約 4 字元 1 token（不載 tokenizer，誤差對預算夠用）
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+CHARS_PER_TOKEN = 4
+# 剩餘預算低於此值就不再塞截斷的尾巴（太碎沒有幫助）
+MIN_TAIL_TOKENS = 20
+
+
+def approx_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + -(-(len(text) - cjk) // CHARS_PER_TOKEN)
+
+
+def _truncate_to_tokens(text: str, tokens: int) -> str:
+    # 二分找最長的前綴
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if approx_tokens(text[:mid]) <= tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+
+def overlap_len(a: str, b: str, max_overlap: int = CHUNK_OVERLAP) -> int:
+    """a 的結尾與 b 的開頭重疊的字元數（chunk_text 切出來的相鄰 chunk 正好重疊 CHUNK_OVERLAP）"""
+    n = min(len(a), len(b), max_overlap)
+    if n and a.endswith(b[:n]):
+        return n
+    for k in range(n - 1, 0, -1):
+        if a.endswith(b[:k]):
+            return k
+    return 0
+
+
+def gap_indices(hits: Sequence[Dict[str, Any]], max_gap: int) -> Dict[str, List[int]]:
+    """
+    同一 doc 內，兩個命中 chunk 之間缺 <= max_gap 個 chunk → 回傳要補的 {doc_id: [chunk_index, ...]}
+    """
+    by_doc: Dict[str, set] = {}
+    for h in hits:
+        if h.get("doc_id") is not None and h.get("chunk_index") is not None:
+            by_doc.setdefault(h["doc_id"], set()).add(int(h["chunk_index"]))
+    out: Dict[str, List[int]] = {}
+    if max_gap <= 0:
+        return out
+    for doc_id, idxs in by_doc.items():
+        ordered = sorted(idxs)
+        missing = []
+        for a, b in zip(ordered, ordered[1:]):
+            if 1 < b - a <= max_gap + 1:
+                missing.extend(range(a + 1, b))
+        if missing:
+            out[doc_id] = missing
+    return out
+
+
+def pack_context(
+    hits: Sequence[Dict[str, Any]],
+    *,
+    max_tokens: Optional[int] = None,
+    max_chars: Optional[int] = None,
+    max_gap: int = 0,
+    fetch: Optional[Callable[[Dict[str, List[int]]], List[Dict[str, Any]]]] = None,
+) -> Dict[str, Any]:
+    """
+    hits: [{"chunk_id", "doc_id", "chunk_index", "text"}]（rank 順序，rank 0 最相關）
+    fetch: {doc_id: [chunk_index]} -> 補缺口用的 chunk（同樣欄位）；一次 bulk 取回，失敗就不補
+    回傳 {"blocks": [{"doc_id", "chunk_ids", "first_index", "last_index", "text", "tokens"}], "stats": {...}}
+
+    max_tokens / max_chars：預算（None = 不限）；兩個都給時兩個都要滿足。
+    只有字元上限時不換算成 token：CJK 1 字 ≈ 1 token，用 4 字元 / token 換算會讓中文 context 少 4 倍。
+    block 依其中最好的 rank 排序；預算不夠時最後一段截斷後停止。
+    """
+    chunks: Dict[Any, Dict[str, Any]] = {}
+    standalone: List[Dict[str, Any]] = []
+    for rank, h in enumerate(hits):
+        text = h.get("text") or ""  # 不 strip：重疊比對需要原始 chunk 文字
+        if not text.strip():
+            continue
+        item = {**h, "text": text, "rank": rank}
+        if h.get("doc_id") is None or h.get("chunk_index") is None:
+            standalone.append(item)
+            continue
+        key = (h["doc_id"], int(h["chunk_index"]))
+        if key not in chunks:
+            chunks[key] = item
+
+    gap_filled = 0
+    if fetch is not None and max_gap > 0:
+        wanted = gap_indices(list(chunks.values()), max_gap)
+        if wanted:
+            for c in fetch(wanted) or []:
+                key = (c.get("doc_id"), c.get("chunk_index"))
+                if key[0] is None or key[1] is None or (key[0], int(key[1])) in chunks:
+                    continue
+                text = c.get("text") or ""
+                if text.strip():
+                    chunks[(key[0], int(key[1]))] = {**c, "text": text, "rank": None}
+                    gap_filled += 1
+
+    # 同 doc 連續 chunk_index → 一個 block
+    blocks: List[Dict[str, Any]] = []
+    overlap_removed = 0
+    cur: Optional[Dict[str, Any]] = None
+    for (doc_id, idx) in sorted(chunks, key=lambda k: (str(k[0]), k[1])):
+        c = chunks[(doc_id, idx)]
+        if cur is not None and cur["doc_id"] == doc_id and cur["last_index"] == idx - 1:
+            ov = overlap_len(cur["parts"][-1], c["text"])
+            overlap_removed += ov
+            cur["parts"].append(c["text"][ov:])
+            cur["chunk_ids"].append(c["chunk_id"])
+            cur["last_index"] = idx
+        else:
+            cur = {"doc_id": doc_id, "chunk_ids": [c["chunk_id"]], "first_index": idx, "last_index": idx,
+                   "parts": [c["text"]], "rank": None}
+            blocks.append(cur)
+        if c["rank"] is not None and (cur["rank"] is None or c["rank"] < cur["rank"]):
+            cur["rank"] = c["rank"]
+    for c in standalone:
+        blocks.append({"doc_id": c.get("doc_id"), "chunk_ids": [c["chunk_id"]], "first_index": c.get("chunk_index"),
+                       "last_index": c.get("chunk_index"), "parts": [c["text"]], "rank": c["rank"]})
+    # 只有補進來的 chunk（沒有命中）組成的 block 不會出現：缺口一定夾在兩個命中之間
+    blocks.sort(key=lambda b: b["rank"] if b["rank"] is not None else len(hits))
+
+    out: List[Dict[str, Any]] = []
+    used = 0
+    used_chars = 0
+    truncated = False
+    for b in blocks:
+        text = "".join(b.pop("parts"))
+        b.pop("rank")
+        header = "".join(f"[{cid}]" for cid in b["chunk_ids"])
+        header_tokens = approx_tokens(header) + 1
+        header_chars = len(header) + 2  # render_blocks："header\ntext\n"
+        tokens = header_tokens + approx_tokens(text)
+        chars = header_chars + len(text)
+        if (max_tokens is not None and used + tokens > max_tokens) or (
+            max_chars is not None and used_chars + chars > max_chars
+        ):
+            remain = max_tokens - used - header_tokens if max_tokens is not None else None
+            if max_chars is not None:
+                text = text[: max(0, max_chars - used_chars - header_chars)]
+                remain = approx_tokens(text) if remain is None else min(remain, approx_tokens(text))
+            if remain >= MIN_TAIL_TOKENS:
+                text = _truncate_to_tokens(text, remain)
+                tokens = header_tokens + approx_tokens(text)
+                out.append({**b, "text": text, "tokens": tokens})
+                used += tokens
+                used_chars += header_chars + len(text)
+            truncated = True
+            break
+        out.append({**b, "text": text, "tokens": tokens})
+        used += tokens
+        used_chars += chars
+
+    return {
+        "blocks": out,
+        "stats": {
+            "chunks_in": len(hits),
+            "blocks": len(out),
+            "chunks_used": sum(len(b["chunk_ids"]) for b in out),
+            "gap_filled": gap_filled,
+            "overlap_chars_removed": overlap_removed,
+            "tokens": used,
+            "max_tokens": max_tokens,
+            "chars": used_chars,
+            "max_chars": max_chars,
+            "truncated": truncated,
+        },
+    }
+
+
+def render_blocks(blocks: Sequence[Dict[str, Any]]) -> str:
+    # header 列出這段包含的所有 chunk_id，LLM 可引用其中任何一個
+    return "\n".join(f"{''.join(f'[{cid}]' for cid in b['chunk_ids'])}\n{b['text'].strip()}\n" for b in blocks)
@@ -1,46 +1,351 @@
 import os
 import json
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from redis import Redis
+from redis import asyncio as aioredis
 from rq import Queue
 
+from app import blobstore
+
+try:  # optional: compact result encoding
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 
 redis_conn = Redis(host=REDIS_HOST, port=REDIS_PORT)  # ← 名字用 redis_conn
-queue = Queue(connection=redis_conn)
+# long-poll / SSE 用：XREAD BLOCK 等待時不佔 threadpool thread（只在 API 的 event loop 內使用）
+async_redis_conn = aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT)
+
+# priority -> RQ queue name（normal 沿用原本的 default queue）
+QUEUE_NAMES = {
+    "interactive": os.getenv("QUEUE_INTERACTIVE", "interactive"),
+    "normal": os.getenv("QUEUE_NORMAL", "default"),
+    "bulk": os.getenv("QUEUE_BULK", "bulk"),
+}
+queues = {p: Queue(name, connection=redis_conn) for p, name in QUEUE_NAMES.items()}
+queue = queues["normal"]
+
+# worker 取件權重（smooth weighted round-robin），格式：name:weight,...
+QUEUE_WEIGHTS = {
+    name: int(w)
+    for name, w in (
+        item.split(":", 1)
+        for item in os.getenv(
+            "QUEUE_WEIGHTS",
+            f"{QUEUE_NAMES['interactive']}:6,{QUEUE_NAMES['normal']}:3,{QUEUE_NAMES['bulk']}:1",
+        ).split(",")
+        if ":" in item
+    )
+}
+
+# job state TTL（秒），依 status 分開設定；0 = 不過期
+JOB_TTL_SEC = {
+    "queued": int(os.getenv("JOB_TTL_QUEUED_SEC", str(24 * 3600))),
+    "started": int(os.getenv("JOB_TTL_STARTED_SEC", str(24 * 3600))),
+    "retrying": int(os.getenv("JOB_TTL_STARTED_SEC", str(24 * 3600))),
+    "finished": int(os.getenv("JOB_TTL_FINISHED_SEC", str(24 * 3600))),
+    "failed": int(os.getenv("JOB_TTL_FAILED_SEC", str(7 * 24 * 3600))),
+}
+
+# result["payload"] 內較大的欄位改存 blob store，hash 只留 {"$blob": key, "bytes": n}
+RESULT_OFFLOAD_FIELDS = ("chunks", "raw")
+RESULT_OFFLOAD_MIN_BYTES = int(os.getenv("RESULT_OFFLOAD_MIN_BYTES", "2048"))
+ZSTD_LEVEL = int(os.getenv("RESULT_ZSTD_LEVEL", "3"))
+
+JOB_FIELDS = ("status", "result", "error")
+TERMINAL_STATUSES = ("finished", "failed")
+
+# blob 生命週期：blob 是 content-addressed，可能被多個 job 共用 → zset 記每個 blob「最晚」的過期時間
+#   （ZADD GT 只延長不縮短），worker 的 maintenance 週期刪掉已過期的 blob（sweep_expired_blobs）
+BLOB_EXPIRY_KEY = "blobs:expiry"
+# POST /v1/uploads 之後還沒建 job 的 blob 保留多久（建 job 後改跟著 job TTL）
+BLOB_UPLOAD_TTL_SEC = int(os.getenv("BLOB_UPLOAD_TTL_SEC", str(JOB_TTL_SEC["queued"])))
+BLOB_SWEEP_BATCH = int(os.getenv("BLOB_SWEEP_BATCH", "1000"))
+
+# 仍然過期才從 zset 移除（sweep 期間被其他 job 延長的 blob 保留）
+_BLOB_CLAIM_LUA = """
+local s = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if s and tonumber(s) <= tonumber(ARGV[2]) then
+  redis.call('ZREM', KEYS[1], ARGV[1])
+  return 1
+end
+return 0
+"""
+_scripts: Dict[int, Any] = {}
+
+# progress events：每個 job 一條 Redis stream（status 變化 + pipeline stage）
+JOB_EVENTS_MAXLEN = int(os.getenv("JOB_EVENTS_MAXLEN", "200"))
+
+def job_key(job_id: str) -> str:
+    # one hash per job: status / result / error / updated_at
+    return f"job:{job_id}"
+
+def job_events_key(job_id: str) -> str:
+    return f"job:{job_id}:events"
+
+def _xadd_event(pipe, job_id: str, event: str, data: Dict[str, Any], ttl: int):
+    key = job_events_key(job_id)
+    pipe.xadd(
+        key,
+        {"event": event, "data": json.dumps(data, ensure_ascii=False)},
+        maxlen=JOB_EVENTS_MAXLEN,
+        approximate=True,
+    )
+    if ttl > 0:
+        pipe.expire(key, ttl)
+
+# ----------------------------
+# result encoding
+#   b"Z" + zstd(msgpack) | b"M" + msgpack | b"J" + json
+# ----------------------------
+
+def encode_value(obj: Any) -> bytes:
+    if msgpack is not None:
+        packed = msgpack.packb(obj, use_bin_type=True)
+        if zstandard is not None:
+            return b"Z" + zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(packed)
+        return b"M" + packed
+    return b"J" + json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+def decode_value(v: Optional[bytes]) -> Any:
+    if not v:
+        return None
+    if isinstance(v, str):
+        v = v.encode("utf-8")
+    tag, body = v[:1], v[1:]
+    if tag == b"Z":
+        return msgpack.unpackb(zstandard.ZstdDecompressor().decompress(body), raw=False)
+    if tag == b"M":
+        return msgpack.unpackb(body, raw=False)
+    if tag == b"J":
+        return json.loads(body.decode("utf-8"))
+    # legacy：未加 tag 的 json 字串
+    return json.loads(v.decode("utf-8"))
+
+def _offload_payload(result: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """-> (result with large payload fields replaced by blob refs, blob keys written)"""
+    payload = result.get("payload")
+    if not isinstance(payload, dict):
+        return result, []
 
-def job_status_key(job_id: str) -> str:
-    return f"job:{job_id}:status"
+    slim = dict(payload)
+    keys: List[str] = []
+    for field in RESULT_OFFLOAD_FIELDS:
+        value = slim.get(field)
+        if value is None:
+            continue
+        blob = encode_value(value)
+        if len(blob) < RESULT_OFFLOAD_MIN_BYTES:
+            continue
+        key = blobstore.put_bytes(blob)
+        keys.append(key)
+        slim[field] = {"$blob": key, "bytes": len(blob)}
+    return {**result, "payload": slim}, keys
 
-def job_result_key(job_id: str) -> str:
-    return f"job:{job_id}:result"
+def touch_blobs(r, keys: Iterable[Optional[str]], ttl_sec: int) -> None:
+    """
+    Extend the blobs' expiry to now + ttl_sec (ttl_sec <= 0 = never). Never shortens:
+    a blob shared with a longer-lived job keeps that job's expiry. r may be a pipeline.
+    """
+    keys = [k for k in keys if k]
+    if not keys:
+        return
+    expire_at = float("inf") if ttl_sec <= 0 else time.time() + ttl_sec
+    r.zadd(BLOB_EXPIRY_KEY, {k: expire_at for k in keys}, gt=True)
 
-def job_error_key(job_id: str) -> str:
-    return f"job:{job_id}:error"
+def sweep_expired_blobs(r: Redis, *, now: Optional[float] = None, limit: int = BLOB_SWEEP_BATCH) -> int:
+    """Delete up to `limit` blobs whose expiry has passed. Returns the number removed."""
+    now = time.time() if now is None else now
+    script = _scripts.get(id(r))
+    if script is None:
+        script = _scripts[id(r)] = r.register_script(_BLOB_CLAIM_LUA)
+    removed = 0
+    for key in r.zrangebyscore(BLOB_EXPIRY_KEY, "-inf", now, start=0, num=limit):
+        key = _decode_str(key)
+        if int(script(keys=[BLOB_EXPIRY_KEY], args=[key, now])) == 1:
+            try:
+                blobstore.delete(key)
+            except ValueError:
+                pass  # 不是合法 key（手動寫進 zset 的）：只移除 zset entry
+            removed += 1
+    return removed
+
+def expand_result(result: Any) -> Any:
+    """
+    Inline offloaded blobs back into result["payload"] (for ?expand=true).
+    """
+    if not isinstance(result, dict) or not isinstance(result.get("payload"), dict):
+        return result
+    payload = dict(result["payload"])
+    for field, value in payload.items():
+        if isinstance(value, dict) and "$blob" in value:
+            try:
+                payload[field] = decode_value(blobstore.get_bytes(value["$blob"]))
+            except blobstore.BlobNotFound:
+                payload[field] = None
+    return {**result, "payload": payload}
+
+# ----------------------------
+# write：一個 pipeline（MULTI/EXEC）寫入 + 設 TTL
+# ----------------------------
+
+def set_job_state(
+    r: Redis,
+    job_id: str,
+    status: str,
+    *,
+    result: Optional[dict] = None,
+    error: Optional[str] = None,
+    blobs: Iterable[Optional[str]] = (),
+):
+    """
+    blobs：這個 job 用到的 blob（例如上傳的輸入檔）；與 result offload 出去的 blob 一起延長到 job 的 TTL
+    """
+    mapping: Dict[str, Any] = {"status": status, "updated_at": int(time.time())}
+    blob_keys = list(blobs)
+    if result is not None:
+        slim, offloaded = _offload_payload(result)
+        mapping["result"] = encode_value(slim)
+        blob_keys.extend(offloaded)
+    if error is not None:
+        mapping["error"] = error
+
+    key = job_key(job_id)
+    ttl = JOB_TTL_SEC.get(status, 0)
+    pipe = r.pipeline(transaction=True)
+    pipe.hset(key, mapping=mapping)
+    if error is None and status not in ("failed", "retrying"):
+        # retrying 時寫的 error 不能留到 started / finished（之後成功的 job 不該帶舊錯誤）
+        pipe.hdel(key, "error")
+    if ttl > 0:
+        pipe.expire(key, ttl)
+    else:
+        pipe.persist(key)
+    _xadd_event(pipe, job_id, "status", {"status": status, "ts": mapping["updated_at"]}, ttl)
+    touch_blobs(pipe, blob_keys, ttl)
+    pipe.execute()
+
+def publish_event(r: Redis, job_id: str, event: str, **data):
+    """
+    Append a progress event (e.g. event="stage", stage="embed") to the job stream.
+    """
+    if not job_id:
+        return
+    data.setdefault("ts", int(time.time()))
+    pipe = r.pipeline(transaction=False)
+    _xadd_event(pipe, job_id, event, data, JOB_TTL_SEC.get("started", 0))
+    pipe.execute()
+
+def read_events(
+    r: Redis,
+    job_id: str,
+    last_id: str = "0-0",
+    *,
+    block_ms: Optional[int] = None,
+    count: int = 100,
+) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """
+    XREAD after last_id (optionally blocking). Returns [(event_id, event, data), ...].
+    """
+    return _parse_events(r.xread({job_events_key(job_id): last_id}, count=count, block=block_ms))
+
+async def aread_events(
+    ar: "aioredis.Redis",
+    job_id: str,
+    last_id: str = "0-0",
+    *,
+    block_ms: Optional[int] = None,
+    count: int = 100,
+) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """Async read_events：blocking XREAD 只掛起 coroutine，不佔 thread。"""
+    return _parse_events(await ar.xread({job_events_key(job_id): last_id}, count=count, block=block_ms))
+
+def _parse_events(resp) -> List[Tuple[str, str, Dict[str, Any]]]:
+    out = []
+    for _, entries in resp or []:
+        for eid, fields in entries:
+            eid = _decode_str(eid)
+            fields = {_decode_str(k): _decode_str(v) for k, v in fields.items()}
+            try:
+                data = json.loads(fields.get("data") or "{}")
+            except ValueError:
+                data = {}
+            out.append((eid, fields.get("event") or "message", data))
+    return out
 
 def set_status(r: Redis, job_id: str, status: str):
-    r.set(job_status_key(job_id), status)
+    set_job_state(r, job_id, status)
 
 def set_result(r: Redis, job_id: str, result: dict):
-    r.set(job_result_key(job_id), json.dumps(result, ensure_ascii=False))
+    set_job_state(r, job_id, "finished", result=result)
 
 def set_error(r: Redis, job_id: str, err: str):
-    r.set(job_error_key(job_id), err)
+    set_job_state(r, job_id, "failed", error=err)
 
-def get_status(r: Redis, job_id: str):
-    v = r.get(job_status_key(job_id))
+# ----------------------------
+# read：HMGET 一次 round-trip
+# ----------------------------
+
+def _decode_str(v) -> Optional[str]:
     return v.decode("utf-8") if isinstance(v, (bytes, bytearray)) else v
 
-def get_result(r: Redis, job_id: str):
-    v = r.get(job_result_key(job_id))
-    if not v:
+def _state_from_values(fields: Iterable[str], values) -> Optional[Dict[str, Any]]:
+    state = dict(zip(fields, values))
+    if state.get("status") is None and all(v is None for v in state.values()):
         return None
-    if isinstance(v, (bytes, bytearray)):
-        v = v.decode("utf-8")
-    return json.loads(v)
+    out: Dict[str, Any] = {}
+    for f, v in state.items():
+        out[f] = decode_value(v) if f == "result" else _decode_str(v)
+    return out
+
+def get_job_state(r: Redis, job_id: str, fields: Iterable[str] = JOB_FIELDS) -> Optional[Dict[str, Any]]:
+    """
+    Returns {"status": ..., "result": ..., "error": ...} (only requested fields) or None if unknown/expired.
+    """
+    fields = tuple(fields)
+    return _state_from_values(fields, r.hmget(job_key(job_id), fields))
+
+async def aget_job_state(
+    ar: "aioredis.Redis", job_id: str, fields: Iterable[str] = JOB_FIELDS
+) -> Optional[Dict[str, Any]]:
+    fields = tuple(fields)
+    return _state_from_values(fields, await ar.hmget(job_key(job_id), fields))
+
+def get_job_states(
+    r: Redis,
+    job_ids: Iterable[str],
+    fields: Iterable[str] = JOB_FIELDS,
+) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Bulk version of get_job_state：所有 HMGET 放進同一個 pipeline，一次 round-trip。
+    Returns {job_id: state_or_None}
+    """
+    job_ids = list(job_ids)
+    fields = tuple(fields)
+    pipe = r.pipeline(transaction=False)
+    for job_id in job_ids:
+        pipe.hmget(job_key(job_id), fields)
+    values = pipe.execute() if job_ids else []
+    return {job_id: _state_from_values(fields, v) for job_id, v in zip(job_ids, values)}
+
+def get_status(r: Redis, job_id: str):
+    v = r.hget(job_key(job_id), "status")
+    return _decode_str(v)
+
+def get_result(r: Redis, job_id: str):
+    return decode_value(r.hget(job_key(job_id), "result"))
 
 def get_error(r: Redis, job_id: str):
-    v = r.get(job_error_key(job_id))
+    v = r.hget(job_key(job_id), "error")
     if not v:
         return None
-    return v.decode("utf-8") if isinstance(v, (bytes, bytearray)) else v
\ No newline at end of file
+    return _decode_str(v)
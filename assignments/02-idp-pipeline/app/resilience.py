@@ -0,0 +1,253 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import requests
+
+from app.queue import redis_conn
+
+T = TypeVar("T")
+
+# ----------------------------
+# Circuit breaker（per endpoint，狀態放 Redis：API replicas / fork 出來的 work-horse 共用）
+#   closed    -> 連續失敗 CB_FAILURE_THRESHOLD 次 -> open
+#   open      -> 直接 fail fast，CB_RESET_SEC 後進 half_open
+#   half_open -> 只放一個 probe；成功 -> closed，失敗 -> open
+#   只有 endpoint 本身有問題才算失敗（timeout / 連線錯誤 / 5xx）；4xx、回應解析失敗代表 endpoint 活著，
+#   不能因為幾個壞 request 就把所有人擋掉
+# ----------------------------
+CB_FAILURE_THRESHOLD = int(os.getenv("CB_FAILURE_THRESHOLD", "5"))
+CB_RESET_SEC = float(os.getenv("CB_RESET_SEC", "30"))
+CB_PROBE_TIMEOUT_SEC = int(os.getenv("CB_PROBE_TIMEOUT_SEC", "60"))
+
+# ----------------------------
+# Hedged requests（只用在 idempotent 呼叫）
+#   primary 超過 p95 還沒回來 -> 對下一個 replica 再送一次，取先成功的
+# ----------------------------
+HEDGE_TARGETS = {t.strip() for t in os.getenv("HEDGE_TARGETS", "").split(",") if t.strip()}
+HEDGE_DEFAULT_DELAY_MS = int(os.getenv("HEDGE_DEFAULT_DELAY_MS", "2000"))
+HEDGE_MIN_DELAY_MS = int(os.getenv("HEDGE_MIN_DELAY_MS", "50"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MAX_WORKERS = int(os.getenv("HEDGE_MAX_WORKERS", "16"))
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, name: str):
+        super().__init__(f"circuit open: {name}")
+        self.name = name
+
+
+def is_endpoint_failure(exc: BaseException) -> bool:
+    """timeout / 連線錯誤 / 5xx -> True（計入 breaker）"""
+    if isinstance(exc, requests.HTTPError):
+        status = getattr(exc.response, "status_code", None)
+        return status is None or status >= 500
+    return isinstance(exc, (requests.Timeout, requests.ConnectionError, TimeoutError, ConnectionError))
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        *,
+        failure_threshold: int = CB_FAILURE_THRESHOLD,
+        reset_sec: float = CB_RESET_SEC,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_sec = reset_sec
+        self.key = f"cb:{name}"
+        self.probe_key = f"cb:{name}:probe"
+
+    def _load(self) -> Dict[str, Any]:
+        raw = redis_conn.hgetall(self.key) or {}
+        data = {
+            (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+            for k, v in raw.items()
+        }
+        return {
+            "state": data.get("state", "closed"),
+            "failures": int(data.get("failures", 0) or 0),
+            "opened_at": float(data.get("opened_at", 0) or 0),
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        try:
+            d = self._load()
+        except Exception:
+            return {"name": self.name, "state": "unknown"}
+        state = d["state"]
+        if state == "open" and time.time() - d["opened_at"] >= self.reset_sec:
+            state = "half_open"
+        return {"name": self.name, "state": state, "failures": d["failures"]}
+
+    def admit(self) -> Tuple[bool, bool]:
+        """
+        -> (allowed, dirty)；dirty = Redis 裡有失敗計數或非 closed 狀態，成功時才需要 reset
+        （健康的 endpoint 每次成功都 DEL 會讓每個呼叫多一次 Redis 寫入）
+        """
+        try:
+            d = self._load()
+            dirty = d["state"] != "closed" or d["failures"] > 0
+            if d["state"] != "open":
+                return True, dirty
+            if time.time() - d["opened_at"] < self.reset_sec:
+                return False, dirty
+            # half-open：同一時間只放一個 probe
+            return bool(redis_conn.set(self.probe_key, "1", nx=True, ex=CB_PROBE_TIMEOUT_SEC)), dirty
+        except Exception:
+            # Redis 掛掉時不擋呼叫
+            return True, False
+
+    def allow(self) -> bool:
+        return self.admit()[0]
+
+    def record_success(self, dirty: bool = True):
+        # dirty=False：呼叫前讀到的是乾淨的 closed；期間別人記的失敗留到下次成功再清
+        if not dirty:
+            return
+        try:
+            redis_conn.delete(self.key, self.probe_key)
+        except Exception:
+            pass
+
+    def record_failure(self):
+        try:
+            pipe = redis_conn.pipeline(transaction=True)
+            pipe.hincrby(self.key, "failures", 1)
+            pipe.hget(self.key, "state")
+            failures, state = pipe.execute()
+            state = state.decode() if isinstance(state, bytes) else state
+            if failures >= self.failure_threshold or state == "open":
+                pipe = redis_conn.pipeline(transaction=True)
+                pipe.hset(self.key, mapping={"state": "open", "opened_at": time.time()})
+                pipe.delete(self.probe_key)
+                pipe.expire(self.key, int(self.reset_sec * 10) + 60)
+                pipe.execute()
+            else:
+                redis_conn.expire(self.key, int(self.reset_sec * 10) + 60)
+        except Exception:
+            pass
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    br = _breakers.get(name)
+    if br is None:
+        br = _breakers[name] = CircuitBreaker(name)
+    return br
+
+
+def breaker_states(*names: str) -> Dict[str, str]:
+    return {n: get_breaker(n).snapshot()["state"] for n in names}
+
+
+# ----------------------------
+# latency tracking（in-process，給 hedge delay 用）
+# ----------------------------
+_latencies: Dict[str, deque] = {}
+_lat_lock = threading.Lock()
+
+
+def record_latency(name: str, seconds: float):
+    with _lat_lock:
+        _latencies.setdefault(name, deque(maxlen=200)).append(seconds)
+
+
+def p95_sec(name: str) -> Optional[float]:
+    with _lat_lock:
+        samples = list(_latencies.get(name) or [])
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    samples.sort()
+    return samples[int(0.95 * (len(samples) - 1))]
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    # work-horse 是 fork 出來的：pool 的 thread 不會跟著過來，依 pid 重建
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def _hedged(name: str, fn: Callable[[str], T], urls: List[str]) -> T:
+    p95 = p95_sec(name)
+    delay = max(HEDGE_MIN_DELAY_MS / 1000.0, p95 if p95 is not None else HEDGE_DEFAULT_DELAY_MS / 1000.0)
+
+    ex = _get_executor()
+    # copy_context：讓 hedge thread 內的 span 仍掛在目前 trace 底下
+    pending = {ex.submit(contextvars.copy_context().run, fn, urls[0])}
+    done, pending = wait(pending, timeout=delay)
+    if done:
+        return next(iter(done)).result()
+
+    # primary 超過 p95：送到下一個 replica（只有一個 URL 時就送同一個）
+    pending.add(ex.submit(contextvars.copy_context().run, fn, urls[1 % len(urls)]))
+    first_error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            err = fut.exception()
+            if err is None:
+                return fut.result()
+            first_error = first_error or err
+    raise first_error
+
+
+def call_with_resilience(
+    name: str,
+    urls: List[str],
+    fn: Callable[[str], T],
+    *,
+    idempotent: bool = False,
+    is_failure: Callable[[BaseException], bool] = is_endpoint_failure,
+) -> T:
+    """
+    fn(url) does one request. Applies the circuit breaker for `name`, and
+    hedges to the next URL when idempotent and name is in HEDGE_TARGETS.
+    Raises CircuitOpenError without calling fn when the breaker is open.
+    Only exceptions for which is_failure() is True count against the breaker;
+    any other exception still proves the endpoint answered, so it counts as a success.
+    """
+    if not urls:
+        raise ValueError(f"no endpoint configured for {name}")
+
+    br = get_breaker(name)
+    allowed, dirty = br.admit()
+    if not allowed:
+        raise CircuitOpenError(name)
+
+    t0 = time.perf_counter()
+    try:
+        if idempotent and name in HEDGE_TARGETS:
+            result = _hedged(name, fn, urls)
+        else:
+            result = fn(urls[0])
+    except Exception as e:
+        if is_failure(e):
+            br.record_failure()
+        else:
+            br.record_success(dirty)  # half-open probe 也要放掉
+        raise
+    br.record_success(dirty)
+    record_latency(name, time.perf_counter() - t0)
+    return result
+
+
+def split_urls(value: str) -> List[str]:
+    """
+    "http://a,http://b" -> ["http://a", "http://b"]（第一個為 primary，其餘為 hedge replica）
+    """
+    return [u.strip() for u in (value or "").split(",") if u.strip()]
@@ -20,3 +20,45 @@ def rrf_fuse(
             s += 1.0 / (rrf_k + bm25_rank[pid])
         out[pid] = s
     return out
+
+
+# SearchFilters attribute -> payload field
+_MATCH_FIELDS = {
+    "doc_ids": "doc_id",
+    "pipeline_versions": "pipeline_version",
+    "input_types": "input_type",
+    "sources": "source",
+    "job_ids": "job_id",
+}
+_RANGE_FIELDS = ("chunk_index", "ingested_at")
+
+def filter_spec(filters: Any) -> Tuple[Dict[str, List[Any]], Dict[str, Dict[str, float]]]:
+    """
+    Flatten SearchFilters into (match, ranges) understood by both
+    qdrant_client.build_filter and fts_client.search_keyword.
+    """
+    match: Dict[str, List[Any]] = {}
+    ranges: Dict[str, Dict[str, float]] = {}
+    if filters is None:
+        return match, ranges
+
+    for single, field in (("doc_id", "doc_id"), ("pipeline_version", "pipeline_version")):
+        v = getattr(filters, single, None)
+        if v:
+            match.setdefault(field, []).append(v)
+
+    for attr, field in _MATCH_FIELDS.items():
+        values = getattr(filters, attr, None) or []
+        for v in values:
+            if v and v not in match.get(field, []):
+                match.setdefault(field, []).append(v)
+
+    for field in _RANGE_FIELDS:
+        r = getattr(filters, field, None)
+        if r is None:
+            continue
+        bounds = {k: v for k, v in r.model_dump().items() if v is not None}
+        if bounds:
+            ranges[field] = bounds
+
+    return match, ranges
@@ -1,6 +1,12 @@
+import os
 import re
-from typing import Tuple
-from .state import Route
+from typing import Optional, Tuple
+from .state import Route, JobPriority
+
+# 成本單位 ≈ 頁數；text 以每 2000 字元算一頁
+INTERACTIVE_MAX_COST = float(os.getenv("INTERACTIVE_MAX_COST", "2"))
+BULK_MIN_COST = float(os.getenv("BULK_MIN_COST", "20"))
+PDF_BYTES_PER_PAGE = int(os.getenv("PDF_BYTES_PER_PAGE", str(100 * 1024)))
 
 TABLE_HINTS = [
     "表格", "欄位", "列", "行", "csv", "excel", "xlsx", "tsv",
@@ -30,4 +36,49 @@ def decide_route(text: str) -> Tuple[Route, float, str]:
         return Route.ocr, 0.65, "Detected dense delimiters (csv-like)"
 
     # 4) 預設：VLM（偏視覺語意理解，之後可調）
-    return Route.vlm, 0.55, "Default route (no strong table hints)"
\ No newline at end of file
+    return Route.vlm, 0.55, "Default route (no strong table hints)"
+
+def estimate_cost(
+    text: str, input_type: str, page_count: Optional[int] = None, size_bytes: Optional[int] = None
+) -> float:
+    """
+    粗估 job 成本（≈ 頁數），只看 request 與檔案大小，不讀檔內容。
+    size_bytes：上傳的 blob 大小（有給就不用再 stat 檔案）
+    """
+    if input_type == "image":
+        return 1.0
+    if input_type == "pdf":
+        if page_count:
+            return float(page_count)
+        if size_bytes is None:
+            try:
+                size_bytes = os.path.getsize((text or "").strip())
+            except OSError:
+                return BULK_MIN_COST / 2  # 看不到檔案：當成中等大小
+        return max(1.0, size_bytes / PDF_BYTES_PER_PAGE)
+    if size_bytes is not None:
+        return max(0.1, size_bytes / 2000.0)
+    return max(0.1, len(text or "") / 2000.0)
+
+def decide_priority(
+    requested: Optional[JobPriority],
+    text: str,
+    input_type: str,
+    page_count: Optional[int] = None,
+    size_bytes: Optional[int] = None,
+) -> Tuple[JobPriority, float, str]:
+    """
+    Returns: (priority, estimated_cost, reason)
+    """
+    cost = estimate_cost(text, input_type, page_count, size_bytes)
+
+    if requested is not None:
+        if requested == JobPriority.interactive and cost > INTERACTIVE_MAX_COST:
+            return JobPriority.normal, cost, f"Interactive demoted: cost {cost:.1f} > {INTERACTIVE_MAX_COST}"
+        return requested, cost, "Priority set by request"
+
+    if cost <= INTERACTIVE_MAX_COST:
+        return JobPriority.interactive, cost, "Small job"
+    if cost >= BULK_MIN_COST:
+        return JobPriority.bulk, cost, "Large job"
+    return JobPriority.normal, cost, "Medium job"
@@ -1,11 +1,30 @@
 from pydantic import BaseModel, Field
 from typing import Any, Dict, List, Optional, Literal
-from .state import JobStatus, Route, InputType
+from .state import JobStatus, Route, InputType, JobPriority
+
+class DocOptions(BaseModel):
+    # Docling 昂貴功能的開關；只需要文字時可關掉（PDF_ENGINE=docling 才有作用）
+    ocr: bool = True               # Docling 內建 OCR（純文字層 PDF 不需要）
+    table_structure: bool = True   # 表格結構模型
 
 class CreateJobRequest(BaseModel):
-    text: str
+    # text：文字內容；image/pdf 時可放共用 volume 上的檔案路徑（舊用法）
+    text: str = ""
+    # blob_key：先 POST /v1/uploads 拿到的 sha256；有給時 worker 直接讀 blob（text 可省略）
+    blob_key: Optional[str] = Field(None, pattern=r"^[0-9a-f]{64}$")
     input_type: InputType = InputType.text
     route: Route = Route.auto   # auto/ocr/vlm
+    # None = 依估算成本自動分流；interactive 只給小 job（大 job 會被降級）
+    priority: Optional[JobPriority] = None
+    page_count: Optional[int] = Field(None, ge=1, description="pdf 頁數（有給會用來估算成本）")
+    doc_options: Optional[DocOptions] = None
+
+class UploadResponse(BaseModel):
+    blob_key: str
+    sha256: str
+    bytes: int
+    filename: Optional[str] = None
+    content_type: Optional[str] = None
 
 class CreateJobResponse(BaseModel):
     job_id: str
@@ -24,6 +43,22 @@ class GetJobResponse(BaseModel):
     result: Optional[Any] = None
     error: Optional[str] = None
 
+class JobsStatusRequest(BaseModel):
+    job_ids: List[str] = Field(..., min_length=1, max_length=10000)
+    # 預設只回 status/error；要 result 需明確指定（避免一次搬大量結果）
+    fields: List[Literal["status", "result", "error"]] = ["status", "error"]
+    expand: bool = False
+
+class JobStatusItem(BaseModel):
+    job_id: str
+    status: Optional[JobStatus] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+
+class JobsStatusResponse(BaseModel):
+    jobs: List[JobStatusItem]
+    missing: List[str]
+
 # ----------------------------
 # Day5: Semantic Search API v1
 # ----------------------------
@@ -33,15 +68,42 @@ class RerankConfig(BaseModel):
     timeout_ms: int = Field(2000, ge=200, le=20000)
     top_n: int = Field(50, ge=5, le=200)  # candidates size
 
+class RangeFilter(BaseModel):
+    gte: Optional[float] = None
+    lte: Optional[float] = None
+    gt: Optional[float] = None
+    lt: Optional[float] = None
+
 class SearchFilters(BaseModel):
     doc_id: Optional[str] = None
     pipeline_version: Optional[str] = None
 
+    # multi-value：同欄位內 OR，不同欄位之間 AND
+    doc_ids: Optional[List[str]] = None
+    pipeline_versions: Optional[List[str]] = None
+    input_types: Optional[List[str]] = None
+    sources: Optional[List[str]] = None
+    job_ids: Optional[List[str]] = None
+
+    # range
+    chunk_index: Optional[RangeFilter] = None
+    ingested_at: Optional[RangeFilter] = Field(None, description="epoch seconds")
+
 class RetrievalConfig(BaseModel):
     mode: Literal["dense", "hybrid"] = "dense"
     dense_top_k: int = Field(50, ge=1, le=200)
     bm25_top_k: int = Field(50, ge=1, le=200)
     rrf_k: int = Field(60, ge=1, le=200)
+    # hybrid 的關鍵字端：sparse = Qdrant BM25 sparse vector（一次 query，server 端 RRF）、fts = 本機 SQLite FTS
+    lexical: Optional[Literal["sparse", "fts"]] = Field(
+        None, description="Hybrid lexical backend; None = HYBRID_LEXICAL (auto: sparse when the collection has it)"
+    )
+
+    # Qdrant per-request search params（None = 用 collection 預設）
+    hnsw_ef: Optional[int] = Field(None, ge=4, le=4096, description="HNSW ef at query time (higher = better recall, slower)")
+    exact: bool = Field(False, description="Brute-force exact search (bypass HNSW)")
+    rescore: Optional[bool] = Field(None, description="Rescore quantized candidates with original vectors")
+    oversampling: Optional[float] = Field(None, ge=1.0, le=10.0, description="Fetch limit*oversampling quantized candidates before rescoring")
 
 class SearchRequest(BaseModel):
     query: str = Field(..., min_length=1, description="User query text")
@@ -53,6 +115,9 @@ class SearchRequest(BaseModel):
     include_payload: bool = True  # v1 先固定回 payload（含 text/lineage）
     rerank: RerankConfig = RerankConfig()
 
+    # end-to-end latency budget（header X-Request-Budget-Ms 優先）
+    budget_ms: Optional[int] = Field(None, ge=1, le=120000)
+
 class SearchResultItem(BaseModel):
     score: float
     chunk_id: str
@@ -71,15 +136,28 @@ class SearchDebug(BaseModel):
     top_k: int
 
     mode: str
-    dense_hits: int
-    bm25_hits: int
+    dense_hits: Optional[int]  # None：fusion 在 server（lexical=sparse），拿不到各分支實際筆數
+    bm25_hits: Optional[int]
     dense_top_k: int
     bm25_top_k: int
     rrf_k: int
     rerank_used: bool
     rerank_latency_ms: int
     rerank_fallback_reason: Optional[str] = None
+    breakers: Optional[Dict[str, str]] = None  # circuit breaker state（closed/open/half_open）
     candidates_n: int
+    hydrated_n: int = 0  # dense hits whose text/payload was fetched after fusion
+    # hybrid only: sparse | fts（sparse 時 fusion 在 server：dense_hits / bm25_hits 為 None，
+    # 兩個 prefetch 的上限看 dense_top_k / bm25_top_k；rrf_k=0 表示 server 不支援可調 k、用的是 server 預設值）
+    lexical: Optional[str] = None
+
+    # latency budget：degradations 依發生順序列出（fts_skipped / rerank_skipped / ...）
+    budget_ms: Optional[int] = None
+    budget_remaining_ms: Optional[int] = None
+    degradations: List[str] = Field(default_factory=list)
+
+    # single-flight：結果來自同時進來的另一個相同 request（latency / degradations 是那次執行的）
+    coalesced: bool = False
 
 class SearchResponse(BaseModel):
     query: str
@@ -91,6 +169,15 @@ class AnswerGenConfig(BaseModel):
     style: str = Field("normal", description="concise|normal")
     force_citations: bool = Field(True, description="If model returns no [chunk_id], append citations automatically")
 
+    # context packing：同 doc 連續 chunk 合併成一段、去掉 chunk 間重疊，依 token 預算塞 prompt
+    packing: bool = Field(True, description="Merge adjacent/overlapping chunks of the same doc (False = one block per chunk)")
+    max_context_tokens: Optional[int] = Field(
+        None, ge=100, le=32000, description="Token budget for the context; unset = capped by max_context_chars only"
+    )
+    fill_gaps: int = Field(
+        1, ge=0, le=3, description="Fetch up to N missing chunks between two hits of the same doc (0 = off)"
+    )
+
 class CitationItem(BaseModel):
     chunk_id: str
     score: float
@@ -111,6 +198,16 @@ class AnswerDebug(BaseModel):
     # ✅ 新增：讓 llm_latency_ms=0 可解釋
     llm_used: bool = False
     llm_fallback_reason: Optional[str] = None
+    breakers: Optional[Dict[str, str]] = None
+
+    budget_ms: Optional[int] = None
+    degradations: List[str] = Field(default_factory=list)
+
+    # context packing：blocks / gap_filled / overlap_chars_removed / tokens / truncated ...
+    context_tokens: Optional[int] = None
+    packing: Optional[Dict[str, Any]] = None
+
+    coalesced: bool = False
 
 class AnswerRequest(BaseModel):
     query: str = Field(..., min_length=1)
@@ -123,6 +220,8 @@ class AnswerRequest(BaseModel):
 
     gen: AnswerGenConfig = AnswerGenConfig()
 
+    budget_ms: Optional[int] = Field(None, ge=1, le=120000)
+
 class AnswerResponse(BaseModel):
     query: str
     answer: str
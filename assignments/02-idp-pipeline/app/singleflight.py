@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from app.metrics import record_singleflight
+
+T = TypeVar("T")
+
+# ----------------------------
+# Single-flight（/v1/search、/v1/answer）
+#   同一個 canonical request 同時進來多份時只算一次，其餘等第一份的結果：
+#   1) process 內：同 key 共用一個 Future
+#   2) 跨 API replica：Redis lock（SET NX PX）；拿到 lock 的算完把結果寫到 result key，
+#      其他 replica poll result key，lock 消失但沒有結果（leader 失敗 / 掛掉）就自己算
+#   只合併「正在算」的 request：leader 算完後 result 只留 SINGLEFLIGHT_RESULT_TTL_MS 給還在等的 follower
+#   shareable(result)=False 的結果（例如 leader 的 budget 不夠而降級）不分享，follower 依自己的條件重算
+# ----------------------------
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1") == "1"
+SINGLEFLIGHT_REDIS = os.getenv("SINGLEFLIGHT_REDIS", "1") == "1"  # 0 = 只做 process 內合併
+SINGLEFLIGHT_LOCK_TTL_MS = int(os.getenv("SINGLEFLIGHT_LOCK_TTL_MS", "30000"))  # leader 最長執行時間
+SINGLEFLIGHT_RESULT_TTL_MS = int(os.getenv("SINGLEFLIGHT_RESULT_TTL_MS", "2000"))
+SINGLEFLIGHT_POLL_MS = int(os.getenv("SINGLEFLIGHT_POLL_MS", "20"))
+
+_KEY_PREFIX = "sf"
+
+# 只刪自己的 lock（leader 超過 TTL 後別人可能已經拿到新的 lock）
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_inflight: Dict[str, Future] = {}
+_lock = threading.Lock()
+_scripts: Dict[int, Any] = {}
+
+
+def request_key(kind: str, payload: Dict[str, Any]) -> str:
+    """canonical JSON（key 排序、無空白）的 sha256；同樣語意的 request 欄位順序不同也會得到同一個 key"""
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return f"{kind}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+def _redis():
+    # 延遲 import：process 內合併不需要 Redis（單元測試也不需要）
+    from app.queue import redis_conn
+
+    return redis_conn
+
+
+def _release(redis_conn, key: str, token: str) -> None:
+    script = _scripts.get(id(redis_conn))
+    if script is None:
+        script = _scripts[id(redis_conn)] = redis_conn.register_script(_RELEASE_LUA)
+    script(keys=[key], args=[token])
+
+
+def _run_distributed(
+    key: str,
+    fn: Callable[[], T],
+    dumps: Callable[[T], str],
+    loads: Callable[[str], T],
+    wait_s: float,
+    shareable: Callable[[T], bool],
+) -> Tuple[T, bool]:
+    """-> (result, coalesced)；Redis 有問題時直接自己算（不因為合併層失敗而擋 request）"""
+    lock_key = f"{_KEY_PREFIX}:lock:{key}"
+    result_key = f"{_KEY_PREFIX}:result:{key}"
+    token = uuid.uuid4().hex
+    try:
+        redis_conn = _redis()
+        leader = bool(redis_conn.set(lock_key, token, nx=True, px=SINGLEFLIGHT_LOCK_TTL_MS))
+    except Exception:
+        return fn(), False
+
+    if leader:
+        try:
+            result = fn()
+            if shareable(result):
+                try:
+                    redis_conn.set(result_key, dumps(result), px=SINGLEFLIGHT_RESULT_TTL_MS)
+                except Exception:
+                    pass
+            return result, False
+        finally:
+            try:
+                _release(redis_conn, lock_key, token)
+            except Exception:
+                pass
+
+    # follower：poll result；leader 的 lock 消失但沒有結果 -> 自己算
+    expires = time.monotonic() + wait_s
+    try:
+        while time.monotonic() < expires:
+            pipe = redis_conn.pipeline(transaction=False)
+            pipe.get(result_key)
+            pipe.exists(lock_key)
+            raw, locked = pipe.execute()
+            if raw is not None:
+                result = loads(raw.decode() if isinstance(raw, bytes) else raw)
+                if shareable(result):
+                    return result, True
+                break
+            if not locked:
+                break
+            time.sleep(SINGLEFLIGHT_POLL_MS / 1000.0)
+    except Exception:
+        pass
+    return fn(), False
+
+
+def do(
+    kind: str,
+    key: str,
+    fn: Callable[[], T],
+    *,
+    dumps: Callable[[T], str],
+    loads: Callable[[str], T],
+    wait_s: Optional[float] = None,
+    shareable: Callable[[T], bool] = lambda result: True,
+) -> Tuple[T, bool]:
+    """
+    Run fn once per key across concurrent callers. Returns (result, coalesced).
+
+    coalesced=True means the result came from another caller's execution (same process or another
+    replica); a local follower receives the same object as the leader, so copy before mutating it.
+    The leader's exception is re-raised to local followers. wait_s bounds how long a follower waits
+    (default SINGLEFLIGHT_LOCK_TTL_MS) before computing on its own. A leader result for which
+    shareable() is False is never handed to followers: each of them runs fn itself.
+    """
+    if not SINGLEFLIGHT_ENABLED:
+        return fn(), False
+    if wait_s is None:
+        wait_s = SINGLEFLIGHT_LOCK_TTL_MS / 1000.0
+
+    with _lock:
+        fut = _inflight.get(key)
+        leader = fut is None
+        if leader:
+            fut = _inflight[key] = Future()
+
+    if not leader:
+        try:
+            result = fut.result(timeout=max(0.0, wait_s))
+        except FutureTimeout:
+            record_singleflight(kind, "timeout")
+            return fn(), False
+        if not shareable(result):
+            record_singleflight(kind, "unshared")
+            return fn(), False
+        record_singleflight(kind, "local")
+        return result, True
+
+    try:
+        if SINGLEFLIGHT_REDIS:
+            result, coalesced = _run_distributed(key, fn, dumps, loads, wait_s, shareable)
+        else:
+            result, coalesced = fn(), False
+        fut.set_result(result)
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+    record_singleflight(kind, "remote" if coalesced else "leader")
+    return result, coalesced
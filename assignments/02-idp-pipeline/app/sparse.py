@@ -0,0 +1,61 @@
+import os
+import re
+import zlib
+from collections import Counter
+from typing import Dict, List, Tuple
+
+# ----------------------------
+# BM25 sparse vectors（存在 Qdrant 的 named sparse vector，取代 API 容器內的 SQLite FTS）
+#   index：每個 chunk 的 term → hash index，value = BM25 的 TF 部分（含文件長度正規化）
+#   query：每個 query term value = 1
+#   IDF 由 Qdrant 依整個 collection 計算（SparseVectorParams(modifier=IDF)），新增文件不用重算舊向量
+# ----------------------------
+SPARSE_VECTOR_NAME = "bm25"
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# 平均 chunk 長度（token 數）；chunk 是固定 300 字元，英文約 50 詞、中文約 300 個 bigram
+BM25_AVGDL = float(os.getenv("BM25_AVGDL", "100"))
+
+_CJK = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+# group 1：CJK 連續字串；group 2：其他語言的字母數字串（底線、標點都當分隔）
+_TOKEN = re.compile(rf"([{_CJK}]+)|((?:(?![{_CJK}])[^\W_])+)")
+
+SparseVec = Tuple[List[int], List[float]]
+
+
+def tokenize(text: str) -> List[str]:
+    """小寫的字母數字詞；CJK 沒有空白分詞，切成相鄰兩字（bigram），單字則保留單字"""
+    tokens: List[str] = []
+    for m in _TOKEN.finditer((text or "").casefold()):
+        cjk = m.group(1)
+        if cjk is None:
+            tokens.append(m.group(2))
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i : i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+def term_index(token: str) -> int:
+    # crc32：跨 process / 版本穩定（不能用 hash()，有 PYTHONHASHSEED）
+    return zlib.crc32(token.encode("utf-8"))
+
+
+def _to_sparse(weights: Dict[int, float]) -> SparseVec:
+    indices = sorted(weights)
+    return indices, [weights[i] for i in indices]
+
+
+def doc_vector(text: str, *, k1: float = BM25_K1, b: float = BM25_B, avgdl: float = BM25_AVGDL) -> SparseVec:
+    """chunk text -> (indices, values)；hash 碰撞的 term 合併計數"""
+    tf = Counter(term_index(t) for t in tokenize(text))
+    dl = sum(tf.values())
+    if not dl:
+        return [], []
+    norm = k1 * (1 - b + b * dl / avgdl)
+    return _to_sparse({i: round(n * (k1 + 1) / (n + norm), 6) for i, n in tf.items()})
+
+
+def query_vector(text: str) -> SparseVec:
+    return _to_sparse({term_index(t): 1.0 for t in tokenize(text)})
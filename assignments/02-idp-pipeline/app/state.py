@@ -3,6 +3,7 @@ from enum import Enum
 class JobStatus(str, Enum):
     queued = "queued"
     started = "started"
+    retrying = "retrying"  # 這次 attempt 失敗，RQ 還會再 retry（非終態）
     finished = "finished"
     failed = "failed"
 
@@ -12,6 +13,11 @@ class Route(str, Enum):
     vlm = "vlm"
     pipeline = "pipeline"
 
+class JobPriority(str, Enum):
+    interactive = "interactive"
+    normal = "normal"
+    bulk = "bulk"
+
 class InputType(str, Enum):
     text = "text"
     image = "image"
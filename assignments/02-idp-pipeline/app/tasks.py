@@ -1,27 +1,42 @@
-import os, requests, uuid
+import os, requests
 import time
 import inspect
-import json
-import re
-from typing import Any, Dict, Optional, Tuple
-from hashlib import sha256
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
 from rq import get_current_job
 
-from .queue import redis_conn, set_status, set_result, set_error
+from .queue import redis_conn, set_job_state, publish_event
 from .state import JobStatus, Route
 from .router import decide_route
+from .instrument import StageRecorder
+from .metrics import record_stage, record_job
+from .admission import record_completion
+from .resilience import breaker_states, CircuitOpenError
+from . import tracing
 
 # 你原本的 client / mock
 from app.clients.model_api import call_ocr, call_vlm
-from app.clients.embedding import embed_texts
-from app.clients.qdrant_client import get_qdrant, ensure_collection, upsert_points
+from app.clients.embedding import embed_texts, embed_array
+from app.clients.qdrant_client import get_qdrant, ensure_and_write, collection_has_sparse, upsert_points, upload_batch
+from app.indexing import chunk_text, iter_chunks, index_stream, make_doc_id, build_points, PIPELINE_VERSION
+from app.jsonscan import extract_json_obj
+from app.blobstore import resolve_path
 from app.mocks import mock_ocr, mock_vlm
 
-from qdrant_client.http.models import PointStruct
-
 DEFAULT_TIMEOUT_SEC = int(os.getenv("DEFAULT_TIMEOUT_SEC", "20"))
 USE_REAL_API = os.getenv("USE_REAL_API", "0") == "1"
 COLLECTION = os.getenv("QDRANT_COLLECTION", "idp_chunks")
+# pipeline streaming 模式：逐頁 VLM → normalize → chunk → embed → upsert（固定大小 batch），
+# job result 只留 summary（不含全文 / chunks / raw）
+PIPELINE_STREAMING = os.getenv("PIPELINE_STREAMING", "0") == "1"
+# 本機 engine
+#   USE_EASYOCR=1        image 走真 EasyOCR（app/clients/easyocr_client.py：batched + cached；預設 stub）
+#   PDF_ENGINE=stub      pdf 走 stub（預設）
+#   PDF_ENGINE=docling   真 Docling（app/clients/docling_client.py：每個 process 一個 warm converter）
+#   PDF_ENGINE=easyocr   pdf 當掃描檔逐頁 render + OCR
+USE_EASYOCR = os.getenv("USE_EASYOCR", "0") == "1"
+PDF_ENGINE = os.getenv("PDF_ENGINE", "stub").strip().lower()
+
+tracing.init_tracing("idp-worker")
 
 
 # =========================
@@ -52,11 +67,19 @@ def infer_input_type(text: str) -> Tuple[str, Optional[str]]:
 # =========================
 #  Docling / EasyOCR (stub)
 # =========================
-def run_docling(pdf_path: str) -> Dict[str, Any]:
+def run_docling(pdf_path: str, doc_options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     這裡先做 stub：回傳你後續 pipeline 需要的結構。
     你真的要接 Docling 時，就在這裡 import docling 並實作解析。
     """
+    if PDF_ENGINE == "docling":
+        from app.clients import docling_client  # worker 已在 fork 前 warm（app/worker.py）
+
+        return docling_client.run_docling(pdf_path, doc_options)
+    if PDF_ENGINE == "easyocr":
+        from app.clients.easyocr_client import run_easyocr_pdf  # lazy：torch / easyocr 很重
+
+        return run_easyocr_pdf(pdf_path)
     # TODO: integrate real Docling here
     return {
         "engine": "docling-stub",
@@ -68,8 +91,12 @@ def run_docling(pdf_path: str) -> Dict[str, Any]:
 
 def run_easyocr(image_path: str) -> Dict[str, Any]:
     """
-    stub：之後換成 EasyOCR 真實推論
+    stub：之後換成 EasyOCR 真實推論（USE_EASYOCR=1 已可用）
     """
+    if USE_EASYOCR:
+        from app.clients.easyocr_client import run_easyocr as _run_easyocr
+
+        return _run_easyocr(image_path)
     # TODO: integrate real EasyOCR here
     return {
         "engine": "easyocr-stub",
@@ -104,6 +131,9 @@ def _call_with_feedback(fn, route: str, text: str, timeout: int):
             payload = result
             err = None
 
+    except CircuitOpenError:
+        payload = None
+        err = "circuit_open"
     except requests.Timeout:
         payload = None
         err = "timeout"
@@ -119,19 +149,208 @@ def _call_with_feedback(fn, route: str, text: str, timeout: int):
         "ok": (payload is not None) and (not err),
         "latency_ms": latency_ms,
         "error": err,
+        "breaker": breaker_states(route).get(route),
     }
 
     return payload, api_feedback
 
+def _publish_stage(job_id: Optional[str], stage: str, index: int):
+    """
+    推送 stage 進度事件（GET /v1/jobs/{id}/events、?wait= long-poll 會收到）
+    """
+    try:
+        publish_event(redis_conn, job_id, "stage", stage=stage, index=index)
+    except Exception:
+        # 進度事件只是 best-effort，不能讓 job 因此失敗
+        pass
+
+def _on_stage_recorded(job, records: list):
+    """
+    每個 stage 結束：送出 stage latency metric，並寫入 RQ job.meta（rq info / dashboard 可即時看到）
+    """
+    last = records[-1]
+    record_stage(last["stage"], last["wall_ms"])
+    if job is None:
+        return
+    try:
+        job.meta["stage_metrics"] = records
+        job.save_meta()
+    except Exception:
+        pass
+
+def _record_completion(job_id: Optional[str]):
+    # 給 API admission 估算 throughput / time-to-start；失敗不影響 job
+    try:
+        record_completion(redis_conn, job_id)
+    except Exception:
+        pass
+
+def _nbytes(s: Optional[str]) -> int:
+    return len(s.encode("utf-8")) if s else 0
+
 def get_vlm_text(v: dict) -> str:
     if not isinstance(v, dict):
         return ""
     return v.get("caption") or v.get("text") or ""
 
+def _vlm_json(v: Any, text: str) -> Optional[Dict[str, Any]]:
+    # streamed VLM（VLM_STREAM=1）已在接收時掃出 JSON object
+    if isinstance(v, dict) and isinstance(v.get("json"), dict):
+        return v["json"]
+    return extract_json_obj(text)
+
+def _call_or_fallback(fn, route: str, text: str, fallback: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    外部 OCR / VLM 呼叫，回傳 (payload, api_feedback)。
+    breaker open（CircuitOpenError，沒有真的呼叫）：不等 timeout，回傳 fallback 往下走，api_feedback["fallback"]="circuit_open"；
+    其他錯誤（包含 call_ocr / call_vlm 回傳的 ({}, err)）-> raise，交給 RQ retry
+    """
+    payload, fb = _call_with_feedback(fn, route=route, text=text, timeout=DEFAULT_TIMEOUT_SEC)
+    if fb["error"] == "circuit_open":
+        return fallback, {**fb, "fallback": "circuit_open"}
+    if not fb["ok"]:
+        raise RuntimeError(f"{route.upper()} API call failed: {fb.get('error')}")
+    return payload, fb
+
+def _pipeline_vlm(text: str) -> Tuple[Dict[str, Any], Optional[str]]:
+    """
+    pipeline 的 VLM 呼叫，回傳 (vlm_payload, fallback_reason)。
+    VLM breaker open：直接用 OCR/Docling 抽出的文字往下走（degraded）
+    """
+    if USE_REAL_API:
+        vlm_payload, fb = _call_or_fallback(call_vlm, "vlm", text, {"engine": "vlm-fallback", "caption": text})
+        return vlm_payload, fb.get("fallback")
+    return mock_vlm(text), None
+
+def iter_pages(doc_payload: Dict[str, Any]) -> Iterator[str]:
+    """Docling/OCR payload → 逐頁文字（沒有 pages 時整份當一頁）"""
+    pages = doc_payload.get("pages") or []
+    if not pages:
+        yield doc_payload.get("text") or doc_payload.get("extracted_text") or ""
+        return
+    for p in pages:
+        yield (p.get("text") or "") if isinstance(p, dict) else str(p)
+
+def _stream_normalized(pages: Iterable[str], summary: Dict[str, Any]) -> Iterator[str]:
+    """
+    逐頁 VLM + normalize，yield 正規化後的文字（頁與頁之間補一個換行），
+    只把計數寫進 summary：全文 / VLM raw / JSON 都不累積。
+    """
+    first = True
+    for page_text in pages:
+        t0 = time.perf_counter()
+        vlm_payload, fallback = _pipeline_vlm(page_text)
+        summary["vlm_ms"] += (time.perf_counter() - t0) * 1000
+        raw_text = get_vlm_text(vlm_payload)
+        summary["pages"] += 1
+        summary["bytes_in"] += _nbytes(page_text)
+        summary["bytes_out"] += _nbytes(raw_text)
+        if _vlm_json(vlm_payload, raw_text) is not None:
+            summary["json_pages"] += 1
+        if fallback:
+            summary["fallback_pages"] += 1
+        if not first:
+            yield "\n"
+        first = False
+        yield raw_text
+
+def _run_pipeline_streaming(
+    rec: StageRecorder,
+    job_id: Optional[str],
+    text: str,
+    path: str,
+    input_type: str,
+    doc_options: Optional[Dict[str, Any]] = None,
+) -> Tuple[Dict[str, Any], list]:
+    """
+    PIPELINE_STREAMING=1：頁面以 generator 一路往下推
+        pages → VLM/normalize（逐頁）→ iter_chunks（carry buffer）→ embed（ndarray batch）→ upload_batch
+    每份文件的記憶體 ≈ 一頁 + 一個 batch，與頁數無關；回傳 (summary payload, degraded)。
+    """
+    if input_type in ("image", "pdf") and not path:
+        raise RuntimeError(f"input_type={input_type} but empty path/text")
+
+    # 1️⃣ 來源頁面：OCR / Docling；text input 整段當一頁
+    if input_type in ("image", "pdf"):
+        with rec.stage("ocr") as m:
+            src = run_easyocr(path) if input_type == "image" else run_docling(path, doc_options)
+            m["pages"] = len(src.get("pages") or []) or 1
+        pages = iter_pages(src)
+    else:
+        pages = iter([text])
+
+    doc_id = make_doc_id(job_id, path, input_type)
+    qdrant = get_qdrant()
+
+    def upload(ids, vectors, payloads):
+        # ensure 第一批之後走 process cache；collection 中途被刪掉時重建一次再寫
+        ensure_and_write(
+            qdrant,
+            COLLECTION,
+            int(vectors.shape[1]),
+            lambda: upload_batch(
+                qdrant, COLLECTION, ids, vectors, payloads, sparse=collection_has_sparse(qdrant, COLLECTION)
+            ),
+        )
+
+    norm = {"pages": 0, "json_pages": 0, "fallback_pages": 0, "bytes_in": 0, "bytes_out": 0, "vlm_ms": 0.0}
+
+    # 2️⃣~5️⃣ 各段交錯執行，記成一個 stage；各段耗時 / 計數放在 counts
+    with rec.stage("stream") as m:
+        idx = index_stream(
+            iter_chunks(_stream_normalized(pages, norm)),
+            embed=embed_array,
+            upload=upload,
+            doc_id=doc_id,
+            job_id=job_id,
+            input_type=input_type,
+            source=path,
+            pipeline_version=PIPELINE_VERSION,
+        )
+        norm["vlm_ms"] = round(norm["vlm_ms"], 2)
+        m.update(norm)
+        m.update(idx)
+
+    degraded = ["vlm_skipped_circuit_open"] if norm["fallback_pages"] else []
+    payload = {
+        "stages": rec.stages,
+        "streaming": True,
+        "summary": {
+            "pages": norm["pages"],
+            "json_pages": norm["json_pages"],
+            "fallback_pages": norm["fallback_pages"],
+            "bytes_in": norm["bytes_in"],
+            "bytes_out": norm["bytes_out"],
+            "chunks": idx["chunks"],
+            "batches": idx["batches"],
+            "chars": idx["chars"],
+        },
+        "lineage": {
+            "doc_id": doc_id,
+            "pipeline_version": PIPELINE_VERSION,
+            "qdrant": {"collection": COLLECTION, "points": idx["chunks"], "dim": idx["dim"]},
+        },
+    }
+    return payload, degraded
+
+def _resolve_blob_input(blob_key: str, input_type: str) -> str:
+    path = resolve_path(blob_key)  # 不存在 → BlobNotFound（job failed）
+    if (input_type or "text").strip().lower() in ("image", "pdf"):
+        return path
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8", "replace")
+
+
 # =========================
 #  RQ Worker Job
 # =========================
-def run_job(text: str, route: str, input_type: str = "text"):
+def run_job(
+    text: str,
+    route: str,
+    input_type: str = "text",
+    blob_key: Optional[str] = None,
+    doc_options: Optional[Dict[str, Any]] = None,
+):
     """
     RQ worker 執行的 job
 
@@ -140,13 +359,43 @@ def run_job(text: str, route: str, input_type: str = "text"):
     - text: 目前仍沿用：
         - text=input文字
         - image/pdf 時 text 放檔案路徑（例如 /data/a.jpg, /data/a.pdf）
+    - blob_key: 上傳到 blob store 的檔案（POST /v1/uploads）；有給時 text 會被換成 blob 路徑（text input 則是內容）
+    - doc_options: Docling 選項（{"ocr": bool, "table_structure": bool}），只需要文字時可關掉
+
+    Tracing：接續 API 在 job.meta["trace"] 留下的 trace context，
+    並把 enqueue → started 的等待時間記成 queue.wait span。
     """
     job = get_current_job()
     job_id = job.id if job else None
+    meta = (job.meta if job else None) or {}
 
-    set_status(redis_conn, job_id, JobStatus.started.value)
+    with tracing.continued_from(meta.get("trace")):
+        enqueued_at_ns = meta.get("enqueued_at_ns")
+        if enqueued_at_ns:
+            tracing.record_span("queue.wait", int(enqueued_at_ns), time.time_ns(), job_id=job_id)
+        try:
+            with tracing.span("job.run", job_id=job_id, route=route, input_type=input_type):
+                return _run_job(job, text, route, input_type, blob_key, doc_options)
+        finally:
+            tracing.flush()
+
+def _run_job(
+    job,
+    text: str,
+    route: str,
+    input_type: str,
+    blob_key: Optional[str] = None,
+    doc_options: Optional[Dict[str, Any]] = None,
+):
+    job_id = job.id if job else None
+
+    set_job_state(redis_conn, job_id, JobStatus.started.value, blobs=[blob_key])
 
     try:
+        # blob input：API 只傳 key；image/pdf 直接用共用 volume 上的 blob 路徑，text 則讀出內容
+        if blob_key:
+            text = _resolve_blob_input(blob_key, input_type)
+
         # 0) failure 測試
         if "please fail" in (text or "").lower():
             raise RuntimeError("Forced failure for testing")
@@ -194,61 +443,89 @@ def run_job(text: str, route: str, input_type: str = "text"):
         # 4) 依 chosen_route + input_type 分流
         api_feedback: Dict[str, Any] = {"mode": "local", "ok": True, "error": None}
         payload: Any = None
+        rec = StageRecorder(
+            on_enter=lambda stage, i: _publish_stage(job_id, stage, i),
+            on_record=lambda records: _on_stage_recorded(job, records),
+        )
+        stages = rec.stages
 
         # A 方案：image/pdf 的路徑仍放在 text
         path = (text or "").strip()
 
         if chosen_route == "ocr":
+            with rec.stage("ocr") as m:
+
+                if input_type == "image":
+                    if not path:
+                        raise RuntimeError("input_type=image but empty path/text")
+                    payload = run_easyocr(path)  # stub (之後換真 EasyOCR)
+                    api_feedback = {"mode": "local", "route": "easyocr", "ok": True, "latency_ms": 0, "error": None}
+                    m["pages"] = 1
+
+                elif input_type == "pdf":
+                    if not path:
+                        raise RuntimeError("input_type=pdf but empty path/text")
+                    payload = run_docling(path, doc_options)  # PDF_ENGINE（預設 stub）
+                    api_feedback = {"mode": "local", "route": "docling", "ok": True, "latency_ms": 0, "error": None}
+                    m["pages"] = len(payload.get("pages") or []) or None
 
-            if input_type == "image":
-                if not path:
-                    raise RuntimeError("input_type=image but empty path/text")
-                payload = run_easyocr(path)  # stub (之後換真 EasyOCR)
-                api_feedback = {"mode": "local", "route": "easyocr", "ok": True, "latency_ms": 0, "error": None}
-
-            elif input_type == "pdf":
-                if not path:
-                    raise RuntimeError("input_type=pdf but empty path/text")
-                payload = run_docling(path)  # stub (之後換真 Docling)
-                api_feedback = {"mode": "local", "route": "docling", "ok": True, "latency_ms": 0, "error": None}
-
-            else:
-                # text 型：走 OCR API（或 mock）
-                if USE_REAL_API:
-                    payload, api_feedback = _call_with_feedback(
-                        call_ocr, route="ocr", text=text, timeout=DEFAULT_TIMEOUT_SEC
-                    )
-                    if payload is None:
-                        raise RuntimeError(f"OCR API call failed: {api_feedback.get('error')}")
                 else:
-                    payload = mock_ocr(text)
-                    api_feedback = {"mode": "mock", "route": "ocr", "ok": True, "latency_ms": 0, "error": None}
+                    # text 型：走 OCR API（或 mock）
+                    if USE_REAL_API:
+                        # breaker open：輸入本來就是文字，原文當 OCR 結果（degraded）
+                        payload, api_feedback = _call_or_fallback(
+                            call_ocr, "ocr", text, {"engine": "ocr-fallback", "text": text, "tables": []}
+                        )
+                        if api_feedback.get("fallback"):
+                            api_feedback["degraded"] = ["ocr_skipped_circuit_open"]
+                            m["fallback"] = api_feedback["fallback"]
+                    else:
+                        payload = mock_ocr(text)
+                        api_feedback = {"mode": "mock", "route": "ocr", "ok": True, "latency_ms": 0, "error": None}
+                    m["bytes_in"] = _nbytes(text)
 
         elif chosen_route == "vlm":
             # ✅ Day3/Day4: VLM route (text prompt) + normalize JSON
-            if USE_REAL_API:
-                vlm_payload, api_feedback = _call_with_feedback(
-                    call_vlm, route="vlm", text=text, timeout=DEFAULT_TIMEOUT_SEC
-                )
-                if vlm_payload is None:
-                    raise RuntimeError(f"VLM API call failed: {api_feedback.get('error')}")
-            else:
-                vlm_payload = mock_vlm(text)
-                api_feedback = {"mode": "mock", "route": "vlm", "ok": True, "latency_ms": 0, "error": None}
+            with rec.stage("vlm") as m:
+                if USE_REAL_API:
+                    # breaker open：同 pipeline，輸入文字當 caption（degraded）
+                    vlm_payload, api_feedback = _call_or_fallback(
+                        call_vlm, "vlm", text, {"engine": "vlm-fallback", "caption": text}
+                    )
+                    if api_feedback.get("fallback"):
+                        api_feedback["degraded"] = ["vlm_skipped_circuit_open"]
+                        m["fallback"] = api_feedback["fallback"]
+                else:
+                    vlm_payload = mock_vlm(text)
+                    api_feedback = {"mode": "mock", "route": "vlm", "ok": True, "latency_ms": 0, "error": None}
+                m["bytes_in"] = _nbytes(text)
 
-            raw_caption = (vlm_payload or {}).get("caption", "")
-            normalized = extract_json_obj(raw_caption)
+            with rec.stage("normalize") as m:
+                raw_caption = (vlm_payload or {}).get("caption", "")
+                normalized = _vlm_json(vlm_payload, raw_caption)
+                m["bytes_in"] = _nbytes(raw_caption)
+                m["json_ok"] = normalized is not None
 
             payload = {
-                "engine": "vlm-api",
+                "engine": "vlm-fallback" if api_feedback.get("fallback") else "vlm-api",
                 "raw": (vlm_payload or {}).get("raw") if isinstance(vlm_payload, dict) else vlm_payload,
                 "raw_caption": raw_caption,
                 "normalized": normalized,  # dict 或 None
             }
         
+        elif chosen_route == "pipeline" and PIPELINE_STREAMING:
+            payload, degraded = _run_pipeline_streaming(rec, job_id, text, path, input_type, doc_options)
+            api_feedback = {
+                "mode": "pipeline",
+                "route": "pipeline",
+                "ok": True,
+                "error": None,
+                "degraded": degraded,
+                "breakers": breaker_states("vlm") if USE_REAL_API else None,
+            }
+
         elif chosen_route == "pipeline":
 
-            stages = []
             intermediate_text = text
 
             extracted_text = None
@@ -260,93 +537,76 @@ def run_job(text: str, route: str, input_type: str = "text"):
 
             # 1️⃣ OCR / Docling 階段
             if input_type == "image":
-                stages.append("ocr")
-                ocr_payload = run_easyocr(path)
-                ocr_text = ocr_payload.get("extracted_text", "")
-                extracted_text = ocr_text
-                intermediate_text = extracted_text
+                with rec.stage("ocr") as m:
+                    ocr_payload = run_easyocr(path)
+                    ocr_text = ocr_payload.get("extracted_text", "")
+                    extracted_text = ocr_text
+                    intermediate_text = extracted_text
+                    m["pages"] = 1
+                    m["bytes_out"] = _nbytes(extracted_text)
 
             elif input_type == "pdf":
-                stages.append("ocr")
-                doc_payload = run_docling(path)
-                extracted_text = doc_payload.get("text", "")
-                intermediate_text = extracted_text
+                with rec.stage("ocr") as m:
+                    doc_payload = run_docling(path, doc_options)
+                    extracted_text = doc_payload.get("text", "")
+                    intermediate_text = extracted_text
+                    m["pages"] = len(doc_payload.get("pages") or []) or None
+                    m["bytes_out"] = _nbytes(extracted_text)
 
             # 2️⃣ VLM 階段
-            stages.append("vlm")
+            degraded = []
+            with rec.stage("vlm") as m:
+                vlm_payload, fallback = _pipeline_vlm(intermediate_text)
+                if fallback:
+                    degraded.append("vlm_skipped_circuit_open")
+                    m["fallback"] = fallback
 
-            if USE_REAL_API:
-                vlm_payload, fb = _call_with_feedback(call_vlm, route="vlm", text=intermediate_text, timeout=DEFAULT_TIMEOUT_SEC)
-                if vlm_payload is None:
-                    raise RuntimeError(f"VLM API call failed: {fb.get('error')}")
-            else:
-                vlm_payload = mock_vlm(intermediate_text)
-
-            raw_text = get_vlm_text(vlm_payload)
+                raw_text = get_vlm_text(vlm_payload)
+                m["bytes_in"] = _nbytes(intermediate_text)
+                m["bytes_out"] = _nbytes(raw_text)
 
             # 3️⃣ 正規化
-            stages.append("normalize")
-
-            normalized = {
-                "content_text": raw_text,
-                "content_json": extract_json_obj(raw_text),
-            }
+            with rec.stage("normalize") as m:
+                normalized = {
+                    "content_text": raw_text,
+                    "content_json": _vlm_json(vlm_payload, raw_text),
+                }
+                m["json_ok"] = normalized["content_json"] is not None
 
             # 4️⃣ Chunk
-            stages.append("chunk")
-
-            chunk_size = 300
-            overlap = 50
-
-            chunks = []
-            start = 0
-            idx = 0
-            while start < len(raw_text):
-                end = start + chunk_size
-                chunk_text = raw_text[start:end]
-                chunks.append({"i": idx, "text": chunk_text})
-                idx += 1
-                start = max(0, end - overlap)
-                if start >= len(raw_text):
-                    break
+            with rec.stage("chunk") as m:
+                chunks = chunk_text(raw_text)
+                m["chunks"] = len(chunks)
+                m["bytes_in"] = _nbytes(raw_text)
 
             # 5️⃣ Embed + Index (Day4)
-            stages.append("embed")
-
-            texts = [c["text"] for c in chunks]
-            vectors = embed_texts(texts)  # List[List[float]]
-            dim = len(vectors[0]) if vectors else 0
-
-            stages.append("index")
-
-            qdrant = get_qdrant()
-            ensure_collection(qdrant, COLLECTION, dim=dim)
-
-            # doc_id：用 input（例如檔案路徑）+ job_id 生成一個可追溯 id（最小 lineage）
-            doc_seed = f"{job_id}:{path}:{input_type}"
-            doc_id = sha256(doc_seed.encode("utf-8")).hexdigest()[:16]
-            DOC_NS = uuid.UUID("12345678-1234-5678-1234-567812345678")
-
-            points = []
-            for c, v in zip(chunks, vectors):
-                chunk_id = str(uuid.uuid5(DOC_NS, f"{doc_id}:{c['i']}"))
-                points.append(
-                    PointStruct(
-                        id=chunk_id,
-                        vector=v,
-                        payload={
-                            "doc_id": doc_id,
-                            "job_id": job_id,
-                            "chunk_index": c["i"],
-                            "input_type": input_type,
-                            "source": path,
-                            "text": c["text"],
-                            "pipeline_version": "v1",
-                        },
+            with rec.stage("embed") as m:
+                texts = [c["text"] for c in chunks]
+                vectors = embed_texts(texts)  # List[List[float]]
+                dim = len(vectors[0]) if vectors else 0
+                m["vectors"] = len(vectors)
+                m["dim"] = dim
+
+            with rec.stage("index") as m:
+                qdrant = get_qdrant()
+                doc_id = make_doc_id(job_id, path, input_type)
+
+                def write():
+                    points = build_points(
+                        chunks,
+                        vectors,
+                        doc_id=doc_id,
+                        job_id=job_id,
+                        input_type=input_type,
+                        source=path,
+                        pipeline_version=PIPELINE_VERSION,
+                        sparse=collection_has_sparse(qdrant, COLLECTION),
                     )
-                )
+                    upsert_points(qdrant, COLLECTION, points)
+                    return points
 
-            upsert_points(qdrant, COLLECTION, points)
+                points = ensure_and_write(qdrant, COLLECTION, dim, write)
+                m["points"] = len(points)
 
             payload = {
                 "stages": stages,
@@ -357,7 +617,7 @@ def run_job(text: str, route: str, input_type: str = "text"):
                 "raw": vlm_payload,
                 "lineage": {
                     "doc_id": doc_id,
-                    "pipeline_version": "v1",
+                    "pipeline_version": PIPELINE_VERSION,
                     "qdrant": {"collection": COLLECTION, "points": len(points), "dim": dim},
                 },
             }
@@ -367,6 +627,8 @@ def run_job(text: str, route: str, input_type: str = "text"):
                 "route": "pipeline",
                 "ok": True,
                 "error": None,
+                "degraded": degraded,
+                "breakers": breaker_states("vlm") if USE_REAL_API else None,
             }
 
         else:
@@ -382,69 +644,23 @@ def run_job(text: str, route: str, input_type: str = "text"):
             "input_type": input_type,
             "api_feedback": api_feedback,
             "payload": payload,
+            "stage_metrics": rec.summary(),
             "error": None,
         }
 
-        set_result(redis_conn, job_id, result)
-        set_status(redis_conn, job_id, JobStatus.finished.value)
+        set_job_state(redis_conn, job_id, JobStatus.finished.value, result=result, blobs=[blob_key])
+        record_job(chosen_route, "finished")
+        _record_completion(job_id)
         return result
 
     except Exception as e:
         err_msg = str(e)
-        set_error(redis_conn, job_id, err_msg)
-        set_status(redis_conn, job_id, JobStatus.failed.value)
+        # RQ Retry：retries_left 在這次失敗之後才扣 → > 0 代表還會再跑，不是終態（long-poll / SSE 不能結束）
+        if job is not None and (getattr(job, "retries_left", None) or 0) > 0:
+            set_job_state(redis_conn, job_id, JobStatus.retrying.value, error=err_msg, blobs=[blob_key])
+            record_job(route, "retrying")
+            raise
+        set_job_state(redis_conn, job_id, JobStatus.failed.value, error=err_msg, blobs=[blob_key])
+        record_job(route, "failed")
+        _record_completion(job_id)
         raise
-
-def extract_json_obj(text: str) -> Optional[Dict[str, Any]]:
-    """
-    嘗試從 LLM/VLM 回傳的 content 中抽出「第一個可 parse 的 JSON object」。
-
-    支援情境：
-    1) ```json ... ``` code fence
-    2) 文字中夾雜 JSON：抓第一個 '{' 到最後一個 '}'（並做簡單清理）
-    3) content 本身就是 JSON
-
-    成功回傳 dict，失敗回 None
-    """
-    if not text:
-        return None
-
-    s = text.strip()
-
-    # Case 1: ```json ... ```
-    fence = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", s, flags=re.DOTALL | re.IGNORECASE)
-    if fence:
-        candidate = fence.group(1).strip()
-        try:
-            obj = json.loads(candidate)
-            if isinstance(obj, dict):
-                return obj
-        except Exception:
-            pass
-
-    # Case 2: 直接就是 JSON
-    try:
-        obj = json.loads(s)
-        if isinstance(obj, dict):
-            return obj
-    except Exception:
-        pass
-
-    # Case 3: 文字中夾雜 JSON，抓最大包圍
-    l = s.find("{")
-    r = s.rfind("}")
-    if l != -1 and r != -1 and r > l:
-        candidate = s[l : r + 1].strip()
-
-        # 簡單清理：去掉可能的前綴 "json\n{...}"
-        candidate = re.sub(r"^\s*json\s*", "", candidate, flags=re.IGNORECASE)
-
-        try:
-            obj = json.loads(candidate)
-            if isinstance(obj, dict):
-                return obj
-        except Exception:
-            return None
-
-    return None
-
@@ -0,0 +1,161 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+try:  # optional: tracing is a no-op when opentelemetry-sdk is missing
+    from opentelemetry import context as otel_context
+    from opentelemetry import trace
+    from opentelemetry.propagate import extract, inject
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import (
+        BatchSpanProcessor,
+        SimpleSpanProcessor,
+        SpanExporter,
+        SpanExportResult,
+    )
+    from opentelemetry.trace import Status, StatusCode
+except ImportError:
+    trace = None
+    SpanExporter = object
+
+# Exporters（可同時啟用）：
+#   TRACE_FILE=/app/data/traces.jsonl           -> 每行一個 span（JSON）
+#   OTEL_EXPORTER_OTLP_ENDPOINT=http://otel:4318 -> OTLP/HTTP collector
+TRACE_FILE = os.getenv("TRACE_FILE", "").strip()
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "").strip()
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """
+    Append finished spans to a local file, one JSON object per line.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+
+    def export(self, spans):
+        lines = [json.dumps(json.loads(s.to_json()), ensure_ascii=False) for s in spans]
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+
+def init_tracing(service_name: str) -> bool:
+    """
+    Install the global TracerProvider once per process. Returns True if spans are exported.
+    """
+    global _initialized
+    if trace is None:
+        return False
+    with _init_lock:
+        if _initialized:
+            return True
+        if not TRACE_FILE and not OTLP_ENDPOINT:
+            return False
+
+        provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+        if TRACE_FILE:
+            provider.add_span_processor(SimpleSpanProcessor(JsonLinesSpanExporter(TRACE_FILE)))
+        if OTLP_ENDPOINT:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+        _initialized = True
+        return True
+
+
+def flush(timeout_ms: int = 5000):
+    """
+    RQ work-horses exit via os._exit (no atexit), so flush batched spans explicitly.
+    """
+    if trace is None:
+        return
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, "force_flush"):
+        provider.force_flush(timeout_ms)
+
+
+def _tracer():
+    return trace.get_tracer("idp-pipeline")
+
+
+def _clean_attrs(attrs: Dict[str, Any]) -> Dict[str, Any]:
+    out = {}
+    for k, v in attrs.items():
+        if v is None:
+            continue
+        out[k] = v if isinstance(v, (str, bool, int, float)) else str(v)
+    return out
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    with span("qdrant.search", collection=...) as sp:
+        ...
+    sp is None when tracing is unavailable.
+    """
+    if trace is None:
+        yield None
+        return
+    with _tracer().start_as_current_span(name, attributes=_clean_attrs(attrs)) as sp:
+        try:
+            yield sp
+        except Exception as e:
+            sp.set_status(Status(StatusCode.ERROR, str(e)))
+            raise
+
+
+def set_attributes(sp, **attrs):
+    if sp is not None:
+        sp.set_attributes(_clean_attrs(attrs))
+
+
+def record_span(name: str, start_ns: int, end_ns: int, **attrs):
+    """
+    Emit a span for an interval that already happened (e.g. queue wait).
+    """
+    if trace is None:
+        return
+    sp = _tracer().start_span(name, start_time=start_ns, attributes=_clean_attrs(attrs))
+    sp.end(end_time=end_ns)
+
+
+def inject_context(carrier: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    Current trace context as W3C headers (traceparent/tracestate).
+    Used for RQ job.meta and outbound HTTP headers.
+    """
+    carrier = dict(carrier or {})
+    if trace is not None:
+        inject(carrier)
+    return carrier
+
+
+@contextmanager
+def continued_from(carrier: Optional[Dict[str, str]]):
+    """
+    Make the context stored in carrier (e.g. job.meta["trace"]) the current parent.
+    """
+    if trace is None or not carrier:
+        yield
+        return
+    token = otel_context.attach(extract(carrier))
+    try:
+        yield
+    finally:
+        otel_context.detach(token)
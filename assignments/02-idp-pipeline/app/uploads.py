@@ -0,0 +1,180 @@
+import os
+from typing import Any, Dict, List, Optional
+
+from app.blobstore import BlobTooLarge, BlobWriter
+
+try:  # python-multipart >= 0.0.13 改名為 python_multipart（舊名 multipart 仍保留相容）
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # pragma: no cover
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# ----------------------------
+# Streaming upload -> content-addressed blob store
+#   request body 邊收邊寫（BlobWriter：temp file + on-the-fly sha256），API 記憶體只留一個 chunk
+# ----------------------------
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_FIELD_MAX_BYTES = int(os.getenv("UPLOAD_FIELD_MAX_BYTES", str(64 * 1024)))
+UPLOAD_FILE_FIELD = "file"
+
+
+class UploadError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class StreamingUpload:
+    """
+    Push-style sink：feed(chunk) 每收到一段 body 就呼叫一次，finish() 回傳 blob 資訊。
+
+    - multipart/form-data：python-multipart 的 callback parser（不 buffer、不 spool），
+      `file` part 的資料直接進 BlobWriter；其他文字欄位收在 fields（每個上限 UPLOAD_FIELD_MAX_BYTES）
+    - 其他 content-type（例如 application/pdf、application/octet-stream）：整個 body 就是檔案
+
+    超過 max_bytes → UploadError(413)，temp file 立即刪除。
+    """
+
+    def __init__(self, content_type: Optional[str], max_bytes: int = UPLOAD_MAX_BYTES, blob_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.blob_dir = blob_dir
+        self.fields: Dict[str, str] = {}
+        self.filename: Optional[str] = None
+        self.file_content_type: Optional[str] = None
+        self._writer: Optional[BlobWriter] = None
+        self._parser: Optional[MultipartParser] = None
+
+        ctype, params = parse_options_header(content_type or "")
+        if ctype == b"multipart/form-data":
+            boundary = params.get(b"boundary")
+            if not boundary:
+                raise UploadError(400, "multipart body without boundary")
+            self._init_multipart(boundary)
+        else:
+            self.file_content_type = ctype.decode("latin-1") or None
+            self._writer = BlobWriter(max_bytes=max_bytes, blob_dir=blob_dir)
+
+    # ---- multipart callbacks ----
+    def _init_multipart(self, boundary: bytes) -> None:
+        self._headers: Dict[bytes, bytes] = {}
+        self._hname: List[bytes] = []
+        self._hvalue: List[bytes] = []
+        self._part_name: Optional[str] = None
+        self._part_buf: Optional[bytearray] = None  # 非檔案欄位
+        self._in_file = False
+
+        def on_part_begin():
+            self._headers = {}
+            self._part_name = None
+            self._part_buf = None
+            self._in_file = False
+
+        def on_header_field(data, start, end):
+            self._hname.append(data[start:end])
+
+        def on_header_value(data, start, end):
+            self._hvalue.append(data[start:end])
+
+        def on_header_end():
+            self._headers[b"".join(self._hname).lower()] = b"".join(self._hvalue)
+            self._hname, self._hvalue = [], []
+
+        def on_headers_finished():
+            _, disp = parse_options_header(self._headers.get(b"content-disposition", b""))
+            name = disp.get(b"name", b"").decode("utf-8", "replace")
+            self._part_name = name
+            if name == UPLOAD_FILE_FIELD or b"filename" in disp:
+                if self._writer is not None:
+                    raise UploadError(400, "only one file part per upload")
+                self.filename = os.path.basename(disp.get(b"filename", b"").decode("utf-8", "replace")) or None
+                ctype, _ = parse_options_header(self._headers.get(b"content-type", b""))
+                self.file_content_type = ctype.decode("latin-1") or None
+                self._writer = BlobWriter(max_bytes=self.max_bytes, blob_dir=self.blob_dir)
+                self._in_file = True
+            else:
+                self._part_buf = bytearray()
+
+        def on_part_data(data, start, end):
+            if self._in_file:
+                self._writer.write(data[start:end])
+            elif self._part_buf is not None:
+                self._part_buf += data[start:end]
+                if len(self._part_buf) > UPLOAD_FIELD_MAX_BYTES:
+                    raise UploadError(413, f"form field {self._part_name!r} exceeds {UPLOAD_FIELD_MAX_BYTES} bytes")
+
+        def on_part_end():
+            if self._part_buf is not None and self._part_name:
+                self.fields[self._part_name] = self._part_buf.decode("utf-8", "replace")
+            self._part_buf = None
+            self._in_file = False
+
+        self._parser = MultipartParser(
+            boundary,
+            callbacks={
+                "on_part_begin": on_part_begin,
+                "on_header_field": on_header_field,
+                "on_header_value": on_header_value,
+                "on_header_end": on_header_end,
+                "on_headers_finished": on_headers_finished,
+                "on_part_data": on_part_data,
+                "on_part_end": on_part_end,
+            },
+        )
+
+    # ---- public ----
+    def feed(self, chunk: bytes) -> None:
+        try:
+            if self._parser is not None:
+                self._parser.write(chunk)
+            else:
+                self._writer.write(chunk)
+        except BlobTooLarge as e:
+            self.abort()
+            raise UploadError(413, f"upload exceeds {e.max_bytes} bytes") from e
+        except UploadError:
+            self.abort()
+            raise
+        except Exception as e:  # python-multipart 的 MultipartParseError 等
+            self.abort()
+            raise UploadError(400, f"malformed upload body: {e}") from e
+
+    def finish(self) -> Dict[str, Any]:
+        if self._parser is not None:
+            try:
+                self._parser.finalize()
+            except Exception as e:
+                self.abort()
+                raise UploadError(400, f"malformed upload body: {e}") from e
+        if self._writer is None:
+            raise UploadError(400, f"multipart body has no {UPLOAD_FILE_FIELD!r} part")
+        if self._writer.size == 0:
+            self.abort()
+            raise UploadError(400, "empty upload")
+        size = self._writer.size
+        key = self._writer.commit()
+        return {
+            "blob_key": key,
+            "sha256": key,
+            "bytes": size,
+            "filename": self.filename,
+            "content_type": self.file_content_type,
+            "fields": self.fields,
+        }
+
+    def abort(self) -> None:
+        if self._writer is not None:
+            self._writer.abort()
+
+
+def check_declared_length(content_length: Optional[str], max_bytes: int = UPLOAD_MAX_BYTES) -> None:
+    """有 Content-Length 就先擋（還沒讀 body）；chunked 上傳則靠 BlobWriter 邊收邊擋。"""
+    if not content_length:
+        return
+    try:
+        n = int(content_length)
+    except ValueError:
+        raise UploadError(400, "invalid Content-Length")
+    # multipart 有 boundary / header 開銷，留一點餘裕
+    if n > max_bytes + UPLOAD_FIELD_MAX_BYTES:
+        raise UploadError(413, f"upload exceeds {max_bytes} bytes")
+
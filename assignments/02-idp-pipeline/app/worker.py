@@ -0,0 +1,130 @@
+"""
+RQ worker entrypoint with a Prometheus exporter and weighted queue draining.
+
+    python -m app.worker [queue ...]
+
+Replaces `rq worker` so the worker can expose /metrics on WORKER_METRICS_PORT.
+Work-horses are forked per job, so PROMETHEUS_MULTIPROC_DIR must be set for
+their metrics to be aggregated. Each work-horse leaves its own counter/histogram
+file there; the maintenance cycle merges the files of finished pids into one
+per type so scrape cost does not grow with the number of jobs run.
+
+Without arguments the worker listens on every priority queue
+(interactive / default / bulk) and drains them by QUEUE_WEIGHTS.
+
+Expired blobs (uploads and offloaded results whose jobs have expired) are
+deleted in RQ's maintenance cycle (every maintenance_interval, 10 min).
+
+With PDF_ENGINE=docling the default Docling converter (plus any combinations
+listed in DOCLING_WARM_OPTIONS) is built here before any work-horse is forked,
+so those jobs start with warm layout/table models. The embedding model is loaded here too
+when the backend survives fork (torch on CPU; see embedding.fork_inheritable),
+so jobs do not reload it (WORKER_PRELOAD=0 disables all of this).
+"""
+import os
+import shutil
+import sys
+from typing import Dict, Optional
+
+from rq import Worker
+
+from app.queue import redis_conn, QUEUE_NAMES, QUEUE_WEIGHTS, sweep_expired_blobs
+from app import metrics
+
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100"))
+WORKER_PRELOAD = os.getenv("WORKER_PRELOAD", "1") == "1"
+
+
+class WeightedWorker(Worker):
+    """
+    Smooth weighted round-robin over queues.
+
+    RQ dequeues from the first non-empty queue in _ordered_queues, so queues are
+    ordered by how many turns they are "owed" (credit). Credit is charged in
+    reorder_queues, which RQ calls only after a job was actually dequeued, with
+    the queue it came from. Queues ordered before that one were empty, so they
+    neither earn nor pay credit for the turn. With weights interactive:6,
+    default:3, bulk:1 and all queues busy, bulk still gets 1 of every 10 slots,
+    and an idle interactive queue costs nothing.
+    """
+
+    def __init__(self, *args, weights: Optional[Dict[str, int]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        weights = weights or {}
+        self._weights = {q.name: max(1, int(weights.get(q.name, 1))) for q in self.queues}
+        self._credit = {name: 0 for name in self._weights}
+        self._apply_weighted_order()
+
+    def _apply_weighted_order(self):
+        # credit 高的先；同分時 weight 高的先
+        by_name = {q.name: q for q in self.queues}
+        names = sorted(self._weights, key=lambda n: (-self._credit[n], -self._weights[n]))
+        self._ordered_queues = [by_name[n] for n in names]
+
+    def _charge(self, served: str):
+        # 排在 served 前面的 queue 這次是空的：不加也不扣（不會因為閒置而累積 credit）
+        order = [q.name for q in self._ordered_queues]
+        eligible = order[order.index(served):] if served in order else order
+        for name in eligible:
+            self._credit[name] += self._weights[name]
+        self._credit[served] -= sum(self._weights[n] for n in eligible)
+
+    def reorder_queues(self, reference_queue):
+        self._charge(reference_queue.name)
+        self._apply_weighted_order()
+
+    def run_maintenance_tasks(self):
+        super().run_maintenance_tasks()
+        # 多個 worker 同時 sweep 沒關係：每個 blob 由 Lua 原子地 claim，只會被刪一次
+        try:
+            removed = sweep_expired_blobs(self.connection)
+            if removed:
+                self.log.info("Removed %d expired blobs", removed)
+        except Exception:
+            self.log.exception("Blob sweep failed")
+        try:
+            metrics.compact_dead_pid_files()
+        except Exception:
+            self.log.exception("Metrics file compaction failed")
+
+
+def _reset_multiproc_dir():
+    d = metrics.PROMETHEUS_MULTIPROC_DIR
+    if not d:
+        return
+    # stale *.db files from a previous run would be summed into the new one
+    shutil.rmtree(d, ignore_errors=True)
+    os.makedirs(d, exist_ok=True)
+
+
+def _preload():
+    # fork 前載入：work-horse 以 copy-on-write 繼承，不用每個 job 重載 model
+    from app import tasks
+
+    if tasks.PDF_ENGINE == "docling":
+        from app.clients import docling_client
+
+        docling_client.warm()
+
+    # 只載入、不 encode：parent 跑過 inference 的話 thread pool 狀態會被 fork 進 child
+    from app.clients import embedding
+
+    if embedding.fork_inheritable():
+        embedding.get_embedder()
+
+
+def main(argv=None):
+    names = (argv if argv is not None else sys.argv[1:]) or list(QUEUE_NAMES.values())
+    worker = WeightedWorker(names, connection=redis_conn, weights=QUEUE_WEIGHTS)
+
+    _reset_multiproc_dir()
+    if WORKER_PRELOAD:
+        _preload()
+    if WORKER_METRICS_PORT > 0:
+        metrics.start_exporter(WORKER_METRICS_PORT, [metrics.QueueDepthCollector(worker.queues)])
+
+    worker.work()
+
+
+if __name__ == "__main__":
+    main()
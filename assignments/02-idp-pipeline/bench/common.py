@@ -0,0 +1,26 @@
+import math
+import subprocess
+from typing import Any, Dict, List, Optional
+
+
+def percentile(sorted_vals: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile on a sorted list."""
+    if not sorted_vals:
+        return None
+    k = max(0, min(len(sorted_vals) - 1, math.ceil(p / 100.0 * len(sorted_vals)) - 1))
+    return sorted_vals[k]
+
+
+def _git(*cmd: str) -> Optional[str]:
+    try:
+        return subprocess.run(["git", *cmd], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def git_info() -> Dict[str, Any]:
+    """Commit metadata stored with every bench result so runs can be compared across commits."""
+    return {
+        "git_commit": _git("rev-parse", "HEAD"),
+        "git_dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+    }
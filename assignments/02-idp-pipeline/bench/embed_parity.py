@@ -0,0 +1,155 @@
+"""
+Embedding backend parity + speed check (torch vs ONNX Runtime fp32 / int8).
+
+    python -m bench.embed_parity                                  # torch vs onnx vs onnx-int8, default threads
+    python -m bench.embed_parity --threads 1,4 --texts 2000 --out runs/embed.json
+    python -m bench.embed_parity --backends torch,onnx-int8 --min-cosine 0.98 --min-recall 0.9   # exit 1 on failure
+
+Texts are the synthetic retrieval-eval corpus cut by app.indexing.chunk_text (same distribution as
+ingest). Per backend, against the torch reference:
+
+- cosine: per-text cosine to the torch vector (min / p1 / mean)
+- mixed_recall@10: query embedded by the candidate, searched against the *torch* vectors
+  (= switching EMBED_BACKEND without reindexing), overlap with the torch-only top-10
+- speed: batch throughput (texts/s, ingest path) and single-query latency p50/p95 (search path)
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from bench.common import git_info, percentile
+from bench.retrieval_eval import synth_corpus
+
+
+def _texts(n_texts: int, n_queries: int, seed: int):
+    from app.indexing import chunk_text
+
+    corpus, queries = synth_corpus(max(1, n_texts // 4), n_queries, doc_words=300, seed=seed)
+    texts = [c["text"] for doc in corpus for c in chunk_text(doc["text"])][:n_texts]
+    return texts, [q["query"] for q in queries]
+
+
+def _topk(q: np.ndarray, docs: np.ndarray, k: int) -> np.ndarray:
+    scores = q @ docs.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def parity(ref: Dict[str, np.ndarray], cand: Dict[str, np.ndarray], k: int = 10) -> Dict[str, Any]:
+    cos = np.sum(ref["texts"] * cand["texts"], axis=1)
+    cos_sorted = sorted(cos.tolist())
+    ref_top = _topk(ref["queries"], ref["texts"], k)
+    mixed_top = _topk(cand["queries"], ref["texts"], k)
+    overlap = [len(set(a) & set(b)) / k for a, b in zip(ref_top.tolist(), mixed_top.tolist())]
+    return {
+        "cosine_min": round(cos_sorted[0], 6),
+        "cosine_p1": round(percentile(cos_sorted, 1), 6),
+        "cosine_mean": round(float(np.mean(cos)), 6),
+        "max_abs_diff": round(float(np.max(np.abs(ref["texts"] - cand["texts"]))), 6),
+        f"mixed_recall@{k}": round(statistics.mean(overlap), 4),
+        "mixed_top1_agree": round(float(np.mean(ref_top[:, 0] == mixed_top[:, 0])), 4),
+    }
+
+
+def speed(model, texts: List[str], queries: List[str], batch_size: int) -> Dict[str, Any]:
+    from app.clients.embedding import encode
+
+    encode(model, texts[:batch_size], batch_size)  # warm-up (graph init, allocator)
+    t0 = time.perf_counter()
+    encode(model, texts, batch_size)
+    batch_sec = time.perf_counter() - t0
+
+    lat = []
+    for q in queries:
+        t1 = time.perf_counter()
+        encode(model, [q], 1)
+        lat.append((time.perf_counter() - t1) * 1000)
+    lat.sort()
+    return {
+        "texts_per_sec": round(len(texts) / batch_sec, 1),
+        "query_p50_ms": round(percentile(lat, 50), 3),
+        "query_p95_ms": round(percentile(lat, 95), 3),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--backends", default="torch,onnx,onnx-int8", help="first one is the parity reference")
+    ap.add_argument("--threads", default="0", help="comma list; 0 = library default")
+    ap.add_argument("--texts", type=int, default=1000)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--min-cosine", type=float, default=0.98, help="fail when a backend's cosine_p1 is below")
+    ap.add_argument("--min-recall", type=float, default=0.9, help="fail when a backend's mixed_recall@10 is below")
+    ap.add_argument("--out", default=None)
+    args = ap.parse_args(argv)
+
+    from app.clients.embedding import load_embedder, encode
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    threads = [int(t) for t in args.threads.split(",") if t.strip()]
+    texts, queries = _texts(args.texts, args.queries, args.seed)
+    print(f"texts={len(texts)} queries={len(queries)} batch_size={args.batch_size}", flush=True)
+
+    vectors: Dict[str, Dict[str, np.ndarray]] = {}
+    rows: List[Dict[str, Any]] = []
+    for backend in backends:
+        for n_threads in threads:
+            try:
+                t0 = time.perf_counter()
+                model = load_embedder(backend, threads=n_threads)
+                load_sec = time.perf_counter() - t0
+            except (ImportError, RuntimeError) as e:
+                rows.append({"backend": backend, "threads": n_threads, "skipped": str(e)})
+                print(f"{backend:<10} threads={n_threads:<3} skipped: {e}", flush=True)
+                break
+            if backend not in vectors:
+                vectors[backend] = {
+                    "texts": encode(model, texts, args.batch_size),
+                    "queries": encode(model, queries, args.batch_size),
+                }
+            row = {"backend": backend, "threads": n_threads, "load_sec": round(load_sec, 2)}
+            row.update(speed(model, texts, queries, args.batch_size))
+            rows.append(row)
+            print(
+                f"{backend:<10} threads={n_threads:<3} {row['texts_per_sec']:>9.1f} texts/s  "
+                f"query p50 {row['query_p50_ms']:.2f} ms  p95 {row['query_p95_ms']:.2f} ms",
+                flush=True,
+            )
+            del model
+
+    ref = backends[0]
+    report: Dict[str, Any] = {}
+    failed = False
+    if ref in vectors:
+        print(f"\nparity vs {ref}:")
+        for backend in backends[1:]:
+            if backend not in vectors:
+                continue
+            report[backend] = parity(vectors[ref], vectors[backend])
+            r = report[backend]
+            ok = r["cosine_p1"] >= args.min_cosine and r["mixed_recall@10"] >= args.min_recall
+            failed |= not ok
+            print(f"  {backend:<10} {json.dumps(r)}{'' if ok else '  <-- below --min-cosine / --min-recall'}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(
+                {
+                    "meta": {**git_info(), "python": sys.version.split()[0], **vars(args)},
+                    "speed": rows,
+                    "parity": {"reference": ref, "results": report},
+                },
+                f,
+                indent=2,
+            )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
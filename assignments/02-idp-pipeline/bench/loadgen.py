@@ -0,0 +1,380 @@
+"""
+Load generator for the IDP API (stdlib + requests only; does not import app/).
+
+    # 1) seed a corpus (pipeline jobs + FTS reindex) so search/answer have data
+    python -m bench.loadgen seed --docs 200
+
+    # 2) run a scenario; results are JSON (stdout or --out)
+    python -m bench.loadgen run --scenario search --concurrency 16 --duration 60 --out runs/$(git rev-parse --short HEAD).json
+    python -m bench.loadgen run --scenario mixed --rate 20 --duration 120
+    python -m bench.loadgen run --scenario jobs --mix text=8,image=1,pdf=1 --image-path /app/data/bench/a.png --pdf-path /app/data/bench/a.pdf
+
+    # 3) compare two runs (exit 1 when p95 regresses more than --fail-pct)
+    python -m bench.loadgen compare runs/base.json runs/new.json --fail-pct 10
+
+Closed loop by default (each worker sends the next request when the previous one returns).
+With --rate the schedule is open loop and latency is measured from the *scheduled* start,
+so a slow server cannot hide its queueing delay (no coordinated omission).
+"""
+import argparse
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from bench.common import git_info, percentile
+
+TERMINAL = ("finished", "failed")
+
+WORDS = (
+    "invoice contract receipt payment shipment warranty policy customer vendor order "
+    "amount tax total refund account balance statement quarter revenue report audit "
+    "table figure section clause signature date address delivery inspection approval"
+).split()
+
+QUERIES = [
+    "invoice total amount",
+    "refund policy for customers",
+    "quarter revenue report",
+    "contract signature date",
+    "shipment delivery address",
+    "warranty clause",
+    "tax statement balance",
+    "audit approval section",
+]
+
+SEARCH_VARIANTS: Dict[str, Dict[str, Any]] = {
+    "dense": {"retrieval": {"mode": "dense"}},
+    "hybrid": {"retrieval": {"mode": "hybrid"}},
+    "rerank": {"retrieval": {"mode": "hybrid"}, "rerank": {"enabled": True, "top_n": 50}},
+}
+
+
+def synthetic_doc(rng: random.Random, n_words: int = 400) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n_words))
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            out[k.strip()] = float(v)
+    return out
+
+
+class Recorder:
+    """Thread-safe latency / outcome collection per operation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lat: Dict[str, List[float]] = defaultdict(list)
+        self.outcomes: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def add(self, op: str, latency_ms: float, outcome: str):
+        with self._lock:
+            if outcome == "ok":
+                self.lat[op].append(latency_ms)
+            self.outcomes[op][outcome] += 1
+
+    def summary(self, elapsed_sec: float) -> Dict[str, Any]:
+        ops: Dict[str, Any] = {}
+        for op in sorted(self.outcomes):
+            outcomes = dict(self.outcomes[op])
+            total = sum(outcomes.values())
+            ok = outcomes.get("ok", 0)
+            vals = sorted(self.lat[op])
+            ops[op] = {
+                "count": total,
+                "ok": ok,
+                "errors": total - ok,
+                "error_rate": round((total - ok) / total, 4) if total else 0.0,
+                "throughput_rps": round(ok / elapsed_sec, 3) if elapsed_sec > 0 else 0.0,
+                "latency_ms": {
+                    "p50": _r(percentile(vals, 50)),
+                    "p95": _r(percentile(vals, 95)),
+                    "p99": _r(percentile(vals, 99)),
+                    "mean": _r(sum(vals) / len(vals)) if vals else None,
+                    "max": _r(vals[-1]) if vals else None,
+                },
+                "outcomes": outcomes,
+            }
+        return ops
+
+
+def _r(x: Optional[float]) -> Optional[float]:
+    return round(x, 2) if x is not None else None
+
+
+def _outcome(resp: requests.Response) -> str:
+    if resp.status_code < 400:
+        return "ok"
+    if resp.status_code == 429:
+        return "rejected_429"
+    return f"http_{resp.status_code}"
+
+
+# ----------------------------
+# operations: each returns list of (op, latency_ms, outcome)
+# ----------------------------
+class Client:
+    def __init__(self, base_url: str, timeout: float, client_id: str):
+        self.base = base_url.rstrip("/")
+        self.timeout = timeout
+        self.local = threading.local()
+        self.headers = {"X-Client-Id": client_id}
+
+    @property
+    def s(self) -> requests.Session:
+        sess = getattr(self.local, "s", None)
+        if sess is None:
+            sess = self.local.s = requests.Session()
+            sess.headers.update(self.headers)
+        return sess
+
+    def post(self, path: str, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        return self.s.post(self.base + path, json=body, timeout=self.timeout, headers=headers)
+
+    def get(self, path: str, **params):
+        return self.s.get(self.base + path, params=params, timeout=self.timeout)
+
+
+def op_search(c: Client, args, rng: random.Random, t_sched: float) -> List[Tuple[str, float, str]]:
+    variant = rng.choice(args.variants)
+    body = {"query": rng.choice(QUERIES), "top_k": 5, **SEARCH_VARIANTS[variant]}
+    headers = {"X-Request-Budget-Ms": str(args.budget_ms)} if args.budget_ms else None
+    resp = c.post("/v1/search", body, headers=headers)
+    return [(f"search.{variant}", (time.perf_counter() - t_sched) * 1000, _outcome(resp))]
+
+
+def op_answer(c: Client, args, rng: random.Random, t_sched: float) -> List[Tuple[str, float, str]]:
+    body = {"query": rng.choice(QUERIES), "top_k": 5, "retrieval": {"mode": "hybrid"}}
+    headers = {"X-Request-Budget-Ms": str(args.budget_ms)} if args.budget_ms else None
+    resp = c.post("/v1/answer", body, headers=headers)
+    return [("answer", (time.perf_counter() - t_sched) * 1000, _outcome(resp))]
+
+
+def _job_body(kind: str, args, rng: random.Random) -> Dict[str, Any]:
+    if kind == "image":
+        return {"text": args.image_path, "input_type": "image", "route": "pipeline"}
+    if kind == "pdf":
+        return {"text": args.pdf_path, "input_type": "pdf", "route": "pipeline"}
+    return {"text": synthetic_doc(rng, args.doc_words), "input_type": "text", "route": "pipeline"}
+
+
+def op_job(c: Client, args, rng: random.Random, t_sched: float) -> List[Tuple[str, float, str]]:
+    kinds = [k for k in args.mix if args.mix[k] > 0]
+    kind = rng.choices(kinds, weights=[args.mix[k] for k in kinds])[0]
+    resp = c.post("/v1/jobs", _job_body(kind, args, rng))
+    t_submit = time.perf_counter()
+    out = [(f"jobs.submit.{kind}", (t_submit - t_sched) * 1000, _outcome(resp))]
+    if resp.status_code >= 400 or args.no_wait_jobs:
+        return out
+
+    job_id = resp.json()["job_id"]
+    deadline = t_submit + args.job_timeout
+    status = None
+    while time.perf_counter() < deadline:
+        r = c.get(f"/v1/jobs/{job_id}", wait=min(30.0, max(0.0, deadline - time.perf_counter())))
+        if r.status_code >= 400:
+            out.append((f"jobs.e2e.{kind}", (time.perf_counter() - t_sched) * 1000, _outcome(r)))
+            return out
+        status = r.json().get("status")
+        if status in TERMINAL:
+            break
+    outcome = "ok" if status == "finished" else ("job_failed" if status == "failed" else "job_timeout")
+    out.append((f"jobs.e2e.{kind}", (time.perf_counter() - t_sched) * 1000, outcome))
+    return out
+
+
+OPS: Dict[str, Callable] = {"search": op_search, "answer": op_answer, "jobs": op_job}
+
+
+# ----------------------------
+# runner
+# ----------------------------
+def run_load(args) -> Dict[str, Any]:
+    c = Client(args.base_url, args.timeout, args.client_id)
+    rec = Recorder()
+    weights = parse_weights(args.weights) if args.scenario == "mixed" else {args.scenario: 1.0}
+    names = [n for n in weights if weights[n] > 0]
+    stop_at = time.perf_counter() + args.duration
+    ticket = itertools.count()
+    t_start = time.perf_counter()
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        while True:
+            if args.rate:
+                i = next(ticket)
+                t_sched = t_start + i / args.rate
+                if t_sched >= stop_at or (args.requests and i >= args.requests):
+                    return
+                delay = t_sched - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                i = next(ticket)
+                if time.perf_counter() >= stop_at or (args.requests and i >= args.requests):
+                    return
+                t_sched = time.perf_counter()
+
+            name = rng.choices(names, weights=[weights[n] for n in names])[0]
+            try:
+                for op, ms, outcome in OPS[name](c, args, rng, t_sched):
+                    rec.add(op, ms, outcome)
+            except requests.Timeout:
+                rec.add(name, (time.perf_counter() - t_sched) * 1000, "timeout")
+            except requests.RequestException as e:
+                rec.add(name, (time.perf_counter() - t_sched) * 1000, f"conn_error:{type(e).__name__}")
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        for f in [ex.submit(worker, args.seed + i) for i in range(args.concurrency)]:
+            f.result()
+
+    elapsed = time.perf_counter() - t_start
+    return {
+        "meta": _meta(args, elapsed),
+        "ops": rec.summary(elapsed),
+    }
+
+
+def _meta(args, elapsed: float) -> Dict[str, Any]:
+    return {
+        **git_info(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(time.time() - elapsed)),
+        "elapsed_sec": round(elapsed, 3),
+        "base_url": args.base_url,
+        "scenario": args.scenario,
+        "args": {k: v for k, v in vars(args).items() if k not in ("func",)},
+    }
+
+
+def seed_corpus(args) -> Dict[str, Any]:
+    """Ingest synthetic docs via the pipeline route, then rebuild FTS (hybrid needs it)."""
+    c = Client(args.base_url, args.timeout, args.client_id)
+    rng = random.Random(args.seed)
+    job_ids: List[str] = []
+    for _ in range(args.docs):
+        body = {"text": synthetic_doc(rng, args.doc_words), "input_type": "text", "route": "pipeline", "priority": "bulk"}
+        while True:
+            r = c.post("/v1/jobs", body)
+            if r.status_code != 429:
+                break
+            time.sleep(float(r.headers.get("Retry-After", "1")))
+        r.raise_for_status()
+        job_ids.append(r.json()["job_id"])
+
+    failed = 0
+    for job_id in job_ids:
+        while True:
+            st = c.get(f"/v1/jobs/{job_id}", wait=30).json().get("status")
+            if st in TERMINAL:
+                failed += st == "failed"
+                break
+
+    r = c.post("/v1/reindex/fts", {})
+    return {"docs": len(job_ids), "failed": failed, "reindex_status": r.status_code}
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], fail_pct: Optional[float]) -> int:
+    regressions = 0
+    print(f"{'op':<24}{'metric':<14}{'base':>10}{'new':>10}{'delta%':>9}")
+    for op in sorted(set(base["ops"]) | set(new["ops"])):
+        b, n = base["ops"].get(op), new["ops"].get(op)
+        if not b or not n:
+            print(f"{op:<24}{'(missing)':<14}{'-' if not b else 'x':>10}{'-' if not n else 'x':>10}")
+            continue
+        rows = [
+            ("throughput", b["throughput_rps"], n["throughput_rps"]),
+            ("error_rate", b["error_rate"], n["error_rate"]),
+            *((f"{p}_ms", b["latency_ms"][p], n["latency_ms"][p]) for p in ("p50", "p95", "p99")),
+        ]
+        for metric, bv, nv in rows:
+            delta = ((nv - bv) / bv * 100.0) if bv and nv is not None else None
+            flag = ""
+            if metric == "p95_ms" and fail_pct is not None and delta is not None and delta > fail_pct:
+                regressions += 1
+                flag = "  <-- regression"
+            d = f"{delta:+.1f}" if delta is not None else "-"
+            print(f"{op:<24}{metric:<14}{_fmt(bv):>10}{_fmt(nv):>10}{d:>9}{flag}")
+    return 1 if regressions else 0
+
+
+def _fmt(v) -> str:
+    return "-" if v is None else f"{v:.2f}" if isinstance(v, float) else str(v)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    def common(p):
+        p.add_argument("--base-url", default="http://localhost:8000")
+        p.add_argument("--timeout", type=float, default=120.0, help="per HTTP request (s)")
+        p.add_argument("--client-id", default="loadgen", help="X-Client-Id (admission rate limit key)")
+        p.add_argument("--seed", type=int, default=42)
+        p.add_argument("--doc-words", type=int, default=400)
+
+    p_run = sub.add_parser("run", help="run a load scenario")
+    common(p_run)
+    p_run.add_argument("--scenario", choices=["jobs", "search", "answer", "mixed"], default="search")
+    p_run.add_argument("--weights", default="jobs=1,search=6,answer=3", help="mixed scenario weights")
+    p_run.add_argument("--variants", default="dense,hybrid,rerank", help="search variants to rotate")
+    p_run.add_argument("--mix", default="text=1", help="jobs input mix, e.g. text=8,image=1,pdf=1")
+    p_run.add_argument("--image-path", default=None, help="image path visible to the worker")
+    p_run.add_argument("--pdf-path", default=None, help="pdf path visible to the worker")
+    p_run.add_argument("--no-wait-jobs", action="store_true", help="only measure POST /v1/jobs")
+    p_run.add_argument("--job-timeout", type=float, default=300.0)
+    p_run.add_argument("--budget-ms", type=int, default=None, help="send X-Request-Budget-Ms on search/answer")
+    p_run.add_argument("--concurrency", type=int, default=8)
+    p_run.add_argument("--duration", type=float, default=30.0, help="seconds")
+    p_run.add_argument("--requests", type=int, default=0, help="stop after N requests (0 = duration only)")
+    p_run.add_argument("--rate", type=float, default=0.0, help="open-loop requests/sec (0 = closed loop)")
+    p_run.add_argument("--out", default=None, help="write JSON here (default stdout)")
+
+    p_seed = sub.add_parser("seed", help="ingest a synthetic corpus and rebuild FTS")
+    common(p_seed)
+    p_seed.add_argument("--docs", type=int, default=100)
+
+    p_cmp = sub.add_parser("compare", help="compare two run JSON files")
+    p_cmp.add_argument("base")
+    p_cmp.add_argument("new")
+    p_cmp.add_argument("--fail-pct", type=float, default=None, help="exit 1 if any p95 grows more than this")
+
+    args = ap.parse_args(argv)
+
+    if args.cmd == "compare":
+        with open(args.base) as f1, open(args.new) as f2:
+            return compare(json.load(f1), json.load(f2), args.fail_pct)
+
+    if args.cmd == "seed":
+        print(json.dumps(seed_corpus(args), indent=2))
+        return 0
+
+    args.variants = [v.strip() for v in args.variants.split(",") if v.strip() in SEARCH_VARIANTS]
+    args.mix = parse_weights(args.mix)
+    if args.mix.get("image") and not args.image_path:
+        ap.error("--mix has image but --image-path is not set")
+    if args.mix.get("pdf") and not args.pdf_path:
+        ap.error("--mix has pdf but --pdf-path is not set")
+
+    result = run_load(args)
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""
+Microbenchmarks for per-job / per-query hot functions (timeit based, no pytest needed).
+
+    python -m bench.microbench                          # default sizes, prints a table
+    python -m bench.microbench --out runs/micro.json    # save results (JSON)
+    python -m bench.microbench --baseline runs/micro.json --threshold 20   # exit 1 on regression
+    python -m bench.microbench -k bulk_upsert --full    # one case, include 1M rows
+
+Each case = setup (untimed) -> zero-arg callable (timed). Cases whose imports are
+missing (e.g. qdrant-client for app.indexing) are reported as skipped.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import timeit
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bench.common import git_info
+
+WORDS = (
+    "invoice contract receipt payment shipment warranty policy customer vendor order "
+    "amount tax total refund account balance statement quarter revenue report audit "
+    "table figure section clause signature date address delivery inspection approval "
+    "表格 欄位 圖表 趨勢 合約 發票 金額 日期"
+).split()
+
+# name -> (setup(param) -> fn, default params, full params, once)
+CASES: Dict[str, Tuple[Callable[[Any], Callable[[], Any]], List[Any], List[Any], bool]] = {}
+
+
+def case(name: str, params: List[Any], *, full: Optional[List[Any]] = None, once: bool = False):
+    """once=True: each call is expensive (or mutates state), time single calls."""
+    def deco(setup):
+        CASES[name] = (setup, params, full or params, once)
+        return setup
+    return deco
+
+
+def _text(rng: random.Random, n_chars: int) -> str:
+    out, size = [], 0
+    while size < n_chars:
+        w = rng.choice(WORDS)
+        out.append(w)
+        size += len(w) + 1
+    return " ".join(out)[:n_chars]
+
+
+def _fts_rows(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        text = _text(rng, 300)
+        rows.append(
+            {
+                "chunk_id": f"00000000-0000-0000-0000-{i:012d}",
+                "doc_id": f"doc-{i // 20:06d}",
+                "pipeline_version": "v1",
+                "chunk_index": i % 20,
+                "source_file": f"/app/data/in/{i // 20}.pdf",
+                "job_id": f"job-{i // 20}",
+                "input_type": "pdf",
+                "ingested_at": 1_700_000_000 + i,
+                "content": text,
+                "text": text,
+            }
+        )
+    return rows
+
+
+# ----------------------------
+# cases
+# ----------------------------
+@case("extract_json_obj", ["fenced_2kb", "prose_20kb", "nojson_50kb"])
+def _bench_extract_json(kind: str):
+    from app.jsonscan import extract_json_obj
+
+    rng = random.Random(1)
+    obj = {"title": "report", "fields": [{"k": w, "v": rng.randint(0, 10**6)} for w in WORDS * 2]}
+    body = json.dumps(obj, ensure_ascii=False)
+    if kind == "fenced_2kb":
+        text = f"Here is the result:\n```json\n{body}\n```\n"
+    elif kind == "prose_20kb":
+        text = _text(rng, 10_000) + "\n" + body + "\n" + _text(rng, 8_000)
+    else:
+        text = _text(rng, 50_000)
+    return lambda: extract_json_obj(text)
+
+
+@case("chunk_text", [10_000, 100_000, 1_000_000])
+def _bench_chunk(n_chars: int):
+    from app.indexing import chunk_text
+
+    text = _text(random.Random(2), n_chars)
+    return lambda: chunk_text(text)
+
+
+@case("iter_chunks", [100_000, 1_000_000])
+def _bench_iter_chunks(n_chars: int):
+    from app.indexing import iter_chunks
+
+    rng = random.Random(2)
+    pages = [_text(rng, 3_000) for _ in range(n_chars // 3_000)]
+    return lambda: sum(1 for _ in iter_chunks(pages))
+
+
+@case("rrf_fuse", [50, 200])
+def _bench_rrf(n: int):
+    from app.retrieval import rrf_fuse
+
+    ids = [f"id-{i}" for i in range(int(n * 1.5))]
+    rng = random.Random(3)
+    dense = {pid: r for r, pid in enumerate(rng.sample(ids, n), start=1)}
+    bm25 = {pid: r for r, pid in enumerate(rng.sample(ids, n), start=1)}
+    return lambda: rrf_fuse(dense_rank=dense, bm25_rank=bm25, rrf_k=60)
+
+
+@case("auto_prefix", [1000])
+def _bench_auto_prefix(n: int):
+    from app.clients.fts_client import _auto_prefix
+
+    samples = ["INV-2024-0012", "invoice total", '"exact phrase"', "tax OR refund", "合約 金額", "ab", "A12345"]
+    queries = [samples[i % len(samples)] for i in range(n)]
+    return lambda: [_auto_prefix(q) for q in queries]
+
+
+@case("search_keyword", [10_000, 100_000], full=[10_000, 100_000, 1_000_000])
+def _bench_search_keyword(n_rows: int):
+    from app.clients.fts_client import reset_fts, bulk_upsert, search_keyword
+
+    tmp = tempfile.mkdtemp(prefix="microbench_fts_")
+    db = os.path.join(tmp, "fts.db")
+    reset_fts(db)
+    bulk_upsert(_fts_rows(n_rows), db_path=db)
+    _TMP_DIRS.append(tmp)
+    return lambda: search_keyword("invoice total", limit=50, db_path=db)
+
+
+@case("bulk_upsert", [10_000, 100_000], full=[10_000, 100_000, 1_000_000], once=True)
+def _bench_bulk_upsert(n_rows: int):
+    from app.clients.fts_client import reset_fts, bulk_upsert
+
+    rows = _fts_rows(n_rows)
+    tmp = tempfile.mkdtemp(prefix="microbench_fts_")
+    db = os.path.join(tmp, "fts.db")
+    _TMP_DIRS.append(tmp)
+
+    def run():
+        reset_fts(db)
+        bulk_upsert(rows, db_path=db)
+
+    return run
+
+
+@case("decide_route", [1_000, 20_000, 200_000])
+def _bench_decide_route(n_chars: int):
+    from app.router import decide_route
+
+    text = _text(random.Random(4), n_chars)
+    return lambda: decide_route(text)
+
+
+@case("search_response_json", [10, 50])
+def _bench_search_response(n: int):
+    from app.schemas import SearchResponse, SearchResultItem, SearchDebug
+
+    rng = random.Random(5)
+    results = [
+        SearchResultItem(
+            score=rng.random(),
+            chunk_id=f"00000000-0000-0000-0000-{i:012d}",
+            doc_id=f"doc-{i}",
+            pipeline_version="v1",
+            chunk_index=i,
+            text=_text(rng, 300),
+            payload={"doc_id": f"doc-{i}", "text": _text(rng, 300), "source": "/app/data/a.pdf", "chunk_index": i},
+        )
+        for i in range(n)
+    ]
+    resp = SearchResponse(
+        query="invoice total",
+        results=results,
+        debug=SearchDebug(
+            latency_ms=12, collection="idp_chunks", used_filter=False, top_k=n, mode="hybrid",
+            dense_hits=n, bm25_hits=n, dense_top_k=n, bm25_top_k=n, rrf_k=60,
+            rerank_used=False, rerank_latency_ms=0, candidates_n=n,
+        ),
+    )
+    return lambda: resp.model_dump_json()
+
+
+_TMP_DIRS: List[str] = []
+
+
+# ----------------------------
+# runner
+# ----------------------------
+def run_case(setup, param, once: bool, repeat: int) -> Dict[str, Any]:
+    fn = setup(param)
+    timer = timeit.Timer(fn)
+    number = 1 if once else timer.autorange()[0]
+    times = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "median_us": round(statistics.median(times) * 1e6, 3),
+        "min_us": round(min(times) * 1e6, 3),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold_pct: float) -> int:
+    regressions = 0
+    print(f"\n{'case':<40}{'base_us':>14}{'new_us':>14}{'delta%':>9}")
+    for key, r in new.items():
+        b = base.get(key)
+        if not b or "median_us" not in b or "median_us" not in r:
+            continue
+        delta = (r["median_us"] - b["median_us"]) / b["median_us"] * 100.0
+        flag = ""
+        if delta > threshold_pct:
+            regressions += 1
+            flag = "  <-- regression"
+        print(f"{key:<40}{b['median_us']:>14.1f}{r['median_us']:>14.1f}{delta:>+9.1f}{flag}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-k", dest="filter", default=None, help="only cases whose name contains this")
+    ap.add_argument("--full", action="store_true", help="include the largest sizes (1M rows)")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--out", default=None)
+    ap.add_argument("--baseline", default=None, help="previous --out file to compare against")
+    ap.add_argument("--threshold", type=float, default=20.0, help="median regression %% that fails the run")
+    args = ap.parse_args(argv)
+
+    results: Dict[str, Any] = {}
+    try:
+        for name, (setup, params, full, once) in CASES.items():
+            if args.filter and args.filter not in name:
+                continue
+            for param in full if args.full else params:
+                key = f"{name}[{param}]"
+                try:
+                    results[key] = run_case(setup, param, once, 3 if once else args.repeat)
+                except ImportError as e:
+                    results[key] = {"skipped": f"missing dependency: {e.name or e}"}
+                r = results[key]
+                line = f"{r['median_us']:>14.1f} us  (min {r['min_us']:.1f}, n={r['number']})" if "median_us" in r else r["skipped"]
+                print(f"{key:<40}{line}", flush=True)
+    finally:
+        for d in _TMP_DIRS:
+            shutil.rmtree(d, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"meta": {**git_info(), "python": sys.version.split()[0]}, "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            base = json.load(f)["results"]
+        if compare(base, results, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,299 @@
+"""
+Offline retrieval quality-vs-latency sweep.
+
+Ingests a labeled corpus through the real chunk -> embed -> Qdrant/FTS index path
+(app.indexing / app.clients.*), then runs every query against app.main._semantic_search
+for each point of a RetrievalConfig / RerankConfig grid and prints a Pareto table.
+
+    # synthetic corpus, embedded Qdrant (:memory:), temp FTS db
+    python -m bench.retrieval_eval --docs 300 --queries 200
+
+    # own labeled data, real Qdrant server (latency closer to production: HNSW instead of brute force)
+    python -m bench.retrieval_eval --qdrant-path "" --corpus corpus.jsonl --queries-file queries.jsonl \\
+        --modes hybrid --dense-top-k 20,50,100 --bm25-top-k 20,50 --rrf-k 20,60 --rerank-top-n 0,20,50 --out runs/eval.json
+
+    # hybrid lexical side: Qdrant BM25 sparse vectors (server-side RRF) vs SQLite FTS
+    python -m bench.retrieval_eval --modes hybrid --lexical sparse,fts
+
+corpus.jsonl : {"doc_id": "...", "text": "..."}
+queries.jsonl: {"query": "...", "relevant_doc_ids": ["...", ...]}
+
+rerank-top-n > 0 needs RERANK_URL (e.g. bench/stub_models.py) and Redis (circuit breaker state);
+those grid points are skipped when RERANK_URL is not set.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from bench.common import percentile, git_info
+
+TOPICS: Dict[str, List[str]] = {
+    "finance": "invoice payment balance ledger revenue expense audit budget tax quarter account refund".split(),
+    "logistics": "shipment warehouse pallet carrier delivery route freight customs inventory dispatch".split(),
+    "legal": "contract clause liability agreement party termination warranty jurisdiction signature".split(),
+    "hr": "employee onboarding payroll benefit leave review training manager contractor policy".split(),
+    "it": "server incident deployment backup network firewall credential patch outage ticket".split(),
+}
+ATTRIBUTES = ["budget code", "contract number", "warehouse location", "approval date", "owner", "serial number"]
+SYLLABLES = "ka ro vex mi tor lan qui zen dra pol fen ur bis cal nor".split()
+
+
+def _entity(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(3)).capitalize() + f"-{rng.randint(10, 999)}"
+
+
+def synth_corpus(n_docs: int, n_queries: int, doc_words: int, seed: int):
+    """
+    Topic filler text with planted facts ("The owner of Kavexmi-417 is R582.").
+    Each query asks for one planted fact; the relevant doc is the one that contains it.
+    """
+    rng = random.Random(seed)
+    corpus: List[Dict[str, Any]] = []
+    facts: List[Dict[str, Any]] = []
+    facts_per_doc = max(1, -(-n_queries // max(1, n_docs)))
+
+    for d in range(n_docs):
+        topic = rng.choice(list(TOPICS))
+        words = TOPICS[topic]
+        sentences = []
+        while sum(len(s.split()) for s in sentences) < doc_words:
+            n = rng.randint(6, 14)
+            sentences.append(" ".join(rng.choice(words) for _ in range(n)).capitalize() + ".")
+        doc_id = f"doc-{d:05d}"
+        for _ in range(facts_per_doc):
+            ent, attr = _entity(rng), rng.choice(ATTRIBUTES)
+            value = f"{rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ')}{rng.randint(100, 999)}"
+            sentences.insert(rng.randrange(len(sentences) + 1), f"The {attr} of {ent} is {value}.")
+            facts.append({"query": f"What is the {attr} of {ent}?", "relevant_doc_ids": [doc_id]})
+        corpus.append({"doc_id": doc_id, "text": " ".join(sentences)})
+
+    rng.shuffle(facts)
+    return corpus, facts[:n_queries]
+
+
+def _load_jsonl(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def ingest(corpus: List[Dict[str, Any]], collection: str, *, reset: bool) -> Dict[str, Any]:
+    from app.clients.embedding import embed_texts
+    from app.clients.qdrant_client import get_qdrant, ensure_collection, collection_has_sparse, upsert_points
+    from app.clients.fts_client import reset_fts, bulk_upsert
+    from app.indexing import chunk_text, build_points, fts_row
+
+    qdrant = get_qdrant()
+    if reset and qdrant.collection_exists(collection):
+        qdrant.delete_collection(collection)
+    reset_fts()
+
+    t0 = time.perf_counter()
+    n_chunks = 0
+    for doc in corpus:
+        chunks = chunk_text(doc["text"])
+        if not chunks:
+            continue
+        vectors = embed_texts([c["text"] for c in chunks])
+        ensure_collection(qdrant, collection, dim=len(vectors[0]))
+        points = build_points(
+            chunks, vectors, doc_id=doc["doc_id"], job_id=None, input_type="text", source="eval",
+            sparse=collection_has_sparse(qdrant, collection),
+        )
+        upsert_points(qdrant, collection, points)
+        bulk_upsert([fts_row(str(p.id), p.payload) for p in points])
+        n_chunks += len(points)
+    return {"docs": len(corpus), "chunks": n_chunks, "ingest_sec": round(time.perf_counter() - t0, 2)}
+
+
+def build_grid(args) -> List[Dict[str, Any]]:
+    def ints(s: str) -> List[int]:
+        return [int(x) for x in s.split(",") if x.strip()]
+
+    hnsw = [int(x) if x.strip() else None for x in (args.hnsw_ef or "").split(",")] or [None]
+    grid: List[Dict[str, Any]] = []
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        if mode == "dense":
+            # dense mode: candidate pool = rerank.top_n (or top_k); dense/bm25/rrf knobs unused
+            for top_n, ef in itertools.product(ints(args.rerank_top_n), hnsw):
+                grid.append({"mode": "dense", "lexical": None, "dense_top_k": None, "bm25_top_k": None, "rrf_k": None,
+                             "rerank_top_n": top_n, "hnsw_ef": ef})
+        else:
+            lexical = [x.strip() for x in args.lexical.split(",") if x.strip()] or [None]
+            for lx, dk, bk, rk, top_n, ef in itertools.product(
+                lexical, ints(args.dense_top_k), ints(args.bm25_top_k), ints(args.rrf_k), ints(args.rerank_top_n), hnsw
+            ):
+                grid.append({"mode": "hybrid", "lexical": lx, "dense_top_k": dk, "bm25_top_k": bk, "rrf_k": rk,
+                             "rerank_top_n": top_n, "hnsw_ef": ef})
+    return grid
+
+
+def _request(cfg: Dict[str, Any], query: str, top_k: int):
+    from app.schemas import SearchRequest, RetrievalConfig, RerankConfig
+
+    retrieval = {"mode": cfg["mode"], "hnsw_ef": cfg["hnsw_ef"]}
+    for k in ("lexical", "dense_top_k", "bm25_top_k", "rrf_k"):
+        if cfg[k] is not None:
+            retrieval[k] = cfg[k]
+    rerank = RerankConfig(enabled=True, top_n=cfg["rerank_top_n"]) if cfg["rerank_top_n"] else RerankConfig()
+    return SearchRequest(
+        query=query, top_k=top_k, retrieval=RetrievalConfig(**retrieval), rerank=rerank, include_payload=False
+    )
+
+
+def evaluate(cfg: Dict[str, Any], queries: List[Dict[str, Any]], top_k: int, repeat: int) -> Dict[str, Any]:
+    from app.main import _semantic_search
+    from app.deadline import Deadline
+
+    ks = sorted({1, 5, top_k})
+    hits = {k: 0 for k in ks}
+    rr_sum = 0.0
+    latencies: List[float] = []
+    candidates: List[int] = []
+    rerank_used = 0
+
+    for q in queries:
+        relevant = set(q["relevant_doc_ids"])
+        req = _request(cfg, q["query"], top_k)
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            resp = _semantic_search(req, Deadline(None))
+            latencies.append((time.perf_counter() - t0) * 1000)
+        candidates.append(resp.debug.candidates_n)
+        rerank_used += int(resp.debug.rerank_used)
+
+        ranked = [r.doc_id for r in resp.results]
+        first = next((i for i, d in enumerate(ranked, start=1) if d in relevant), None)
+        for k in ks:
+            hits[k] += int(first is not None and first <= k)
+        rr_sum += 1.0 / first if first else 0.0
+
+    latencies.sort()
+    n = max(1, len(queries))
+    return {
+        **cfg,
+        "candidates_avg": round(sum(candidates) / n, 1),
+        **{f"recall@{k}": round(hits[k] / n, 4) for k in ks},
+        f"mrr@{top_k}": round(rr_sum / n, 4),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "rerank_used_rate": round(rerank_used / n, 3),
+    }
+
+
+def mark_pareto(rows: List[Dict[str, Any]], quality: str):
+    """Pareto-optimal = no other row has >= quality and <= p95 with at least one strict."""
+    for r in rows:
+        r["pareto"] = not any(
+            o is not r
+            and o[quality] >= r[quality]
+            and o["p95_ms"] <= r["p95_ms"]
+            and (o[quality] > r[quality] or o["p95_ms"] < r["p95_ms"])
+            for o in rows
+        )
+
+
+def print_table(rows: List[Dict[str, Any]], top_k: int):
+    cols = ["pareto", "mode", "lexical", "dense_top_k", "bm25_top_k", "rrf_k", "rerank_top_n", "hnsw_ef",
+            "candidates_avg", "recall@1", "recall@5", f"recall@{top_k}", f"mrr@{top_k}", "p50_ms", "p95_ms"]
+    cols = list(dict.fromkeys(cols))
+    print("| " + " | ".join(cols) + " |")
+    print("|" + "---|" * len(cols))
+    for r in sorted(rows, key=lambda x: x["p95_ms"]):
+        cells = []
+        for c in cols:
+            v = r.get(c)
+            cells.append("*" if c == "pareto" and v else "" if v is None or v is False else str(v))
+        print("| " + " | ".join(cells) + " |")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--corpus", default=None, help="corpus.jsonl (default: synthetic)")
+    ap.add_argument("--queries-file", default=None, help="queries.jsonl (required with --corpus)")
+    ap.add_argument("--docs", type=int, default=200, help="synthetic corpus size")
+    ap.add_argument("--queries", type=int, default=200, help="synthetic query count")
+    ap.add_argument("--doc-words", type=int, default=400)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--qdrant-path", default=":memory:", help='embedded Qdrant; "" = use QDRANT_HOST/QDRANT_PORT server')
+    ap.add_argument("--collection", default="eval_chunks")
+    ap.add_argument("--fts-db", default=os.path.join(tempfile.gettempdir(), "idp_eval_fts.db"))
+    ap.add_argument("--no-reset", action="store_true", help="reuse an already ingested collection / FTS db")
+    ap.add_argument("--modes", default="dense,hybrid")
+    ap.add_argument("--dense-top-k", default="20,50,100")
+    ap.add_argument("--bm25-top-k", default="20,50,100")
+    ap.add_argument("--rrf-k", default="60")
+    ap.add_argument("--lexical", default="", help="hybrid lexical backends, e.g. sparse,fts (empty = HYBRID_LEXICAL)")
+    ap.add_argument("--rerank-top-n", default="0", help="0 = rerank off; e.g. 0,20,50")
+    ap.add_argument("--hnsw-ef", default="", help="query-time ef values, e.g. 64,128 (empty = collection default)")
+    ap.add_argument("--top-k", type=int, default=10)
+    ap.add_argument("--repeat", type=int, default=1, help="timed runs per query")
+    ap.add_argument("--quality", default=None, help="Pareto quality column (default recall@top_k)")
+    ap.add_argument("--out", default=None)
+    args = ap.parse_args(argv)
+
+    # app/ reads these at import time
+    os.environ["QDRANT_PATH"] = args.qdrant_path
+    os.environ["QDRANT_COLLECTION"] = args.collection
+    os.environ["FTS_DB_PATH"] = args.fts_db
+
+    if args.corpus:
+        if not args.queries_file:
+            ap.error("--corpus needs --queries-file")
+        corpus, queries = _load_jsonl(args.corpus), _load_jsonl(args.queries_file)
+    else:
+        corpus, queries = synth_corpus(args.docs, args.queries, args.doc_words, args.seed)
+    if not queries:
+        ap.error("no queries to evaluate")
+
+    ingest_info = {"skipped": True} if args.no_reset else ingest(corpus, args.collection, reset=True)
+    print(f"ingest: {ingest_info}", file=sys.stderr)
+
+    grid = build_grid(args)
+    if not os.getenv("RERANK_URL"):
+        skipped = [g for g in grid if g["rerank_top_n"]]
+        grid = [g for g in grid if not g["rerank_top_n"]]
+        if skipped:
+            print(f"RERANK_URL not set: skipping {len(skipped)} rerank grid points", file=sys.stderr)
+
+    # warm-up：embedding model load / first Qdrant call 不算進 latency
+    if grid:
+        evaluate(grid[0], queries[:10], args.top_k, 1)
+
+    rows = []
+    for i, cfg in enumerate(grid, start=1):
+        rows.append(evaluate(cfg, queries, args.top_k, args.repeat))
+        print(f"[{i}/{len(grid)}] {cfg}", file=sys.stderr)
+
+    quality = args.quality or f"recall@{args.top_k}"
+    mark_pareto(rows, quality)
+    print_table(rows, args.top_k)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(
+                {
+                    "meta": {
+                        **git_info(),
+                        "qdrant": args.qdrant_path or "server",
+                        "corpus": args.corpus or "synthetic",
+                        "queries": len(queries),
+                        "ingest": ingest_info,
+                        "top_k": args.top_k,
+                        "quality": quality,
+                    },
+                    "results": rows,
+                },
+                f,
+                indent=2,
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+Local stand-ins for the OCR / VLM / LLM (OpenAI-compatible) and rerank endpoints,
+with configurable latency distributions, so load tests do not hit shared GPUs.
+
+    uvicorn bench.stub_models:app --host 0.0.0.0 --port 9002
+
+Endpoints:
+    POST /ocr/v1/chat/completions   -> echoes the user text
+    POST /vlm/v1/chat/completions   -> echoes the user text (STUB_VLM_JSON=1: {"text": ...} + text)
+    POST /llm/v1/chat/completions   -> short answer citing the first [chunk_id] in the prompt
+    POST /rerank                    -> token-overlap scores (same as rerank_service.py)
+    GET  /stub/config               -> effective latency / error settings
+    chat completions honour "stream": true (SSE deltas, OpenAI chunk format)
+
+Latency spec (env STUB_<NAME>_LATENCY, fallback STUB_LATENCY), all values in ms:
+    fixed:200 | uniform:100:300 | normal:300:50 | lognormal:400:0.5 (median, sigma) | exp:300 (mean)
+Optional per route:
+    STUB_<NAME>_MS_PER_KCHAR  extra latency per 1000 prompt chars (prefill-like)
+    STUB_<NAME>_ERROR_RATE    probability of a 503
+    STUB_<NAME>_TAIL          "p:ms" -> with probability p add ms (latency spikes for p99)
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import re
+from typing import Any, Callable, Dict, List
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+app = FastAPI(title="IDP Model Stand-ins", version="0.1.0")
+
+ROUTES = ("ocr", "vlm", "llm", "rerank")
+STUB_VLM_JSON = os.getenv("STUB_VLM_JSON", "0") == "1"
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """Return a sampler (ms) for a latency spec like 'lognormal:400:0.5'."""
+    kind, *args = spec.strip().split(":")
+    a = [float(x) for x in args]
+    kind = kind.lower()
+    if kind == "fixed":
+        return lambda: a[0]
+    if kind == "uniform":
+        return lambda: random.uniform(a[0], a[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(a[0], a[1]))
+    if kind == "lognormal":
+        # median = exp(mu)
+        mu = math.log(max(a[0], 1e-3))
+        return lambda: random.lognormvariate(mu, a[1])
+    if kind == "exp":
+        return lambda: random.expovariate(1.0 / max(a[0], 1e-3))
+    raise ValueError(f"unknown latency spec: {spec}")
+
+
+def _route_config(name: str) -> Dict[str, Any]:
+    up = name.upper()
+    spec = os.getenv(f"STUB_{up}_LATENCY") or os.getenv("STUB_LATENCY", "lognormal:200:0.5")
+    tail = os.getenv(f"STUB_{up}_TAIL", "").strip()
+    tail_p, tail_ms = (float(x) for x in tail.split(":")) if tail else (0.0, 0.0)
+    return {
+        "latency": spec,
+        "sampler": parse_latency(spec),
+        "ms_per_kchar": float(os.getenv(f"STUB_{up}_MS_PER_KCHAR", "0")),
+        "error_rate": float(os.getenv(f"STUB_{up}_ERROR_RATE") or os.getenv("STUB_ERROR_RATE", "0")),
+        "tail_p": tail_p,
+        "tail_ms": tail_ms,
+    }
+
+
+CONFIG: Dict[str, Dict[str, Any]] = {name: _route_config(name) for name in ROUTES}
+
+
+def _sample_ms(name: str, prompt_chars: int) -> float:
+    cfg = CONFIG[name]
+    ms = cfg["sampler"]() + cfg["ms_per_kchar"] * prompt_chars / 1000.0
+    if cfg["tail_p"] and random.random() < cfg["tail_p"]:
+        ms += cfg["tail_ms"]
+    return ms
+
+
+def _maybe_fail(name: str):
+    if CONFIG[name]["error_rate"] and random.random() < CONFIG[name]["error_rate"]:
+        raise HTTPException(status_code=503, detail=f"stub {name}: injected error")
+
+
+async def _simulate(name: str, prompt_chars: int):
+    await asyncio.sleep(_sample_ms(name, prompt_chars) / 1000.0)
+    _maybe_fail(name)
+
+
+STREAM_TTFT_SHARE = 0.2  # stream=True：sampled latency 的 20% 當 time-to-first-token，其餘平均分給 delta
+STREAM_DELTA_CHARS = 16
+
+
+def _stream(name: str, body: Dict[str, Any], content: str, prompt_chars: int) -> StreamingResponse:
+    ms = _sample_ms(name, prompt_chars)
+    _maybe_fail(name)
+    deltas = [content[i : i + STREAM_DELTA_CHARS] for i in range(0, len(content), STREAM_DELTA_CHARS)] or [""]
+    per_delta = ms * (1 - STREAM_TTFT_SHARE) / 1000.0 / len(deltas)
+
+    async def gen():
+        await asyncio.sleep(ms * STREAM_TTFT_SHARE / 1000.0)
+        for d in deltas:
+            chunk = {"object": "chat.completion.chunk", "model": body.get("model", "stub"),
+                     "choices": [{"index": 0, "delta": {"content": d}}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(per_delta)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(gen(), media_type="text/event-stream")
+
+
+def _user_text(body: Dict[str, Any]) -> str:
+    msgs = body.get("messages") or []
+    for m in reversed(msgs):
+        if m.get("role") == "user":
+            content = m.get("content")
+            return content if isinstance(content, str) else str(content)
+    return ""
+
+
+def _completion(body: Dict[str, Any], content: str) -> Dict[str, Any]:
+    return {
+        "id": "stub",
+        "object": "chat.completion",
+        "model": body.get("model", "stub"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    }
+
+
+_CHUNK_ID_RE = re.compile(r"\[([0-9a-fA-F-]{36})\]")
+
+
+@app.post("/{name}/v1/chat/completions")
+async def chat_completions(name: str, request: Request):
+    if name not in ("ocr", "vlm", "llm"):
+        raise HTTPException(status_code=404, detail=f"unknown stub: {name}")
+    body = await request.json()
+    text = _user_text(body)
+
+    if name == "llm":
+        m = _CHUNK_ID_RE.search(text)
+        content = f"(stub answer) [{m.group(1)}]" if m else "(stub answer)"
+    elif name == "vlm" and STUB_VLM_JSON:
+        # structured reply: JSON object first, trailing prose after it (lets VLM_STREAM_CANCEL cut the stream)
+        content = json.dumps({"text": text}, ensure_ascii=False) + "\n\n" + text
+    else:
+        content = text
+
+    if body.get("stream"):
+        return _stream(name, body, content, len(text))
+    await _simulate(name, len(text))
+    return _completion(body, content)
+
+
+def _token_score(q: str, t: str) -> float:
+    q_tokens = set(re.findall(r"[A-Za-z0-9]+", q.lower()))
+    t_tokens = set(re.findall(r"[A-Za-z0-9]+", t.lower()))
+    if not q_tokens or not t_tokens:
+        return 0.0
+    return len(q_tokens & t_tokens) / (len(q_tokens) ** 0.5)
+
+
+@app.post("/rerank")
+async def rerank(request: Request):
+    body = await request.json()
+    query = body.get("query", "")
+    candidates: List[Dict[str, str]] = body.get("candidates") or []
+    await _simulate("rerank", sum(len(c.get("text", "")) for c in candidates))
+
+    scores = [{"id": c["id"], "score": _token_score(query, c.get("text", ""))} for c in candidates]
+    scores.sort(key=lambda x: x["score"], reverse=True)
+    return {"scores": scores, "latency_ms": 0}
+
+
+@app.get("/stub/config")
+def stub_config():
+    return {name: {k: v for k, v in cfg.items() if k != "sampler"} for name, cfg in CONFIG.items()}
@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis 跑 Lua script 需要
+rq = pytest.importorskip("rq")
+
+from app import admission  # noqa: E402
+from app.admission import AdmissionRejected, check_admission, take_token  # noqa: E402
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    monkeypatch.setattr(admission, "_scripts", {})
+    return fakeredis.FakeStrictRedis()
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    def configure(rate, burst):
+        monkeypatch.setattr(admission, "RATE_PER_SEC", rate)
+        monkeypatch.setattr(admission, "BURST", burst)
+
+    return configure
+
+
+def test_token_bucket_allows_burst_then_reports_wait(conn, bucket):
+    bucket(rate=2, burst=5)
+    assert [take_token(conn, "c1") for _ in range(5)] == [0.0] * 5
+    wait = take_token(conn, "c1")
+    assert 0.4 < wait <= 0.5  # 再 1 個 token 需要 1 / rate 秒
+    # 被拒不扣 token：馬上再試，等待時間不會變長
+    assert take_token(conn, "c1") <= wait
+
+
+def test_token_bucket_is_per_client(conn, bucket):
+    bucket(rate=1, burst=1)
+    assert take_token(conn, "c1") == 0.0
+    assert take_token(conn, "c1") > 0
+    assert take_token(conn, "c2") == 0.0
+
+
+def test_token_bucket_refills_at_rate(conn, bucket):
+    bucket(rate=50, burst=1)
+    assert take_token(conn, "c1") == 0.0
+    assert take_token(conn, "c1") > 0
+    time.sleep(0.05)
+    assert take_token(conn, "c1") == 0.0
+
+
+def test_token_bucket_key_expires_when_full_again(conn, bucket):
+    bucket(rate=1, burst=3)
+    take_token(conn, "c1")
+    assert 0 < conn.ttl("ratelimit:jobs:c1") <= 4
+
+
+def test_rate_zero_disables_limit(conn, bucket):
+    bucket(rate=0, burst=1)
+    assert all(take_token(conn, "c1") == 0.0 for _ in range(10))
+    assert not conn.exists("ratelimit:jobs:c1")
+
+
+def test_check_admission_rejects_rate_and_skips_token_when_pre_admitted(conn, bucket, monkeypatch):
+    bucket(rate=1, burst=1)
+    monkeypatch.setattr(admission, "MAX_QUEUE_DEPTH", 0)
+    q = rq.Queue("default", connection=conn)
+    assert check_admission(conn, q, "c1") == {"queue_depth": 0, "estimated_start_sec": 0.0}
+    with pytest.raises(AdmissionRejected) as e:
+        check_admission(conn, q, "c1")
+    assert e.value.reason == "rate limit exceeded" and e.value.retry_after_sec >= 1
+    # /v1/jobs:upload：token 已在讀 body 前扣過，建 job 時只檢查深度
+    assert check_admission(conn, q, "c1", rate_limit=False)["queue_depth"] == 0
+
+
+def test_check_admission_rejects_full_queue_with_retry_estimate(conn, bucket, monkeypatch):
+    bucket(rate=0, burst=1)
+    monkeypatch.setattr(admission, "MAX_QUEUE_DEPTH", 3)
+    monkeypatch.setattr(admission, "DEFAULT_JOB_SEC", 10.0)
+    q = rq.Queue("bulk", connection=conn)
+    for _ in range(4):
+        q.enqueue("os.getcwd")
+    with pytest.raises(AdmissionRejected) as e:
+        check_admission(conn, q, "c1", rate_limit=False)
+    assert e.value.reason == "queue is full"
+    assert e.value.info == {"queue": "bulk", "queue_depth": 4, "max_queue_depth": 3}
+    # 超出 2 個 job、沒有 throughput 紀錄、沒有 worker（當 1 個）-> 2 × DEFAULT_JOB_SEC
+    assert e.value.retry_after_sec == 20
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # sweep 的 claim 是 Lua script
+
+from app import blobstore, queue  # noqa: E402
+from app.queue import BLOB_EXPIRY_KEY, JOB_TTL_SEC, set_job_state, sweep_expired_blobs, touch_blobs  # noqa: E402
+
+DAY = 24 * 3600
+
+
+@pytest.fixture
+def conn(monkeypatch, tmp_path):
+    monkeypatch.setattr(blobstore, "BLOB_DIR", str(tmp_path))
+    monkeypatch.setattr(queue, "_scripts", {})
+    return fakeredis.FakeStrictRedis()
+
+
+def _big_result():
+    # chunks 超過 RESULT_OFFLOAD_MIN_BYTES -> 寫進 blob store
+    return {"payload": {"chunks": [{"i": i, "text": "x" * 200} for i in range(50)], "text": "short"}}
+
+
+def _expiry(conn, key):
+    return conn.zscore(BLOB_EXPIRY_KEY, key)
+
+
+def test_offloaded_result_blobs_follow_job_ttl(conn):
+    set_job_state(conn, "j1", "finished", result=_big_result())
+    (key,) = [k.decode() for k in conn.zrange(BLOB_EXPIRY_KEY, 0, -1)]
+    assert blobstore.exists(key)
+    assert _expiry(conn, key) == pytest.approx(time.time() + JOB_TTL_SEC["finished"], abs=5)
+
+
+def test_input_blob_extended_not_shortened(conn):
+    key = blobstore.put_bytes(b"%PDF- input")
+    touch_blobs(conn, [key], 60)
+    set_job_state(conn, "j1", "failed", blobs=[key])  # 7 天
+    long_expiry = _expiry(conn, key)
+    assert long_expiry == pytest.approx(time.time() + JOB_TTL_SEC["failed"], abs=5)
+    # 共用同一個 blob、TTL 較短的 job 不會把它縮短
+    set_job_state(conn, "j2", "finished", blobs=[key])
+    assert _expiry(conn, key) == long_expiry
+
+
+def test_sweep_deletes_only_expired_blobs(conn):
+    old = blobstore.put_bytes(b"old upload")
+    new = blobstore.put_bytes(b"new upload")
+    touch_blobs(conn, [old], 10)
+    touch_blobs(conn, [new], 2 * DAY)
+    assert sweep_expired_blobs(conn, now=time.time() + DAY) == 1
+    assert not blobstore.exists(old) and blobstore.exists(new)
+    assert _expiry(conn, old) is None and _expiry(conn, new) is not None
+
+
+def test_sweep_keeps_blob_extended_after_it_was_listed(conn, monkeypatch):
+    key = blobstore.put_bytes(b"shared")
+    touch_blobs(conn, [key], 10)
+    real_zrange = conn.zrangebyscore
+
+    def zrange_then_extend(*args, **kwargs):
+        listed = real_zrange(*args, **kwargs)
+        touch_blobs(conn, [key], 3 * DAY)  # 另一個 job 在 sweep 途中用到它
+        return listed
+
+    monkeypatch.setattr(conn, "zrangebyscore", zrange_then_extend)
+    assert sweep_expired_blobs(conn, now=time.time() + DAY) == 0
+    assert blobstore.exists(key)
+
+
+def test_zero_ttl_never_expires_and_sweep_respects_limit(conn):
+    forever = blobstore.put_bytes(b"forever")
+    touch_blobs(conn, [forever], 0)
+    keys = [blobstore.put_bytes(f"tmp {i}".encode()) for i in range(5)]
+    touch_blobs(conn, keys, 1)
+    later = time.time() + 10 * 365 * DAY
+    assert sweep_expired_blobs(conn, now=later, limit=2) == 2
+    assert sweep_expired_blobs(conn, now=later) == 3
+    assert blobstore.exists(forever)
+
+
+def test_sweep_drops_invalid_zset_members(conn):
+    conn.zadd(BLOB_EXPIRY_KEY, {"../not-a-key": 1})
+    assert sweep_expired_blobs(conn, now=time.time()) == 1
+    assert conn.zcard(BLOB_EXPIRY_KEY) == 0
@@ -0,0 +1,88 @@
+import types
+
+import pytest
+
+from app import deadline as deadline_mod
+from app.deadline import Deadline
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Deadline 讀的 time.perf_counter 換成可手動前進的時鐘（秒）。
+    測試只用 2 的冪次分之一秒的倍數（125 / 250 / 375 ms ...），浮點運算是精確的，remaining_ms 的 int() 不會差 1
+    """
+    now = {"t": 1000.0}
+    monkeypatch.setattr(deadline_mod, "time", types.SimpleNamespace(perf_counter=lambda: now["t"]))
+
+    def advance(ms: float):
+        now["t"] += ms / 1000.0
+
+    return advance
+
+
+@pytest.mark.parametrize("budget", [None, 0, -5])
+def test_unlimited_budget_never_constrains(clock, budget):
+    d = Deadline(budget)
+    clock(10_000_000)
+    assert not d.limited
+    assert d.budget_ms is None
+    assert d.remaining_ms() is None
+    assert d.allows(10**9)
+    assert d.cap_ms(1234, reserve_ms=1000) == 1234
+    child = d.child(0.3)
+    assert not child.limited
+    assert child.degradations is d.degradations
+
+
+def test_remaining_counts_down_and_floors_at_zero(clock):
+    d = Deadline(500)
+    assert d.remaining_ms() == 500
+    clock(125)
+    assert d.remaining_ms() == 375
+    clock(1000)
+    assert d.remaining_ms() == 0
+
+
+def test_allows_compares_remaining_with_phase_minimum(clock):
+    d = Deadline(500)
+    clock(250)
+    assert d.allows(250)
+    assert not d.allows(251)
+
+
+def test_cap_ms_is_default_capped_by_remaining_minus_reserve(clock):
+    d = Deadline(1000)
+    clock(375)
+    assert d.cap_ms(5000) == 625
+    assert d.cap_ms(100) == 100
+    assert d.cap_ms(5000, reserve_ms=25) == 600
+    assert d.cap_ms(5000, reserve_ms=700) == 0
+
+
+def test_child_takes_share_of_what_is_left_and_shares_degradations(clock):
+    parent = Deadline(2000)
+    clock(1000)
+    child = parent.child(0.3)
+    assert child.budget_ms == 300
+    child.degrade("rerank_skipped")
+    assert parent.degradations == ["rerank_skipped"]
+    # 剩 0 時 child 仍是有限的 budget（至少 1 ms），不會變成不限制
+    clock(5000)
+    assert parent.child(0.5).budget_ms == 1
+
+
+def test_degrade_keeps_first_occurrence_order():
+    d = Deadline(None)
+    for reason in ["fts_skipped", "rerank_skipped", "fts_skipped", "llm_context_reduced"]:
+        d.degrade(reason)
+    assert d.degradations == ["fts_skipped", "rerank_skipped", "llm_context_reduced"]
+
+
+def test_from_request_precedence(monkeypatch):
+    monkeypatch.setattr(deadline_mod, "DEFAULT_REQUEST_BUDGET_MS", 900)
+    assert Deadline.from_request(100, 200).budget_ms == 100
+    assert Deadline.from_request(None, 200).budget_ms == 200
+    assert Deadline.from_request(None, None).budget_ms == 900
+    monkeypatch.setattr(deadline_mod, "DEFAULT_REQUEST_BUDGET_MS", 0)
+    assert not Deadline.from_request(None, None).limited
@@ -0,0 +1,32 @@
+from app.clients import fts_client
+from app.indexing import fts_row
+
+
+def _chunk(chunk_id: str, text: str):
+    """/v1/reindex/fts 送進 bulk_upsert 的 row（content = text + metadata）"""
+    return fts_row(chunk_id, {"doc_id": "d", "chunk_index": 0, "text": text})
+
+
+def _rows(db_path):
+    conn = fts_client._connect(db_path)
+    try:
+        return [(r[0], r[1].split("\n")[0]) for r in conn.execute("SELECT chunk_id, content FROM chunks_fts ORDER BY chunk_id")]
+    finally:
+        conn.close()
+
+
+def test_bulk_upsert_replaces_existing_rows(tmp_path):
+    db = str(tmp_path / "fts.db")
+    fts_client.init_fts(db)
+    fts_client.bulk_upsert([_chunk("a", "alpha old"), _chunk("b", "beta")], db_path=db)
+    fts_client.bulk_upsert([_chunk("a", "alpha new")], db_path=db)
+    assert _rows(db) == [("a", "alpha new"), ("b", "beta")]
+    hits = fts_client.search_keyword("alpha", db_path=db)
+    assert [h["chunk_id"] for h in hits] == ["a"]
+
+
+def test_bulk_upsert_duplicate_ids_in_one_batch_keep_last(tmp_path):
+    db = str(tmp_path / "fts.db")
+    fts_client.init_fts(db)
+    fts_client.bulk_upsert([_chunk("a", "first"), _chunk("b", "beta"), _chunk("a", "second")], db_path=db)
+    assert _rows(db) == [("a", "second"), ("b", "beta")]
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from app.indexing import CHUNK_OVERLAP, CHUNK_SIZE, chunk_text, iter_batches, iter_chunks
+
+
+def _split(text: str, rng: random.Random):
+    """text 隨機切成多段（含空字串段），模擬逐頁送進 streaming pipeline"""
+    cuts = sorted(rng.randrange(len(text) + 1) for _ in range(rng.randrange(6)))
+    bounds = [0, *cuts, len(text)]
+    segments = [text[a:b] for a, b in zip(bounds, bounds[1:])]
+    if rng.random() < 0.3:
+        segments.insert(rng.randrange(len(segments) + 1), "")
+    return segments
+
+
+@pytest.mark.parametrize(
+    "length",
+    [0, 1, CHUNK_OVERLAP, CHUNK_SIZE - CHUNK_OVERLAP, CHUNK_SIZE - 1, CHUNK_SIZE, CHUNK_SIZE + 1, 2 * CHUNK_SIZE, 1234],
+)
+def test_iter_chunks_matches_chunk_text_at_boundaries(length):
+    text = "".join(chr(ord("a") + i % 26) for i in range(length))
+    assert list(iter_chunks([text])) == chunk_text(text)
+    # 一個字元一段：carry buffer 最極端的情況
+    assert list(iter_chunks(list(text))) == chunk_text(text)
+
+
+def test_iter_chunks_matches_chunk_text_for_random_segmentations():
+    rng = random.Random(44)
+    for _ in range(300):
+        text = "".join(rng.choice("ab 中文\n") for _ in range(rng.randrange(1500)))
+        size = rng.randrange(5, 400)
+        overlap = rng.randrange(0, size)
+        expected = chunk_text(text, size, overlap)
+        assert list(iter_chunks(_split(text, rng), size, overlap)) == expected
+
+
+def test_chunk_text_windows_overlap_and_cover_text():
+    text = "x" * 10 + "y" * 700
+    chunks = chunk_text(text)
+    assert [c["i"] for c in chunks] == list(range(len(chunks)))
+    step = CHUNK_SIZE - CHUNK_OVERLAP
+    for n, c in enumerate(chunks):
+        assert c["text"] == text[n * step : n * step + CHUNK_SIZE]
+    assert chunks[-1]["text"].endswith(text[-1])
+
+
+def test_iter_chunks_rejects_overlap_not_smaller_than_size():
+    with pytest.raises(ValueError):
+        list(iter_chunks(["abc"], chunk_size=10, overlap=10))
+
+
+def test_iter_batches_keeps_order_and_last_partial_batch():
+    assert list(iter_batches(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(iter_batches([], 3)) == []
@@ -0,0 +1,26 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.queue import get_job_state, get_job_states, set_job_state  # noqa: E402
+
+
+@pytest.fixture
+def conn():
+    return fakeredis.FakeStrictRedis()
+
+
+def test_error_from_retry_is_cleared_when_job_succeeds(conn):
+    set_job_state(conn, "j1", "retrying", error="boom")
+    assert get_job_states(conn, ["j1"], ("status", "error"))["j1"] == {"status": "retrying", "error": "boom"}
+    set_job_state(conn, "j1", "started")
+    set_job_state(conn, "j1", "finished", result={"payload": {"text": "ok"}})
+    state = get_job_states(conn, ["j1"], ("status", "error"))["j1"]
+    assert state["status"] == "finished"
+    assert state.get("error") is None
+
+
+def test_error_kept_for_failed_job(conn):
+    set_job_state(conn, "j2", "started")
+    set_job_state(conn, "j2", "failed", error="final")
+    assert get_job_state(conn, "j2")["error"] == "final"
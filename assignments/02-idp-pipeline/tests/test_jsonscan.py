@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from app.jsonscan import JsonObjectScanner, extract_json_obj
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('{"a": 1}', {"a": 1}),
+        ('```json\n{"caption": "invoice", "total": 12.5}\n```', {"caption": "invoice", "total": 12.5}),
+        ('Here is the result: {"k": [1, {"n": null}]} hope it helps', {"k": [1, {"n": None}]}),
+        # prose braces before the real object are skipped
+        ('see {like this} and then {"k": "v"}', {"k": "v"}),
+        # braces and escaped quotes inside strings do not change depth
+        ('{"a": "}{", "b": "say \\"}\\" twice"}', {"a": "}{", "b": 'say "}" twice'}),
+        ('{"outer": {"inner": {"x": 1}}, "y": 2} {"second": true}', {"outer": {"inner": {"x": 1}}, "y": 2}),
+    ],
+)
+def test_extract_json_obj_finds_first_object(text, expected):
+    assert extract_json_obj(text) == expected
+    assert JsonObjectScanner().feed(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "no json here", '{"a": 1', "[1, 2, 3]", "{not: json}"])
+def test_extract_json_obj_returns_none_without_complete_object(text):
+    assert extract_json_obj(text) is None
+
+
+def test_scanner_returns_object_as_soon_as_it_closes():
+    text = 'thinking... {"caption": "a {curly} cat", "tags": ["x", "y"]} trailing text that never matters'
+    close = text.index("]}") + 2
+    scanner = JsonObjectScanner()
+    for i, ch in enumerate(text):
+        got = scanner.feed(ch)
+        if i + 1 < close:
+            assert got is None, f"object reported early at {i}"
+        else:
+            assert got == {"caption": "a {curly} cat", "tags": ["x", "y"]}
+    assert scanner.done
+
+
+def test_scanner_escape_split_across_chunks():
+    scanner = JsonObjectScanner()
+    assert scanner.feed('{"a": "x\\') is None
+    assert scanner.feed('"y"}') == {"a": 'x"y'}
+
+
+def test_scanner_ignores_chunks_after_result():
+    scanner = JsonObjectScanner()
+    first = scanner.feed('{"a": 1}')
+    assert scanner.feed('{"b": 2}') is first
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_streamed_chunks_match_whole_text(size):
+    payload = {"text": 'quote " brace } backslash \\ 中文', "n": [1, 2, {"deep": {}}]}
+    text = "prefix {broken} " + json.dumps(payload, ensure_ascii=False) + " suffix"
+    scanner = JsonObjectScanner()
+    got = None
+    for start in range(0, len(text), size):
+        got = scanner.feed(text[start : start + size])
+    assert got == payload == extract_json_obj(text)
@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("prometheus_client")
+
+from prometheus_client import multiprocess  # noqa: E402
+from prometheus_client.mmap_dict import MmapedDict, mmap_key  # noqa: E402
+
+from app import metrics  # noqa: E402
+
+
+def _dead_pid() -> int:
+    p = subprocess.Popen([sys.executable, "-c", ""])
+    p.wait()
+    return p.pid
+
+
+def _write(path, typ, pid, samples):
+    d = MmapedDict(os.path.join(path, f"{typ}_{pid}.db"))
+    try:
+        for name, labels, value in samples:
+            metric = name.rsplit("_", 1)[0] if typ == "histogram" else name[: -len("_total")]
+            d.write_value(mmap_key(metric, name, list(labels), list(labels.values()), "doc"), value, 0.0)
+    finally:
+        d.close()
+
+
+def _horse(path, pid, jobs, seconds):
+    _write(path, "counter", pid, [("idp_jobs_total", {"route": "ocr"}, jobs)])
+    _write(path, "histogram", pid, [
+        ("idp_stage_seconds_bucket", {"le": "1.0"}, jobs),
+        ("idp_stage_seconds_bucket", {"le": "+Inf"}, jobs),
+        ("idp_stage_seconds_sum", {}, seconds),
+    ])
+
+
+def _scrape(path):
+    samples = {}
+    for m in multiprocess.MultiProcessCollector(None, path=path).collect():
+        for s in m.samples:
+            samples[(s.name, tuple(sorted(s.labels.items())))] = s.value
+    return samples
+
+
+def test_compaction_merges_dead_pids_without_changing_the_scrape(tmp_path):
+    path = str(tmp_path)
+    dead = [_dead_pid(), _dead_pid()]
+    _horse(path, dead[0], 2, 1.5)
+    _horse(path, dead[1], 3, 0.5)
+    _horse(path, os.getpid(), 1, 0.25)  # 還活著：不動
+    before = _scrape(path)
+
+    assert metrics.compact_dead_pid_files(path) == 4
+    assert sorted(os.listdir(path)) == sorted([
+        "counter_compacted.db", "histogram_compacted.db", f"counter_{os.getpid()}.db", f"histogram_{os.getpid()}.db",
+    ])
+    assert _scrape(path) == before
+    assert before[("idp_jobs_total", (("route", "ocr"),))] == 6
+
+    # 下一輪：新的 dead pid 加進既有的 compacted 檔
+    _horse(path, _dead_pid(), 4, 1.0)
+    assert metrics.compact_dead_pid_files(path) == 2
+    assert _scrape(path)[("idp_jobs_total", (("route", "ocr"),))] == 10
+
+
+def test_compaction_without_dir_is_noop():
+    assert metrics.compact_dead_pid_files("") == 0
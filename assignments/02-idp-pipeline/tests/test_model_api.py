@@ -0,0 +1,70 @@
+import io
+import json
+import threading
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+requests = pytest.importorskip("requests")
+
+from app import resilience  # noqa: E402
+from app.clients import model_api  # noqa: E402
+
+
+def _sse(*deltas: str) -> bytes:
+    lines = [f"data: {json.dumps({'choices': [{'delta': {'content': d}}]}, ensure_ascii=False)}\n\n" for d in deltas]
+    return ("".join(lines) + "data: [DONE]\n\n").encode("utf-8")
+
+
+class _BlockingRaw:
+    """一直不送資料的 stream（模擬還在 prefill 的 replica），close() 才結束"""
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def read(self, *_args, **_kwargs):
+        self.closed.wait(5)
+        return b""
+
+    def close(self):
+        self.closed.set()
+
+
+def _response(raw) -> requests.Response:
+    r = requests.Response()
+    r.status_code = 200
+    r.headers["Content-Type"] = "text/event-stream"  # 沒有 charset
+    r.encoding = requests.utils.get_encoding_from_headers(r.headers)  # 同 HTTPAdapter：text/* -> ISO-8859-1
+    r.raw = raw
+    return r
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    r = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(resilience, "redis_conn", r)
+    monkeypatch.setattr(resilience, "_breakers", {})
+    return r
+
+
+def test_stream_decodes_utf8_without_charset(conn, monkeypatch):
+    monkeypatch.setattr(model_api.requests, "post", lambda *a, **kw: _response(io.BytesIO(_sse("發票", "金額"))))
+    content, obj, meta = model_api._stream_chat(["http://a"], {}, target="vlm", cancel_on_json=False)
+    assert content == "發票金額"
+    assert obj is None and meta["deltas"] == 2
+
+
+def test_hedged_stream_closes_the_losing_connection(conn, monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_TARGETS", {"vlm"})
+    monkeypatch.setattr(resilience, "HEDGE_DEFAULT_DELAY_MS", 50)
+    slow = _BlockingRaw()
+
+    def post(url, **_kwargs):
+        if url == "http://slow":
+            return _response(slow)
+        return _response(io.BytesIO(_sse('{"total": ', "1}")))
+
+    monkeypatch.setattr(model_api.requests, "post", post)
+    content, obj, meta = model_api._stream_chat(["http://slow", "http://fast"], {}, target="vlm")
+    assert obj == {"total": 1} and meta["cancelled"]
+    assert slow.closed.is_set()
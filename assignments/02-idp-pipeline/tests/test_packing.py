@@ -0,0 +1,156 @@
+import pytest
+
+from app.indexing import chunk_text
+from app.packing import MIN_TAIL_TOKENS, approx_tokens, gap_indices, overlap_len, pack_context, render_blocks
+
+
+def _doc(doc_id: str, text: str):
+    """chunk_text 切好的 hit（chunk_id = doc:index）"""
+    return [
+        {"chunk_id": f"{doc_id}:{c['i']}", "doc_id": doc_id, "chunk_index": c["i"], "text": c["text"]}
+        for c in chunk_text(text)
+    ]
+
+
+LONG = "".join(f"sentence {i:03d} of the report. " for i in range(60))  # ~1700 chars -> 7 chunks
+
+
+def test_approx_tokens_counts_cjk_per_char_and_latin_per_four_chars():
+    assert approx_tokens("") == 0
+    assert approx_tokens("abcd") == 1
+    assert approx_tokens("abcde") == 2
+    assert approx_tokens("中文字") == 3
+    assert approx_tokens("中文ab") == 3
+
+
+def test_overlap_len():
+    assert overlap_len("hello world", "world peace") == 5
+    assert overlap_len("abc", "xyz") == 0
+    a, b = _doc("d", LONG)[:2]
+    assert overlap_len(a["text"], b["text"]) == 50
+
+
+def test_gap_indices_only_fills_small_gaps_within_a_doc():
+    hits = [
+        {"doc_id": "a", "chunk_index": 1},
+        {"doc_id": "a", "chunk_index": 3},
+        {"doc_id": "a", "chunk_index": 9},
+        {"doc_id": "b", "chunk_index": 0},
+        {"doc_id": "b", "chunk_index": 1},
+        {"doc_id": None, "chunk_index": 5},
+    ]
+    assert gap_indices(hits, 0) == {}
+    assert gap_indices(hits, 1) == {"a": [2]}
+    assert gap_indices(hits, 5) == {"a": [2, 4, 5, 6, 7, 8]}
+
+
+def test_adjacent_chunks_merge_back_into_original_text():
+    hits = _doc("d", LONG)
+    out = pack_context(list(reversed(hits)), max_tokens=10_000)
+    assert len(out["blocks"]) == 1
+    block = out["blocks"][0]
+    assert block["text"] == LONG
+    assert block["chunk_ids"] == [h["chunk_id"] for h in hits]
+    assert (block["first_index"], block["last_index"]) == (0, len(hits) - 1)
+    assert out["stats"]["overlap_chars_removed"] == 50 * (len(hits) - 1)
+    assert not out["stats"]["truncated"]
+
+
+def test_blocks_are_ordered_by_best_rank():
+    a, b = _doc("a", LONG), _doc("b", LONG)
+    hits = [b[4], a[0], a[1], b[5]]
+    out = pack_context(hits, max_tokens=10_000)
+    assert [blk["doc_id"] for blk in out["blocks"]] == ["b", "a"]
+    assert out["blocks"][0]["chunk_ids"] == ["b:4", "b:5"]
+
+
+def test_gap_fill_uses_one_fetch_and_bridges_blocks():
+    chunks = _doc("d", LONG)
+    calls = []
+
+    def fetch(wanted):
+        calls.append(wanted)
+        return [chunks[i] for i in wanted["d"]] + [chunks[0]]  # 已經有的 chunk 不重複加入
+
+    out = pack_context([chunks[0], chunks[3]], max_tokens=10_000, max_gap=2, fetch=fetch)
+    assert calls == [{"d": [1, 2]}]
+    assert out["stats"]["gap_filled"] == 2
+    assert [b["chunk_ids"] for b in out["blocks"]] == [["d:0", "d:1", "d:2", "d:3"]]
+    assert out["blocks"][0]["text"] == LONG[: 3 * 250 + 300]  # chunk 0..3，step = 300 - 50
+
+
+def test_gap_fill_not_attempted_without_max_gap():
+    chunks = _doc("d", LONG)
+
+    def fetch(wanted):
+        raise AssertionError("fetch must not be called")
+
+    out = pack_context([chunks[0], chunks[3]], max_tokens=10_000, fetch=fetch)
+    assert [b["chunk_ids"] for b in out["blocks"]] == [["d:0"], ["d:3"]]
+
+
+def test_budget_truncates_last_block_and_stops():
+    a, b = _doc("a", LONG), _doc("b", LONG)
+    first_tokens = pack_context([a[0]], max_tokens=10_000)["stats"]["tokens"]
+    budget = first_tokens + MIN_TAIL_TOKENS + 10
+    out = pack_context([a[0], b[0], b[2]], max_tokens=budget)
+    assert out["stats"]["truncated"]
+    assert out["stats"]["tokens"] <= budget
+    assert [blk["doc_id"] for blk in out["blocks"]] == ["a", "b"]
+    tail = out["blocks"][1]
+    assert b[0]["text"].startswith(tail["text"]) and len(tail["text"]) < len(b[0]["text"])
+
+
+def test_budget_drops_tail_shorter_than_minimum():
+    a, b = _doc("a", LONG), _doc("b", LONG)
+    first_tokens = pack_context([a[0]], max_tokens=10_000)["stats"]["tokens"]
+    out = pack_context([a[0], b[0]], max_tokens=first_tokens + 5)
+    assert [blk["doc_id"] for blk in out["blocks"]] == ["a"]
+    assert out["stats"]["truncated"]
+
+
+def test_standalone_duplicate_and_blank_hits():
+    d = _doc("d", LONG)
+    hits = [
+        {"chunk_id": "x", "doc_id": None, "chunk_index": None, "text": "free text"},
+        d[0],
+        d[0],
+        {"chunk_id": "blank", "doc_id": "d", "chunk_index": 5, "text": "   "},
+    ]
+    out = pack_context(hits, max_tokens=10_000)
+    assert [b["chunk_ids"] for b in out["blocks"]] == [["x"], ["d:0"]]
+    assert out["stats"]["chunks_in"] == 4
+    assert out["stats"]["chunks_used"] == 2
+
+
+def test_render_blocks_lists_every_chunk_id():
+    out = pack_context(_doc("d", LONG)[:2], max_tokens=10_000)
+    rendered = render_blocks(out["blocks"])
+    assert rendered.startswith("[d:0][d:1]\n")
+    assert out["blocks"][0]["text"].strip() in rendered
+
+
+@pytest.mark.parametrize("max_tokens", [0, 5])
+def test_tiny_budget_returns_nothing(max_tokens):
+    out = pack_context(_doc("d", LONG)[:1], max_tokens=max_tokens)
+    assert out["blocks"] == [] and out["stats"]["truncated"]
+
+
+CJK = "".join(f"第{i:03d}段：本報告說明文件處理流程與檢索結果。" for i in range(120))  # ~2400 chars
+
+
+def test_char_cap_alone_does_not_shrink_cjk_context():
+    hits = _doc("zh", CJK)
+    out = pack_context(hits, max_chars=4000)
+    assert not out["stats"]["truncated"]
+    assert out["blocks"][0]["text"] == CJK
+    # 同樣的文字若以 4000 // 4 token 為預算會被截斷（CJK 1 字 ≈ 1 token）
+    assert pack_context(hits, max_tokens=4000 // 4)["stats"]["truncated"]
+
+
+def test_char_cap_truncates_cjk_at_max_chars():
+    out = pack_context(_doc("zh", CJK), max_chars=1000)
+    assert out["stats"]["truncated"]
+    assert out["stats"]["chars"] <= 1000
+    assert len(render_blocks(out["blocks"])) <= 1000
+    assert CJK.startswith(out["blocks"][0]["text"])
@@ -0,0 +1,73 @@
+import pytest
+
+pytest.importorskip("qdrant_client")
+
+from qdrant_client import QdrantClient  # noqa: E402
+from qdrant_client.http.exceptions import UnexpectedResponse  # noqa: E402
+from qdrant_client.http.models import PointStruct  # noqa: E402
+
+from app.clients import qdrant_client as qc  # noqa: E402
+
+pytestmark = pytest.mark.filterwarnings("ignore:Payload indexes have no effect")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(qc, "_ensured_collections", set())
+    monkeypatch.setattr(qc, "_sparse_collections", {})
+    return QdrantClient(location=":memory:")
+
+
+def _upsert(client, point_id=1):
+    return lambda: qc.upsert_points(client, "docs", [PointStruct(id=point_id, vector={"": [0.1, 0.2, 0.3, 0.4]})])
+
+
+def _404():
+    return UnexpectedResponse(404, "Not Found", b"", None)
+
+
+@pytest.mark.parametrize(
+    "exc, missing",
+    [
+        (_404(), True),
+        (UnexpectedResponse(400, "Bad Request", b"", None), False),
+        (ValueError("Collection docs not found"), True),
+        (ValueError("bad vector"), False),
+    ],
+)
+def test_is_missing_collection(exc, missing):
+    assert qc.is_missing_collection(exc) is missing
+
+
+def test_write_recreates_collection_deleted_behind_the_cache(client):
+    qc.ensure_and_write(client, "docs", 4, _upsert(client, 1))
+    assert "docs" in qc._ensured_collections
+
+    client.delete_collection("docs")  # 另一個 process 刪掉；本 process 的 cache 還說它在
+    qc.ensure_and_write(client, "docs", 4, _upsert(client, 2))
+    assert client.count("docs").count == 1
+    assert "docs" in qc._ensured_collections
+
+
+def test_missing_collection_on_query_clears_the_cache(client):
+    qc.ensure_collection(client, "docs", 4)
+    assert qc.collection_has_sparse(client, "docs")
+    client.delete_collection("docs")
+    with pytest.raises(ValueError):
+        qc.search_points(client, "docs", [0.1, 0.2, 0.3, 0.4])
+    assert "docs" not in qc._ensured_collections and "docs" not in qc._sparse_collections
+
+
+def test_missing_collection_is_not_treated_as_rejected_rrf(client, monkeypatch):
+    monkeypatch.setattr(qc, "_rrf_k_unsupported", False)
+    calls = []
+
+    def query_points(**kwargs):
+        calls.append(kwargs["query"])
+        raise _404()
+
+    monkeypatch.setattr(client, "query_points", query_points)
+    with pytest.raises(UnexpectedResponse):
+        qc.hybrid_query(client, "docs", [0.1] * 4, ([1], [1.0]), dense_limit=5, sparse_limit=5, limit=5, rrf_k=60)
+    assert len(calls) == 1  # 沒有再試一次預設 RRF
+    assert qc.rrf_k_supported()
@@ -0,0 +1,93 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+requests = pytest.importorskip("requests")
+
+from app import resilience  # noqa: E402
+from app.resilience import CircuitOpenError, call_with_resilience, get_breaker, is_endpoint_failure  # noqa: E402
+
+
+def _http_error(status):
+    resp = requests.Response()
+    resp.status_code = status
+    return requests.HTTPError(f"{status}", response=resp)
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    r = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(resilience, "redis_conn", r)
+    monkeypatch.setattr(resilience, "_breakers", {})
+    return r
+
+
+def _call(fn, name="vlm"):
+    return call_with_resilience(name, ["http://a"], lambda url: fn())
+
+
+def _raise(exc):
+    def fn():
+        raise exc
+
+    return fn
+
+
+@pytest.mark.parametrize(
+    "exc, counted",
+    [
+        (requests.Timeout(), True),
+        (requests.ConnectionError(), True),
+        (TimeoutError(), True),
+        (_http_error(503), True),
+        (_http_error(500), True),
+        (_http_error(400), False),
+        (_http_error(429), False),
+        (ValueError("bad json"), False),
+    ],
+)
+def test_only_endpoint_failures_count(exc, counted):
+    assert is_endpoint_failure(exc) is counted
+
+
+def test_client_errors_do_not_open_the_breaker(conn):
+    for _ in range(10):
+        with pytest.raises(requests.HTTPError):
+            _call(_raise(_http_error(422)))
+    assert get_breaker("vlm").snapshot()["state"] == "closed"
+    assert not conn.exists("cb:vlm")
+
+
+def test_consecutive_endpoint_failures_open_and_fail_fast(conn):
+    for _ in range(resilience.CB_FAILURE_THRESHOLD):
+        with pytest.raises(requests.Timeout):
+            _call(_raise(requests.Timeout()))
+    assert get_breaker("vlm").snapshot()["state"] == "open"
+    with pytest.raises(CircuitOpenError):
+        _call(lambda: pytest.fail("must not be called while open"))
+
+
+def test_success_resets_failures_but_clean_success_does_not_write(conn, monkeypatch):
+    with pytest.raises(requests.ConnectionError):
+        _call(_raise(requests.ConnectionError()))
+    assert get_breaker("vlm").snapshot()["failures"] == 1
+    assert _call(lambda: "ok") == "ok"
+    assert not conn.exists("cb:vlm")
+
+    deletes = []
+    monkeypatch.setattr(conn, "delete", lambda *keys: deletes.append(keys))
+    for _ in range(5):
+        _call(lambda: "ok")
+    assert deletes == []
+
+
+def test_half_open_probe_released_by_client_error(conn, monkeypatch):
+    for _ in range(resilience.CB_FAILURE_THRESHOLD):
+        with pytest.raises(requests.Timeout):
+            _call(_raise(requests.Timeout()))
+    br = get_breaker("vlm")
+    monkeypatch.setattr(br, "reset_sec", 0)
+    # probe 回 4xx：endpoint 是活的 -> closed，不會卡在 probe lock 上
+    with pytest.raises(requests.HTTPError):
+        _call(_raise(_http_error(400)))
+    assert br.snapshot()["state"] == "closed"
+    assert not conn.exists("cb:vlm:probe")
@@ -0,0 +1,225 @@
+import threading
+import time
+
+import pytest
+
+from app import singleflight
+from app.singleflight import request_key
+
+
+class FakeRedis:
+    """single-flight 用到的指令：SET NX PX / GET / EXISTS / pipeline / release script"""
+
+    def __init__(self):
+        self.data = {}  # key -> (value, expires_at or None)
+        self.lock = threading.Lock()
+
+    def _live(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and time.monotonic() >= expires:
+            del self.data[key]
+            return None
+        return value
+
+    def set(self, key, value, nx=False, px=None):
+        with self.lock:
+            if nx and self._live(key) is not None:
+                return None
+            self.data[key] = (value.encode() if isinstance(value, str) else value,
+                              time.monotonic() + px / 1000.0 if px else None)
+            return True
+
+    def get(self, key):
+        with self.lock:
+            return self._live(key)
+
+    def exists(self, key):
+        return int(self.get(key) is not None)
+
+    def pipeline(self, transaction=False):
+        redis, ops = self, []
+
+        class Pipe:
+            def get(self, key):
+                ops.append(lambda: redis.get(key))
+
+            def exists(self, key):
+                ops.append(lambda: redis.exists(key))
+
+            def execute(self):
+                return [op() for op in ops]
+
+        return Pipe()
+
+    def register_script(self, lua):
+        def release(keys, args):
+            with self.lock:
+                if self._live(keys[0]) == args[0].encode():
+                    del self.data[keys[0]]
+                    return 1
+                return 0
+
+        return release
+
+
+@pytest.fixture
+def local_only(monkeypatch):
+    monkeypatch.setattr(singleflight, "SINGLEFLIGHT_ENABLED", True)
+    monkeypatch.setattr(singleflight, "SINGLEFLIGHT_REDIS", False)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    r = FakeRedis()
+    monkeypatch.setattr(singleflight, "SINGLEFLIGHT_ENABLED", True)
+    monkeypatch.setattr(singleflight, "SINGLEFLIGHT_REDIS", True)
+    monkeypatch.setattr(singleflight, "SINGLEFLIGHT_POLL_MS", 1)
+    monkeypatch.setattr(singleflight, "_redis", lambda: r)
+    monkeypatch.setattr(singleflight, "_scripts", {})
+    return r
+
+
+def _do(key, fn, **kw):
+    return singleflight.do("search", key, fn, dumps=str, loads=lambda s: s, **kw)
+
+
+def _run_concurrently(n, key, fn, **kw):
+    """n 個 thread 同時呼叫 do()；回傳依完成順序的 (result, coalesced) 或 exception"""
+    out, barrier = [], threading.Barrier(n)
+
+    def call():
+        barrier.wait()
+        try:
+            out.append(_do(key, fn, **kw))
+        except Exception as e:
+            out.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(n)]
+    for t in threads:
+        t.start()
+    return threads, out
+
+
+def test_request_key_is_canonical():
+    a = request_key("search", {"query": "q", "top_k": 5, "filters": {"b": 1, "a": 2}})
+    b = request_key("search", {"filters": {"a": 2, "b": 1}, "top_k": 5, "query": "q"})
+    assert a == b and a.startswith("search:")
+    assert a != request_key("search", {"query": "q", "top_k": 6, "filters": {"a": 2, "b": 1}})
+    assert a != request_key("answer", {"query": "q", "top_k": 5, "filters": {"b": 1, "a": 2}})
+
+
+def test_concurrent_callers_share_one_execution(local_only):
+    calls, release = [], threading.Event()
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    threads, out = _run_concurrently(8, "k1", fn)
+    time.sleep(0.1)  # 讓 follower 都等在 leader 的 Future 上
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1
+    assert [r for r, _ in out] == ["result"] * 8
+    assert sorted(c for _, c in out) == [False] + [True] * 7
+
+
+def test_leader_exception_reaches_every_follower(local_only):
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    threads, out = _run_concurrently(5, "k2", fn)
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(out) == 5 and all(isinstance(e, RuntimeError) for e in out)
+    assert singleflight._inflight == {}
+
+
+def test_unshareable_result_is_recomputed_by_followers(local_only):
+    calls, release = [], threading.Event()
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "degraded" if len(calls) == 1 else "full"
+
+    threads, out = _run_concurrently(4, "k3", fn, shareable=lambda r: r != "degraded")
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 4
+    assert all(c is False for _, c in out)
+    assert sorted(r for r, _ in out) == ["degraded", "full", "full", "full"]
+
+
+def test_follower_stops_waiting_after_wait_s(local_only):
+    release = threading.Event()
+    leader = threading.Thread(target=lambda: _do("k4", lambda: release.wait(5) and "slow"))
+    leader.start()
+    time.sleep(0.05)
+    t0 = time.monotonic()
+    assert _do("k4", lambda: "own", wait_s=0.05) == ("own", False)
+    assert time.monotonic() - t0 < 1
+    release.set()
+    leader.join(5)
+
+
+def test_disabled_always_calls_fn(monkeypatch):
+    monkeypatch.setattr(singleflight, "SINGLEFLIGHT_ENABLED", False)
+    calls = []
+    for _ in range(3):
+        assert _do("k5", lambda: calls.append(1) or "r") == ("r", False)
+    assert len(calls) == 3
+
+
+def test_distributed_leader_publishes_result_and_releases_lock(fake_redis):
+    assert _do("k6", lambda: "value") == ("value", False)
+    assert fake_redis.get("sf:result:k6") == b"value"
+    assert fake_redis.get("sf:lock:k6") is None
+
+
+def test_distributed_leader_keeps_unshareable_result_private(fake_redis):
+    assert _do("k7", lambda: "degraded", shareable=lambda r: False) == ("degraded", False)
+    assert fake_redis.get("sf:result:k7") is None
+
+
+def test_distributed_follower_takes_other_replicas_result(fake_redis):
+    fake_redis.set("sf:lock:k8", "other-replica", px=5000)
+
+    def publish():
+        time.sleep(0.05)
+        fake_redis.set("sf:result:k8", "from-leader", px=2000)
+
+    threading.Thread(target=publish).start()
+    assert _do("k8", lambda: pytest.fail("follower must not compute")) == ("from-leader", True)
+
+
+def test_distributed_follower_rejects_unshareable_published_result(fake_redis):
+    fake_redis.set("sf:lock:k9", "other-replica", px=5000)
+    fake_redis.set("sf:result:k9", "degraded", px=2000)
+    assert _do("k9", lambda: "own", shareable=lambda r: r != "degraded") == ("own", False)
+
+
+def test_distributed_follower_computes_when_leader_dies(fake_redis):
+    # lock 過期但沒有結果 = leader 掛了
+    fake_redis.set("sf:lock:k10", "dead-replica", px=30)
+    assert _do("k10", lambda: "own") == ("own", False)
+
+
+def test_redis_failure_falls_back_to_fn(fake_redis, monkeypatch):
+    def broken():
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(singleflight, "_redis", broken)
+    assert _do("k11", lambda: "own") == ("own", False)
@@ -0,0 +1,124 @@
+import zlib
+
+import pytest
+from qdrant_client.http.models import FusionQuery, SparseVector
+
+from app.clients import qdrant_client as qc
+from app.sparse import BM25_AVGDL, BM25_B, BM25_K1, SPARSE_VECTOR_NAME, doc_vector, query_vector, term_index, tokenize
+
+
+def test_tokenize_latin_words_and_cjk_bigrams():
+    assert tokenize("Invoice_No. 12-AB") == ["invoice", "no", "12", "ab"]
+    assert tokenize("GPU加速ABC") == ["gpu", "加速", "abc"]
+    assert tokenize("發票號碼") == ["發票", "票號", "號碼"]
+    assert tokenize("中 文") == ["中", "文"]
+    assert tokenize("한국어 テスト") == ["한국", "국어", "テス", "スト"]
+    assert tokenize("") == [] and tokenize(None) == []
+
+
+def test_term_index_is_stable_crc32():
+    assert term_index("invoice") == zlib.crc32(b"invoice")
+    assert term_index("發票") == zlib.crc32("發票".encode("utf-8"))
+
+
+def _weights(text):
+    indices, values = doc_vector(text)
+    assert indices == sorted(indices)
+    return dict(zip(indices, values))
+
+
+def test_doc_vector_matches_bm25_tf_component():
+    text = "total total amount"
+    dl = 3
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * dl / BM25_AVGDL)
+    w = _weights(text)
+    assert w[term_index("total")] == pytest.approx(2 * (BM25_K1 + 1) / (2 + norm), abs=1e-6)
+    assert w[term_index("amount")] == pytest.approx(1 * (BM25_K1 + 1) / (1 + norm), abs=1e-6)
+
+
+def test_doc_vector_saturates_and_normalises_length():
+    one = _weights("alpha")[term_index("alpha")]
+    many = _weights("alpha " * 50)[term_index("alpha")]
+    assert one < many < BM25_K1 + 1
+    # 同樣 tf，文件越長權重越低
+    short = _weights("alpha beta")[term_index("alpha")]
+    long = _weights("alpha " + " ".join(f"w{i}" for i in range(200)))[term_index("alpha")]
+    assert long < short
+
+
+def test_empty_vectors():
+    assert doc_vector("") == ([], [])
+    assert doc_vector(" ,.;") == ([], [])
+    assert query_vector("!!!") == ([], [])
+
+
+def test_query_vector_is_binary_and_deduplicated():
+    indices, values = query_vector("Total total AMOUNT")
+    assert indices == sorted({term_index("total"), term_index("amount")})
+    assert values == [1.0, 1.0]
+
+
+# ----------------------------
+# hybrid_query：prefetch 組法與舊 server 的 RRF fallback
+# ----------------------------
+class _Points:
+    def __init__(self, points):
+        self.points = points
+
+
+class FakeQdrant:
+    def __init__(self, reject_rrf_k=False, status=400):
+        self.reject_rrf_k, self.status, self.calls = reject_rrf_k, status, []
+
+    def query_points(self, **kw):
+        self.calls.append(kw)
+        if self.reject_rrf_k and not isinstance(kw["query"], FusionQuery):
+            err = Exception("unknown variant `rrf`")
+            err.status_code = self.status
+            raise err
+        return _Points(["p1", "p2"])
+
+
+@pytest.fixture(autouse=True)
+def _reset_rrf_support(monkeypatch):
+    monkeypatch.setattr(qc, "_rrf_k_unsupported", False)
+
+
+def _hybrid(client, sparse=([1, 2], [1.0, 1.0]), rrf_k=60):
+    fn = getattr(qc.hybrid_query, "__wrapped__", qc.hybrid_query)
+    return fn(client, "c", [0.1, 0.2], sparse, dense_limit=40, sparse_limit=30, limit=5, rrf_k=rrf_k)
+
+
+def test_hybrid_query_prefetches_dense_and_sparse():
+    client = FakeQdrant()
+    assert _hybrid(client) == ["p1", "p2"]
+    (call,) = client.calls
+    dense, sparse = call["prefetch"]
+    assert (dense.limit, dense.using) == (40, None)
+    assert (sparse.limit, sparse.using) == (30, SPARSE_VECTOR_NAME)
+    assert sparse.query == SparseVector(indices=[1, 2], values=[1.0, 1.0])
+    assert call["query"].rrf.k == 60 and call["limit"] == 5
+
+
+def test_hybrid_query_without_lexical_tokens_runs_dense_only():
+    client = FakeQdrant()
+    _hybrid(client, sparse=([], []), rrf_k=None)
+    (call,) = client.calls
+    assert len(call["prefetch"]) == 1
+    assert isinstance(call["query"], FusionQuery)
+
+
+def test_rejected_rrf_k_falls_back_once_and_is_remembered():
+    client = FakeQdrant(reject_rrf_k=True)
+    assert _hybrid(client) == ["p1", "p2"]
+    assert [type(c["query"]).__name__ for c in client.calls] == ["RrfQuery", "FusionQuery"]
+    assert not qc.rrf_k_supported()
+    _hybrid(client)
+    assert isinstance(client.calls[-1]["query"], FusionQuery) and len(client.calls) == 3
+
+
+def test_server_errors_are_not_treated_as_missing_rrf_support():
+    client = FakeQdrant(reject_rrf_k=True, status=503)
+    with pytest.raises(Exception, match="unknown variant"):
+        _hybrid(client)
+    assert qc.rrf_k_supported()
@@ -0,0 +1,66 @@
+from collections import Counter
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+rq = pytest.importorskip("rq")
+
+from app.worker import WeightedWorker  # noqa: E402
+
+WEIGHTS = {"interactive": 6, "default": 3, "bulk": 1}
+
+
+@pytest.fixture
+def conn():
+    return fakeredis.FakeStrictRedis()
+
+
+def _worker(conn, jobs):
+    """jobs: {queue name: 要先放進去的 job 數}"""
+    queues = {name: rq.Queue(name, connection=conn) for name in WEIGHTS}
+    for name, n in jobs.items():
+        for _ in range(n):
+            queues[name].enqueue("os.getcwd")
+    return WeightedWorker(list(WEIGHTS), connection=conn, weights=WEIGHTS), queues
+
+
+def _drain(worker, n):
+    """照 RQ 的 work loop 取 n 個 job（dequeue_job_and_maintain_ttl 會呼叫 reorder_queues）"""
+    served = []
+    for _ in range(n):
+        _job, queue = worker.dequeue_job_and_maintain_ttl(timeout=1)
+        served.append(queue.name)
+    return served
+
+
+def test_all_busy_follows_weights_in_every_round(conn):
+    worker, _ = _worker(conn, {name: 40 for name in WEIGHTS})
+    served = _drain(worker, 30)
+    for start in range(0, 30, 10):
+        assert Counter(served[start : start + 10]) == WEIGHTS
+    # smooth：bulk 不會一開始就等滿一整輪，interactive 也不會連續拿 6 次
+    assert "iii" not in "".join(name[0] for name in served)
+
+
+def test_empty_queue_in_front_is_not_charged(conn):
+    worker, _ = _worker(conn, {"default": 5})
+    assert worker._ordered_queues[0].name == "interactive"
+    before = worker._credit["interactive"]
+    assert _drain(worker, 1) == ["default"]
+    assert worker._credit["interactive"] == before
+
+
+def test_idle_queue_does_not_hoard_credit_or_skew_the_rest(conn):
+    worker, _ = _worker(conn, {"default": 60, "bulk": 60})
+    served = _drain(worker, 48)
+    assert "interactive" not in served
+    assert worker._credit["interactive"] <= sum(WEIGHTS.values())
+    # 過渡期之後 default : bulk 回到 3 : 1
+    assert Counter(served[-24:]) == {"default": 18, "bulk": 6}
+
+
+def test_idle_queue_is_served_first_when_work_arrives(conn):
+    worker, queues = _worker(conn, {"default": 20, "bulk": 20})
+    _drain(worker, 10)
+    queues["interactive"].enqueue("os.getcwd")
+    assert _drain(worker, 1) == ["interactive"]